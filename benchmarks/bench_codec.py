@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the queue message codec against the json messages it replaces.
+
+Usage:
+    python benchmarks/bench_codec.py [iterations]
+"""
+import json
+import sys
+
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scrapers"))
+
+from codec import decode, encode
+from extractor import extract_listing
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def json_encode(message: dict) -> bytes:
+    """The encoding as it was done in Scraper.publish before the codec"""
+    return json.dumps(message).encode()
+
+
+def json_decode(raw: bytes) -> dict:
+    """The decoding as it was done in the writer before the codec"""
+    return json.loads(raw.decode())
+
+
+def bench(function, argument, iterations: int) -> float:
+    """Returns the number of messages per second"""
+    start = perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return iterations / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    codecs = [
+        ("json", json_encode, json_decode),
+        ("msgpack", encode, decode),
+        ("msgpack-zstd", lambda message: encode(message, compress=True), decode),
+    ]
+
+    print(f"{'fixture':<28}{'codec':<14}{'bytes':>8}{'encode msg/s':>14}{'decode msg/s':>14}")
+    for fixture in sorted(FIXTURES.glob("detail_*.html")):
+        message = {
+            "funda_id": "43859373",
+            "url": "https://www.funda.nl/detail/koop/tilburg/appartement-de-fabrikant-type-c1-bouwnr-28/43859373/",
+            "scraped_at": datetime(2025, 8, 1, 12, 0).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        extract_listing(fixture.read_text(), message)
+
+        for name, encoder, decoder in codecs:
+            raw = encoder(message)
+            if decoder(raw) != message:
+                raise AssertionError(f"{name} does not round trip {fixture.name}")
+
+            encoded = bench(encoder, message, iterations)
+            decoded = bench(decoder, raw, iterations)
+            print(f"{fixture.name:<28}{name:<14}{len(raw):>8}{encoded:>14.0f}{decoded:>14.0f}")
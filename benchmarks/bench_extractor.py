@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of the listing extractor against the original per-element re-parsing code.
+
+Usage:
+    python benchmarks/bench_extractor.py [iterations]
+"""
+import sys
+
+from pathlib import Path
+from parsel import Selector
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scrapers"))
+
+from extractor import extract_listing
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def legacy_extract(content: str, info: dict) -> dict:
+    """The extraction as it was done in Scraper.scrape before the compiled extractor"""
+    selector = Selector(text = content)
+
+    about_box = selector.css("div#about")
+
+    info["Titel"] = about_box.css("h1 span::text").get()
+    info["Postcode"] = about_box.css("span.text-neutral-40::text").get()
+    info["Buurt"] = about_box.css("a.ml-2.text-secondary-70::text").get()
+
+    purchase_history = selector.css("section.mt-6.border-b.border-neutral-20 dl div").getall()
+    for element in purchase_history:
+        key = Selector(element).css("dt::text").get()
+        value = Selector(element).css("dd::text").get()
+        if key:
+            info[key] = value
+
+    features = selector.css("section#features div dl").getall()
+    for element in features:
+        key = Selector(element).css("dt::text").get()
+        value = Selector(element).css("dd span::text").get()
+        if key:
+            info[key] = value
+
+    return info
+
+
+def bench(function, content: str, iterations: int) -> float:
+    """Returns the number of pages per second"""
+    start = perf_counter()
+    for _ in range(iterations):
+        function(content, {})
+    return iterations / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    print(f"{'fixture':<28}{'legacy pages/s':>16}{'compiled pages/s':>18}{'speedup':>10}")
+    for fixture in sorted(FIXTURES.glob("detail_*.html")):
+        content = fixture.read_text()
+
+        if legacy_extract(content, {}) != extract_listing(content, {}):
+            raise AssertionError(f"Extractors disagree on {fixture.name}")
+
+        legacy = bench(legacy_extract, content, iterations)
+        compiled = bench(extract_listing, content, iterations)
+        print(f"{fixture.name:<28}{legacy:>16.1f}{compiled:>18.1f}{compiled / legacy:>9.1f}x")
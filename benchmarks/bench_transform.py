@@ -0,0 +1,189 @@
+"""
+Micro-benchmark of the writer transforms and validation against the original per-message code.
+
+Usage:
+    python benchmarks/bench_transform.py [messages]
+"""
+import re
+import sys
+
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from random import Random
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scrapers"))
+
+from extractor import extract_listing
+from schema import validate_listing
+from transform import split_postcode_city, transform
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+DUTCH_MONTHS = ["januari", "februari", "maart", "april", "mei", "juni", "juli",
+                "augustus", "september", "oktober", "november", "december"]
+
+
+def legacy_reduce_to_int(string: str) -> int:
+    return int("".join([element for element in string if element in "0123456789"]))
+
+
+def legacy_parse_rooms(text: str):
+    total_match = re.search(r"(\d+)\s+kamers?", text)
+    total_rooms = int(total_match.group(1)) if total_match else None
+    bedroom_match = re.search(r"\((\d+)\s+slaapkamers?\)", text)
+    bedrooms = int(bedroom_match.group(1)) if bedroom_match else None
+    return (total_rooms, bedrooms)
+
+
+def legacy_to_date(date_str: str) -> date:
+    months = {
+        "januari": 1, "februari": 2, "maart": 3, "april": 4, "mei": 5, "juni": 6, "juli": 7,
+        "augustus": 8, "september": 9, "oktober": 10, "november": 11, "december": 12,
+    }
+    parts = date_str.lower().split()
+    if len(parts) != 3:
+        raise ValueError(f"Invalid date format: {date_str}")
+    day = int(parts[0])
+    month = months.get(parts[1])
+    year = int(parts[2])
+    if not month:
+        raise ValueError(f"Unknown Dutch month: {parts[1]}")
+    return date(year, month, day)
+
+
+def legacy_transform(message: dict) -> dict:
+    """The transform as it was done in the writer before the precompiled tables"""
+    result = {}
+    result["funda_id"] = message["funda_id"]
+    result["url"] = message["url"]
+    result["scraped_at"] = message["scraped_at"]
+
+    if "Aantal kamers" in message:
+        total, bedrooms = legacy_parse_rooms(message["Aantal kamers"])
+        result["total_rooms"] = total
+        result["bedrooms"] = bedrooms
+
+    postcode, city = split_postcode_city(message["Postcode"])
+    result["postcode"] = postcode
+    result["city"] = city
+
+    field_map = {
+        "Titel": "title",
+        "Laatste vraagprijs": "last_asking_price",
+        "Gebruiksoppervlakten": "surface_area",
+        "Soort appartement": "listing_type",
+        "Soort woonhuis": "listing_type",
+        "Verkoopdatum": "sell_date",
+        "Aangeboden sinds": "offer_since",
+        "Buurt": "neighborhood",
+        "Energielabel": "energy_label",
+        "Bouwjaar": "building_year"
+    }
+
+    for src, dst in field_map.items():
+        if src not in message:
+            continue
+        value = message[src]
+        if dst in ["last_asking_price", "surface_area"]:
+            result[dst] = legacy_reduce_to_int(value)
+        elif dst in ["sell_date", "offer_since"]:
+            result[dst] = legacy_to_date(value)
+        elif dst == "building_year":
+            try:
+                result[dst] = date(int(value), 1, 1)
+            except ValueError:
+                result[dst] = None
+        else:
+            result[dst] = value
+
+    if result.get("building_year") is None:
+        result["building_year"] = None
+
+    if result.get("sell_date") and result.get("offer_since"):
+        result["sell_duration"] = result["sell_date"] - result["offer_since"]
+
+    used_keys = set(field_map.keys()) | {
+        "Aantal kamers", "funda_id", "url", "scraped_at", "Postcode", "postcode", "Looptijd", "city"
+    }
+
+    result["scraped_at"] = datetime.strptime(result["scraped_at"], "%Y-%m-%d %H:%M:%S")
+
+    result["misc_data"] = {
+        k: v for k, v in message.items() if k not in used_keys
+    }
+    return result
+
+
+LEGACY_REQUIRED_OUTPUT = {
+    "funda_id": str, "title": str, "last_asking_price": int, "surface_area": int, "total_rooms": int,
+    "listing_type": str, "sell_date": date, "offer_since": date, "sell_duration": timedelta, "city": str,
+    "postcode": str, "neighborhood": str, "energy_label": str, "building_year": (date, type(None)),
+    "scraped_at": datetime, "url": str, "misc_data": dict,
+}
+LEGACY_OPTIONAL_OUTPUT = {"bedrooms": (int, type(None))}
+
+
+def legacy_validate_output(listing: dict) -> bool:
+    """The output validation as it was done in the writer before the compiled schema"""
+    for field, expected_type in LEGACY_REQUIRED_OUTPUT.items():
+        if field not in listing or not isinstance(listing[field], expected_type):
+            return False
+    for field, expected_type in LEGACY_OPTIONAL_OUTPUT.items():
+        if field in listing and not isinstance(listing[field], expected_type):
+            return False
+    return True
+
+
+def dutch_date(day: date) -> str:
+    return f"{day.day} {DUTCH_MONTHS[day.month - 1]} {day.year}"
+
+
+def make_messages(count: int) -> list[dict]:
+    """Listings based on the fixtures, with prices and dates spread like a few years of sales"""
+    pages = [extract_listing(fixture.read_text()) for fixture in sorted(FIXTURES.glob("detail_*.html"))]
+    random = Random(42)
+    messages = []
+    for i in range(count):
+        sold = date(2022, 1, 1) + timedelta(days=random.randrange(3 * 365))
+        message = {
+            "funda_id": str(40000000 + i),
+            "url": f"https://www.funda.nl/detail/koop/tilburg/huis/{40000000 + i}/",
+            "scraped_at": f"2025-08-01 12:{i // 60 % 60:02d}:{i % 60:02d}",
+            **pages[i % len(pages)],
+        }
+        message["Laatste vraagprijs"] = f"€ {random.randrange(150, 900) * 1000:,} kosten koper".replace(",", ".")
+        message["Verkoopdatum"] = dutch_date(sold)
+        message["Aangeboden sinds"] = dutch_date(sold - timedelta(days=random.randrange(7, 180)))
+        messages.append(message)
+    return messages
+
+
+def bench(function, messages: list) -> float:
+    """Returns the number of messages per second"""
+    start = perf_counter()
+    for message in messages:
+        function(message)
+    return len(messages) / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = make_messages(count)
+
+    expected = [legacy_transform(message) for message in messages]
+    if [transform(message) for message in messages] != expected:
+        raise AssertionError("Transforms disagree")
+    if not all(legacy_validate_output(listing) and validate_listing(listing) is None for listing in expected):
+        raise AssertionError("Validators disagree")
+
+    legacy = bench(legacy_transform, messages)
+    fast = bench(transform, messages)
+    print(f"{'transform':<32}{'messages/s':>12}{'speedup':>10}")
+    print(f"{'legacy':<32}{legacy:>12.0f}{1:>9.1f}x")
+    print(f"{'precompiled':<32}{fast:>12.0f}{fast / legacy:>9.1f}x")
+
+    legacy = bench(legacy_validate_output, expected)
+    compiled = bench(validate_listing, expected)
+    print(f"\n{'validation':<32}{'listings/s':>12}{'speedup':>10}")
+    print(f"{'legacy':<32}{legacy:>12.0f}{1:>9.1f}x")
+    print(f"{'compiled schema':<32}{compiled:>12.0f}{compiled / legacy:>9.1f}x")
@@ -0,0 +1,314 @@
+"""
+Offline benchmark of the whole crawl -> scrape -> write pipeline.
+
+Serves search result pages and the saved detail pages in `benchmarks/fixtures` from a local
+stand-in for funda, runs a crawler, scrapers and a writer as separate processes against it, and
+reports listings per second, per-stage latency percentiles, CPU and RSS per stage and the queue
+depths over time. The results are written as json to compare them across commits.
+
+By default redis and postgres are faked (fakeredis over TCP and a postgres connection that accepts
+and drops the writes). With --real, the REDIS_* and POSTGRES_* settings of the environment are used:
+REDIS_DB is flushed and the benchmark listings are deleted from the listings table before the run.
+
+Usage:
+    python benchmarks/pipeline.py [--regions 2] [--pages 5] [--per-page 15] [--scrapers 1] [--real] [--output FILE]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import psutil
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter, sleep
+from urllib.parse import parse_qs, urlparse
+
+SCRAPERS = Path(__file__).resolve().parents[1] / "scrapers"
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+sys.path.insert(0, str(SCRAPERS))
+
+# removes everything between the queues, so the stages only wait on each other
+UNTHROTTLED = {
+    "CRAWLER_RATE_START": 1e6, "CRAWLER_RATE_MAX": 1e6,
+    "SCRAPER_RATE_START": 1e6, "SCRAPER_RATE_MAX": 1e6,
+}
+
+
+def listing_id(region: int, page: int, position: int) -> str:
+    return f"bench-{region:02d}{page:04d}{position:03d}"
+
+
+class FundaStandIn(BaseHTTPRequestHandler):
+    """Serves generated search result pages, the saved detail pages and accepts metric pushes"""
+    regions = []
+    pages = 0
+    per_page = 0
+    details = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/zoeken/"):
+            query = parse_qs(url.query)
+            region = json.loads(query["selected_area"][0])[0]
+            page = int(query["search_result"][0])
+            self.respond(self.search_page(region, page))
+        elif url.path.startswith("/detail/"):
+            self.respond(self.details[hash(url.path) % len(self.details)])
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def search_page(self, region: str, page: int) -> str:
+        links = ""
+        if region in self.regions and page <= self.pages:
+            index = self.regions.index(region)
+            links = "".join(
+                f'<a href="/detail/koop/{region}/huis-benchmark/{listing_id(index, page, position)}/">listing</a>'
+                for position in range(self.per_page)
+            )
+        return f'<html><head><title>Koophuizen in {region}</title></head><body><div class="flex flex-col gap-3 mt-4">{links}</div></body></html>'
+
+    def respond(self, content: str):
+        body = content.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        # the prometheus pushgateway
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.end_headers()
+
+    do_POST = do_PUT
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCopy:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def set_types(self, types):
+        pass
+
+    def write_row(self, row):
+        self.cursor.rowcount += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeCursor:
+    """Accepts the statements of the crawler and the writer, nothing is ever stored"""
+    def __init__(self):
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        # keep the number of copied rows as the rowcount of the merge that follows
+        pass
+
+    def fetchall(self):
+        return []
+
+    def copy(self, statement):
+        self.rowcount = 0
+        return FakeCopy(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def timed(r, stage: str, function, count=None):
+    """Records the latency of every call of the function, and optionally the number of listings it handled"""
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            r.rpush(f"bench:latency:{stage}", perf_counter() - start)
+        if count:
+            r.incrby(f"bench:{stage}", count(args, result))
+        return result
+    return wrapper
+
+
+def run_stage(stage: str, regions: list[str], pages: int, fake_postgres: bool):
+    """Entry point of a stage process"""
+    import config
+    for name, value in UNTHROTTLED.items():
+        setattr(config, name, value)
+    if fake_postgres:
+        import psycopg
+        psycopg.connect = FakeConnection
+
+    if stage == "crawler":
+        import crawler
+        crawler.Crawler.crawl_page = timed(crawler.r, stage, crawler.Crawler.crawl_page, lambda args, result: result[0])
+        crawler.Crawler(regions, pages).crawl_links()
+    elif stage == "scraper":
+        import scraper
+        scraper.Scraper.scrape = timed(scraper.r, stage, scraper.Scraper.scrape)
+        scraper.Scraper().listen()
+    elif stage == "writer":
+        import writer
+        writer.Writer.flush = timed(writer.r, stage, writer.Writer.flush, lambda args, result: len(args[1]))
+        writer.Writer().listen()
+
+
+def percentiles(latencies: list[float]) -> dict:
+    if len(latencies) < 2:
+        return {"count": len(latencies), "max": max(latencies, default=None)}
+    cuts = quantiles(latencies, n=100, method="inclusive")
+    return {"count": len(latencies), "p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": max(latencies)}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SCRAPERS, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--regions", type=int, default=2, help="number of regions to crawl")
+    parser.add_argument("--pages", type=int, default=5, help="search result pages per region")
+    parser.add_argument("--per-page", type=int, default=15, help="listings per search result page")
+    parser.add_argument("--scrapers", type=int, default=1, help="number of scraper processes")
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between samples of the queues and processes")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before giving up")
+    parser.add_argument("--real", action="store_true", help="use the redis and postgres of the environment instead of fakes")
+    parser.add_argument("--output", default=None, help="json file to write the results to (default: stdout only)")
+    args = parser.parse_args()
+
+    # the stand-in for funda, which also accepts the metric pushes
+    regions = [f"region-{i}" for i in range(args.regions)]
+    FundaStandIn.regions = regions
+    FundaStandIn.pages = args.pages
+    FundaStandIn.per_page = args.per_page
+    FundaStandIn.details = [fixture.read_text() for fixture in sorted(FIXTURES.glob("detail_*.html"))]
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FundaStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    os.environ.update({"FUNDA_BASE_URL": base_url, "PUSHGATEWAY_URL": base_url, "FETCHER_BACKEND": "http"})
+    if not args.real:
+        from fakeredis import TcpFakeServer
+        redis_server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        # the connections of this process stay open until it exits, their threads must not keep it alive
+        redis_server.daemon_threads = True
+        threading.Thread(target=redis_server.serve_forever, daemon=True).start()
+        os.environ.update({"REDIS_HOST": "127.0.0.1", "REDIS_PORT": str(redis_server.server_address[1]), "REDIS_DB": "0", "REDIS_PASSWORD": ""})
+
+    import redis
+    from dotenv import load_dotenv
+    load_dotenv()
+    r = redis.Redis(
+        host=os.getenv("REDIS_HOST"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD") or None
+    )
+    r.flushdb()
+    if args.real:
+        import psycopg
+        with psycopg.connect(f"host={os.getenv('POSTGRES_HOST')} dbname={os.getenv('POSTGRES_DB')} "
+                             f"user={os.getenv('POSTGRES_USER')} password={os.getenv('POSTGRES_PASSWORD')}") as conn:
+            conn.execute("DELETE FROM listings WHERE funda_id LIKE 'bench-%'")
+
+    from queues import make_queue
+    transport = os.getenv("QUEUE_TRANSPORT", "list")
+    queues = {name: make_queue(r, name, "benchmark", transport) for name in ("listing_queue", "data_queue")}
+
+    # spawn, so every stage imports its module with the environment set up above
+    context = multiprocessing.get_context("spawn")
+    stages = [("crawler", "crawler")] + [(f"scraper-{i}", "scraper") for i in range(args.scrapers)] + [("writer", "writer")]
+    processes = {
+        name: context.Process(target=run_stage, args=(stage, regions, args.pages, not args.real), name=name)
+        for name, stage in stages
+    }
+
+    expected = args.regions * args.pages * args.per_page
+    samples = []
+    usage = {}
+    start = perf_counter()
+    for process in processes.values():
+        process.start()
+    watched = {name: psutil.Process(process.pid) for name, process in processes.items()}
+
+    try:
+        while perf_counter() - start < args.timeout:
+            sleep(args.interval)
+            written = int(r.get("bench:writer") or 0)
+            samples.append({
+                "seconds": perf_counter() - start,
+                "written": written,
+                **{name: queue.lag() for name, queue in queues.items()},
+            })
+            for name, process in watched.items():
+                try:
+                    cpu, memory = process.cpu_times(), process.memory_info()
+                except psutil.NoSuchProcess:
+                    continue
+                stats = usage.setdefault(name, {"cpu_seconds": 0, "max_rss_bytes": 0})
+                stats["cpu_seconds"] = cpu.user + cpu.system
+                stats["max_rss_bytes"] = max(stats["max_rss_bytes"], memory.rss)
+
+            if written >= expected:
+                break
+        else:
+            print(f"Timed out after {args.timeout} seconds with {written} of {expected} listings written", file=sys.stderr)
+    finally:
+        elapsed = perf_counter() - start
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+    latencies = {stage: percentiles([float(x) for x in r.lrange(f"bench:latency:{stage}", 0, -1)])
+                 for stage in ("crawler", "scraper", "writer")}
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "settings": {**vars(args), "queue_transport": transport, "message_codec": os.getenv("MESSAGE_CODEC", "json")},
+        "listings": written,
+        "seconds": elapsed,
+        "listings_per_second": written / elapsed,
+        "latency_seconds": latencies,
+        "processes": usage,
+        "queue_depth": samples,
+    }
+
+    print(json.dumps({key: value for key, value in results.items() if key != "queue_depth"}, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
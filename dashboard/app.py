@@ -1,77 +1,46 @@
 import streamlit as st
-import psycopg
 import pandas as pd
 from dotenv import load_dotenv
-import os
 import plotly.express as px
 
-load_dotenv()
+from charts import DENSITY, SAMPLE, scatter
+from data import (ENERGY_LABELS, PRICE_BUCKET, SELL_DAYS_BUCKET, Filters, get_histogram, get_listings, get_rollup,
+                  get_sell_months, histogram_quantile)
 
-@st.cache_data(ttl=600)
-def get_listings():
-    conn = psycopg.connect(
-        host=os.getenv("POSTGRES_HOST", "localhost"),
-        port=5432,
-        dbname=os.getenv("POSTGRES_DB"),
-        user=os.getenv("POSTGRES_USER"),
-        password=os.getenv("POSTGRES_PASSWORD")
-    )
-    query = """
-        SELECT
-            last_asking_price,
-            surface_area,
-            bedrooms,
-            listing_type,
-            sell_date,
-            neighborhood,
-            offer_since,
-            sell_duration,
-            city,
-            energy_label
-        FROM listings
-        WHERE last_asking_price IS NOT NULL
-          AND surface_area IS NOT NULL
-          AND sell_duration IS NOT NULL
-          AND sell_date IS NOT NULL
-          AND offer_since IS NOT NULL
-          AND city IS NOT NULL
-          AND energy_label IS NOT NULL
-          AND city IN ('Amsterdam', 'Rotterdam', 'Den', 'Groningen', 'Tilburg', 'Eindhoven', 'Utrecht')
-        LIMIT 100000;
-    """
-    df = pd.read_sql(query, conn)
-    conn.close()
-
-    # Convert times & durations
-    df['sell_duration_seconds'] = df['sell_duration'].apply(lambda x: x.total_seconds())
-    df['sell_duration_days'] = df['sell_duration_seconds'] / (60 * 60 * 24)
-    df['offer_since'] = pd.to_datetime(df['offer_since'])
-    df['sell_date'] = pd.to_datetime(df['sell_date'])
-
-    # Month grouping
-    df['sell_month'] = df['sell_date'].dt.to_period('M').dt.to_timestamp()
-    return df
-
-df = get_listings()
+load_dotenv()
 
 # Sidebar city selector
 st.sidebar.title("Selecteer Stad")
 city_selected = st.sidebar.selectbox("Kies een stad:", ["Alle", "Tilburg", "Eindhoven", "Utrecht", "Den", "Amsterdam", "Groningen", "Rotterdam"])
 
-if city_selected != "Alle":
-    df_filtered = df[df['city'].str.lower() == city_selected.lower()]
-else:
-    df_filtered = df
+# Sidebar sell date range, the charts from the rollups include the whole first and last month
+sell_months = get_sell_months().iloc[0]
+sold = ()
+if sell_months['first'] is not None:
+    sold = st.sidebar.date_input("Verkocht tussen:", (sell_months['first'], (sell_months['last'] + pd.offsets.MonthEnd(0)).date()))
+# while picking a range, the date input only has its start
+filters = Filters(None if city_selected == "Alle" else city_selected, *(sold if len(sold) == 2 else ()))
+
+# Sidebar rendering of scatter plots with too many points to draw them all
+large_scatter = st.sidebar.radio("Grote puntenwolken als:", [DENSITY, SAMPLE])
+
+# raw rows, only used by the scatter plots. The frames are cached and shared by all sessions, so they are never changed here
+df_filtered = get_listings(('surface_area', 'last_asking_price', 'city', 'listing_type', 'bedrooms', 'sell_duration_days'), filters)
 
 st.title("Woonitor")
 
+# charts other than the scatter plots come from the rollups
+if city_selected == "Alle":
+    monthly = get_rollup(('sell_month', 'city'), filters)
+else:
+    monthly = get_rollup(('sell_month',), filters)
+
 # 1. Price trends over time
+price_trends = monthly
 if city_selected == "Alle":
-    price_trends = df.groupby(['sell_month', 'city'])['last_asking_price'].mean().reset_index()
     fig1 = px.line(price_trends, x='sell_month', y='last_asking_price', color='city',
                    title='Gemiddelde Vraagprijs door de Tijd')
 else:
-    price_trends = df_filtered.groupby('sell_month')['last_asking_price'].mean().reset_index()
     fig1 = px.line(price_trends, x='sell_month', y='last_asking_price',
                    title='Gemiddelde Vraagprijs over tijd')
 
@@ -80,12 +49,11 @@ fig1.update_layout(xaxis_title="Verkoopmaand", yaxis_title="Gemiddelde Vraagprij
 st.plotly_chart(fig1, use_container_width=True)
 
 # sell time over time
+sell_duration_trends = monthly
 if city_selected == "Alle":
-    sell_duration_trends = df.groupby(['sell_month', 'city'])['sell_duration_days'].mean().reset_index()
     fig_sell_duration = px.line(sell_duration_trends, x='sell_month', y='sell_duration_days', color='city',
                                title='Gemiddelde Verkooptijd over tijd (Dagen)')
 else:
-    sell_duration_trends = df_filtered.groupby('sell_month')['sell_duration_days'].mean().reset_index()
     fig_sell_duration = px.line(sell_duration_trends, x='sell_month', y='sell_duration_days',
                                title='Gemiddelde Verkooptijd over tijd (Dagen)')
 
@@ -95,37 +63,46 @@ st.plotly_chart(fig_sell_duration, use_container_width=True)
 
 
 # 2. Average price per city
-city_prices = df.groupby('city')['last_asking_price'].mean().sort_values(ascending=False).reset_index()
+city_prices = get_rollup(('city',), filters._replace(city=None)).sort_values('last_asking_price', ascending=False)
+price_histograms = get_histogram('price_histogram', filters._replace(city=None))
+medians = price_histograms.groupby('city', observed=True)['listings'].agg(
+    lambda counts: histogram_quantile(counts.to_numpy(), PRICE_BUCKET, 0.5))
+city_prices = city_prices.assign(median_asking_price=city_prices['city'].map(medians).astype(float))
 fig_city = px.bar(city_prices, x='city', y='last_asking_price',
                   title='Gemiddelde Vraagprijs per Stad',
-                  labels={'city': 'Stad', 'last_asking_price': 'Gemiddelde Vraagprijs (€)'},
+                  labels={'city': 'Stad', 'last_asking_price': 'Gemiddelde Vraagprijs (€)',
+                          'median_asking_price': 'Mediaan Vraagprijs (€)'},
+                  hover_data={'median_asking_price': ':,.0f'},
                   color='city')
 fig_city.update_layout(xaxis_title="Stad", yaxis_title="Gemiddelde Vraagprijs (€)")
 st.plotly_chart(fig_city, use_container_width=True)
 
 # 3. Price vs surface area
-fig2 = px.scatter(df_filtered, x='surface_area', y='last_asking_price', color='city',
-                  title='Vraagprijs vs woonoppervlak',
-                  labels={'surface_area': 'Oppervlakte (m²)', 'last_asking_price': 'Vraagprijs (€)'},
-                  hover_data=['listing_type', 'bedrooms'])
+fig2, fig2_caption = scatter(df_filtered, 'surface_area', 'last_asking_price', large_scatter, color='city',
+                             title='Vraagprijs vs woonoppervlak',
+                             labels={'surface_area': 'Oppervlakte (m²)', 'last_asking_price': 'Vraagprijs (€)'},
+                             hover_data=['listing_type', 'bedrooms'])
 fig2.update_layout(xaxis_title="Oppervlakte (m²)", yaxis_title="Vraagprijs (€)")
 st.plotly_chart(fig2, use_container_width=True)
+st.caption(fig2_caption)
 
 # 4. Sell duration histogram
-fig4 = px.histogram(df_filtered, x='sell_duration_days', nbins=200, color='city', barmode='stack',
-                    title='Verdeling van verkooptijd (dagen)',
-                    labels={'sell_duration_days': 'Aantal Dagen'})
+# weekly buckets, the last one holds everything that took longer
+sell_days = get_histogram('sell_days_histogram', filters)
+sell_days = sell_days.assign(sell_duration_days=sell_days['bucket'] * SELL_DAYS_BUCKET).rename(columns={'listings': 'Aantal'})
+fig4 = px.bar(sell_days, x='sell_duration_days', y='Aantal', color='city', barmode='stack',
+              title='Verdeling van verkooptijd (dagen)',
+              labels={'sell_duration_days': 'Aantal Dagen'})
 fig4.update_layout(xaxis_title="Aantal Dagen op de Markt", yaxis_title="Aantal Woningen", bargap=0.1)
 st.plotly_chart(fig4, use_container_width=True)
 
 # 5. Energy labels
-energy_order = ['a++++', 'a+++', 'a++', 'a+', 'a', 'b', 'c', 'd', 'e', 'f', 'g']
-df_filtered['energy_label'] = pd.Categorical(df_filtered['energy_label'].str.lower(),
-                                    categories=[e.lower() for e in energy_order], ordered=True)
-energy_city = df_filtered.groupby(['energy_label', 'city']).size().reset_index(name='Aantal')
+# energy labels are an ordered categorical, labels outside ENERGY_LABELS are missing
+energy_city = get_rollup(('energy_label', 'city'), filters)
+energy_city = energy_city.dropna(subset=['energy_label']).rename(columns={'listings': 'Aantal'})
 
 fig5 = px.bar(energy_city, x='energy_label', y='Aantal', color='city',
-              category_orders={'energy_label': [e.lower() for e in energy_order]},
+              category_orders={'energy_label': ENERGY_LABELS},
               title='Verdeling van energielabels',
               labels={'energy_label': 'Energielabel', 'Aantal': 'Aantal Woningen', 'city': 'Stad'},
               barmode='stack')
@@ -134,25 +111,25 @@ st.plotly_chart(fig5, use_container_width=True)
 
 # 6. Price vs days on market
 st.header("Vraagprijs versus Aantal Dagen op de Markt")
-fig_days_price = px.scatter(df_filtered, x='sell_duration_days', y='last_asking_price',
-                            color='city',
-                            title='Vraagprijs versus aantal dagen op de markt',
-                            labels={'sell_duration_days': 'Aantal Dagen op de Markt',
-                                    'last_asking_price': 'Vraagprijs (€)'},
-                            hover_data=['listing_type', 'bedrooms'])
+fig_days_price, fig_days_price_caption = scatter(df_filtered, 'sell_duration_days', 'last_asking_price', large_scatter,
+                                                 color='city',
+                                                 title='Vraagprijs versus aantal dagen op de markt',
+                                                 labels={'sell_duration_days': 'Aantal Dagen op de Markt',
+                                                         'last_asking_price': 'Vraagprijs (€)'},
+                                                 hover_data=['listing_type', 'bedrooms'])
 fig_days_price.update_layout(xaxis_title="Aantal Dagen op de Markt", yaxis_title="Vraagprijs (€)")
 st.plotly_chart(fig_days_price, use_container_width=True)
+st.caption(fig_days_price_caption)
 
 
 # 7. Monthly listings over time
+maandelijks_aanbod = monthly.rename(columns={'listings': 'Aantal Woningen'})
 if city_selected == "Alle":
-    maandelijks_aanbod = df.groupby(['sell_month', 'city']).size().reset_index(name='Aantal Woningen')
     fig_aanbod = px.bar(maandelijks_aanbod, x='sell_month', y='Aantal Woningen', color='city',
                         title='Maandelijks verkocht per stad',
                         labels={'sell_month': 'Verkoopmaand', 'Aantal Woningen': 'Aantal Listings', 'city': 'Stad'},
                         barmode='stack')
 else:
-    maandelijks_aanbod = df_filtered.groupby('sell_month').size().reset_index(name='Aantal Woningen')
     fig_aanbod = px.bar(maandelijks_aanbod, x='sell_month', y='Aantal Woningen',
                         title=f'Maandelijks verkocht in {city_selected}',
                         labels={'sell_month': 'Verkoopmaand', 'Aantal Woningen': 'Aantal Listings'})
@@ -172,13 +149,8 @@ st.plotly_chart(fig_aanbod, use_container_width=True)
 #
 
 if city_selected != "Alle":
-    df_filtered['listing_type_clean'] = df['listing_type'].str.split(r'[\(,]').str[0].str.strip()
-
-    # Now group by the cleaned listing type
-    listing_type_prices = df_filtered.groupby("listing_type_clean")['last_asking_price'] \
-                            .mean() \
-                            .sort_values(ascending=False) \
-                            .reset_index()
+    listing_type_prices = get_rollup(('listing_type_clean',), filters) \
+                            .sort_values('last_asking_price', ascending=False)
 
     fig_listing_type = px.bar(listing_type_prices, x="listing_type_clean", y='last_asking_price',
                               title=f'Gemiddelde vraagrprijs per woningtype in {city_selected}',
@@ -190,11 +162,8 @@ if city_selected != "Alle":
 
 
 if city_selected != "Alle":
-    # Now group by the cleaned listing type
-    neighborhood_prices = df_filtered.groupby("neighborhood")['last_asking_price'] \
-                            .mean() \
-                            .sort_values(ascending=False) \
-                            .reset_index()
+    neighborhood_prices = get_rollup(('neighborhood',), filters) \
+                            .sort_values('last_asking_price', ascending=False)
 
     fig_listing_type = px.bar(neighborhood_prices, x="neighborhood", y='last_asking_price',
                               title=f'Gemiddelde vraagrprijs per buurt in {city_selected}',
@@ -0,0 +1,69 @@
+"""
+Scatter plots that stay light in the browser.
+
+Up to SCATTER_MAX_POINTS points are drawn as they are. Above that, the points are either binned
+into a 2D density here, so only the bin counts are sent, or reduced to a sample stratified by city
+that keeps the small cities visible.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from time import perf_counter
+
+SCATTER_MAX_POINTS = 5000
+DENSITY_BINS = 80
+# the density covers this quantile range of both axes, so a few outliers don't squash it into a corner
+DENSITY_RANGE = (0.001, 0.999)
+SAMPLE_MIN_PER_CITY = 250
+
+DENSITY = "Dichtheid"
+SAMPLE = "Steekproef"
+
+
+def density(frame: pd.DataFrame, x: str, y: str, bins: int = DENSITY_BINS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Number of points per bin of a bins x bins grid, indexed [y, x], and the centers of the bins"""
+    xs, ys = frame[x].to_numpy(dtype=float), frame[y].to_numpy(dtype=float)
+    ranges = [np.quantile(values, DENSITY_RANGE) for values in (xs, ys)]
+    counts, x_edges, y_edges = np.histogram2d(xs, ys, bins=bins, range=ranges)
+    return counts.T, (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2
+
+
+def stratified_sample(frame: pd.DataFrame, size: int, by: str = "city", seed: int = 0) -> pd.DataFrame:
+    """
+    About `size` rows, sampled per group of `by` in proportion to its size, but at least
+    SAMPLE_MIN_PER_CITY rows of every group that has them.
+    """
+    shuffled = frame.sample(frac=1, random_state=seed)
+    groups = shuffled.groupby(by, observed=True)
+    quota = np.maximum(np.ceil(groups[by].transform("size").to_numpy() * size / len(frame)), SAMPLE_MIN_PER_CITY)
+    return shuffled[groups.cumcount().to_numpy() < quota]
+
+
+def scatter(frame: pd.DataFrame, x: str, y: str, mode: str, **kwargs) -> tuple[go.Figure, str]:
+    """
+    px.scatter of the frame, or its density or stratified sample when it has more than
+    SCATTER_MAX_POINTS rows. Returns the figure and a caption with its payload size and render time.
+    """
+    start = perf_counter()
+    if len(frame) <= SCATTER_MAX_POINTS:
+        description = f"{len(frame)} punten"
+        figure = px.scatter(frame, x=x, y=y, **kwargs)
+    elif mode == DENSITY:
+        counts, x_centers, y_centers = density(frame, x, y)
+        description = f"dichtheid van {len(frame)} punten"
+        # empty bins stay transparent
+        figure = go.Figure(go.Heatmap(x=x_centers, y=y_centers, z=np.where(counts > 0, counts, np.nan),
+                                      colorscale="Viridis", colorbar={"title": "Aantal"},
+                                      hovertemplate="%{x:,.0f}, %{y:,.0f}: %{z:.0f}<extra></extra>"))
+        figure.update_layout(title=kwargs.get("title"))
+    else:
+        sample = stratified_sample(frame, SCATTER_MAX_POINTS)
+        description = f"steekproef van {len(sample)} van {len(frame)} punten"
+        figure = px.scatter(sample, x=x, y=y, **kwargs)
+
+    # the payload is the figure as streamlit sends it to the browser
+    payload = len(figure.to_json())
+    elapsed = perf_counter() - start
+    return figure, f"{description}, {payload / 1024:,.0f} kB, {elapsed * 1000:,.0f} ms"
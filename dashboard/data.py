@@ -0,0 +1,287 @@
+"""
+Data access of the dashboard.
+
+Filters are pushed down into parameterized queries on listings (using idx_city and idx_sell_date)
+and listing_rollups. When the Parquet export of dashboard/export.py is there, raw rows are read
+from it instead, memory-mapped and pruned by partition, column and row group statistics.
+
+Results are cached per query and filter in a memory-bounded LRU cache with a TTL, shared by all
+sessions of the server process.
+"""
+import os
+import threading
+import psycopg
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from pyarrow import fs
+
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from psycopg import sql
+from time import monotonic
+from typing import NamedTuple, Optional
+
+CITIES = ['Amsterdam', 'Rotterdam', 'Den', 'Groningen', 'Tilburg', 'Eindhoven', 'Utrecht']
+
+# the Parquet export of the listings to read raw rows from, see dashboard/export.py
+LISTINGS_PARQUET = os.getenv("LISTINGS_PARQUET")
+PARTITIONING = ds.partitioning(pa.schema([("city", pa.string()), ("sell_month", pa.string())]), flavor="hive")
+
+CACHE_TTL = 600 # seconds
+CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# bucket widths of the histograms in listing_rollups, see init/02_create_rollups.sql
+PRICE_BUCKET = 25000
+SELL_DAYS_BUCKET = 7
+
+# the dimensions listing_rollups can be grouped by
+DIMENSIONS = ("sell_month", "city", "neighborhood", "energy_label", "listing_type_clean")
+
+# the columns the raw rows can have, and the sql that computes them from listings. The types are
+# converted by postgres, so nothing is converted per row in python
+LISTING_COLUMNS = {
+    "last_asking_price": "last_asking_price",
+    "surface_area": "surface_area::float8",
+    "bedrooms": "bedrooms",
+    "listing_type": "listing_type",
+    "listing_type_clean": "listing_type_clean",
+    "sell_date": "sell_date",
+    "neighborhood": "neighborhood",
+    "offer_since": "offer_since",
+    "sell_duration_days": "extract(epoch FROM sell_duration)::float8 / 86400",
+    "city": "city",
+    "energy_label": "lower(energy_label)",
+}
+
+ENERGY_LABELS = ['a++++', 'a+++', 'a++', 'a+', 'a', 'b', 'c', 'd', 'e', 'f', 'g']
+
+# the columns of few distinct values that frames have as categoricals
+CATEGORIES = {
+    "city": "category",
+    "energy_label": pd.CategoricalDtype(ENERGY_LABELS, ordered=True),
+    "listing_type_clean": "category",
+}
+
+# listings the dashboard counts, the same as the rollups do
+COMPLETE_COLUMNS = ("last_asking_price", "surface_area", "sell_duration_days", "sell_date", "offer_since", "city", "energy_label")
+COMPLETE_LISTING = sql.SQL("""
+    last_asking_price IS NOT NULL
+    AND surface_area IS NOT NULL
+    AND sell_duration IS NOT NULL
+    AND sell_date IS NOT NULL
+    AND offer_since IS NOT NULL
+    AND city IS NOT NULL
+    AND energy_label IS NOT NULL
+""")
+
+
+class Filters(NamedTuple):
+    """What the dashboard shows: one city or all of CITIES, and the listings sold in a date range"""
+    city: Optional[str] = None
+    sold_from: Optional[date] = None
+    sold_until: Optional[date] = None
+
+
+class FrameCache:
+    """
+    Least recently used cache of frames that expire `ttl` seconds after they were stored.
+    Evicts the least recently used frames once they take more than `max_bytes`.
+    """
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # key -> (expires at, size in bytes, frame), least recently used first
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key) -> Optional[pd.DataFrame]:
+        with self.lock:
+            entry = self.frames.get(key)
+            if entry is None:
+                return None
+            if entry[0] < monotonic():
+                self.remove(key)
+                return None
+            self.frames.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, frame: pd.DataFrame):
+        size = int(frame.memory_usage(deep=True).sum())
+        with self.lock:
+            if key in self.frames:
+                self.remove(key)
+            if size > self.max_bytes:
+                return
+            self.frames[key] = (monotonic() + self.ttl, size, frame)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.frames)))
+
+    def remove(self, key):
+        _, size, _ = self.frames.pop(key)
+        self.size -= size
+
+
+cache = FrameCache()
+
+
+def cached(function):
+    """Caches the frames returned by `function` by its arguments, which have to be hashable"""
+    @wraps(function)
+    def wrapper(*args):
+        key = (function.__name__, *args)
+        frame = cache.get(key)
+        if frame is None:
+            frame = function(*args)
+            cache.put(key, frame)
+        return frame
+    return wrapper
+
+
+def connect():
+    return psycopg.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=5432,
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD")
+    )
+
+
+def query(statement, params=None) -> pd.DataFrame:
+    with connect() as conn, conn.cursor() as cur:
+        cur.execute(statement, params)
+        return pd.DataFrame(cur.fetchall(), columns=[column.name for column in cur.description])
+
+
+def typed(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the columns of a query result to the types the dashboard uses, a column at a time"""
+    types = {column: dtype for column, dtype in CATEGORIES.items() if column in df}
+    for column in ("sell_month", "sell_date", "offer_since"):
+        if column in df:
+            types[column] = "datetime64[s]"
+    return df.astype(types)
+
+
+def where(filters: Filters, date_column: str, from_date: Optional[date]) -> tuple[sql.Composable, list]:
+    """The conditions of the filters on `date_column`, and their parameters"""
+    conditions = []
+    params = []
+    if filters.city:
+        conditions.append(sql.SQL("city = %s"))
+        params.append(filters.city)
+    else:
+        conditions.append(sql.SQL("city = ANY(%s)"))
+        params.append(CITIES)
+    if from_date:
+        conditions.append(sql.SQL("{} >= %s").format(sql.Identifier(date_column)))
+        params.append(from_date)
+    if filters.sold_until:
+        conditions.append(sql.SQL("{} <= %s").format(sql.Identifier(date_column)))
+        params.append(filters.sold_until)
+    return sql.SQL(' AND ').join(conditions), params
+
+
+def rollup_where(filters: Filters) -> tuple[sql.Composable, list]:
+    # the rollups are per month, so the date range is widened to whole months
+    return where(filters, "sell_month", filters.sold_from and filters.sold_from.replace(day=1))
+
+
+@cached
+def get_sell_months() -> pd.DataFrame:
+    """The first and last month with sold listings"""
+    return query("SELECT min(sell_month) AS first, max(sell_month) AS last FROM listing_rollups")
+
+
+@cached
+def get_rollup(dimensions: tuple, filters: Filters) -> pd.DataFrame:
+    """Number of listings and mean asking price and sell duration per group of `dimensions`, aggregated in postgres"""
+    columns = [sql.Identifier(dimension) for dimension in dimensions if dimension in DIMENSIONS]
+    conditions, params = rollup_where(filters)
+    statement = sql.SQL("""
+        SELECT
+            {columns},
+            sum(listings)::integer AS listings,
+            (sum(sum_asking_price) / sum(listings))::float8 AS last_asking_price,
+            (sum(sum_sell_days) / sum(listings))::float8 AS sell_duration_days
+        FROM listing_rollups
+        WHERE {conditions} AND {not_null}
+        GROUP BY {groups}
+        ORDER BY {groups}
+    """).format(
+        columns=sql.SQL(', ').join(columns),
+        conditions=conditions,
+        # like a pandas groupby, which drops the groups without a value
+        not_null=sql.SQL(' AND ').join(sql.SQL("{} IS NOT NULL").format(column) for column in columns),
+        groups=sql.SQL(', ').join(columns),
+    )
+    return typed(query(statement, params))
+
+
+@cached
+def get_histogram(column: str, filters: Filters) -> pd.DataFrame:
+    """The histogram of `column` (price_histogram or sell_days_histogram) per city, one row per bucket"""
+    conditions, params = rollup_where(filters)
+    statement = sql.SQL("""
+        SELECT city, bucket - 1 AS bucket, listings
+        FROM (
+            SELECT city, histogram_sum({column}) AS counts
+            FROM listing_rollups
+            WHERE {conditions}
+            GROUP BY city
+        ) AS histograms, unnest(counts) WITH ORDINALITY AS buckets(listings, bucket)
+        ORDER BY city, bucket
+    """).format(column=sql.Identifier(column), conditions=conditions)
+    return typed(query(statement, params))
+
+
+def histogram_quantile(counts: np.ndarray, width: float, q: float) -> float:
+    """Interpolates the q-quantile within its histogram bucket, NaN for an empty histogram"""
+    cumulative = np.cumsum(counts)
+    if not cumulative.size or cumulative[-1] == 0:
+        return np.nan
+    target = q * cumulative[-1]
+    bucket = int(np.searchsorted(cumulative, target))
+    before = cumulative[bucket - 1] if bucket else 0
+    # only a target of 0 (q = 0) lands in an empty bucket, on its lower edge
+    if counts[bucket] == 0:
+        return bucket * width
+    return (bucket + (target - before) / counts[bucket]) * width
+
+
+@cached
+def get_listings(columns: tuple, filters: Filters) -> pd.DataFrame:
+    """Raw rows with the given LISTING_COLUMNS of the listings the dashboard counts"""
+    if LISTINGS_PARQUET and os.path.isdir(LISTINGS_PARQUET):
+        return read_listings(columns, filters)
+
+    conditions, params = where(filters, "sell_date", filters.sold_from)
+    statement = sql.SQL("SELECT {columns} FROM listings WHERE {complete} AND {conditions}").format(
+        columns=sql.SQL(', ').join(sql.SQL("{} AS {}").format(sql.SQL(LISTING_COLUMNS[column]), sql.Identifier(column))
+                                   for column in columns if column in LISTING_COLUMNS),
+        complete=COMPLETE_LISTING,
+        conditions=conditions,
+    )
+    return typed(query(statement, params))
+
+
+def read_listings(columns: tuple, filters: Filters) -> pd.DataFrame:
+    """get_listings from the Parquet export, which has the columns as LISTING_COLUMNS computes them"""
+    expression = ds.field("city") == filters.city if filters.city else ds.field("city").isin(CITIES)
+    # the sell month partitions prune whole directories, the sell dates the row groups within them
+    if filters.sold_from:
+        expression &= (ds.field("sell_month") >= f"{filters.sold_from:%Y-%m}") & (ds.field("sell_date") >= filters.sold_from)
+    if filters.sold_until:
+        expression &= (ds.field("sell_month") <= f"{filters.sold_until:%Y-%m}") & (ds.field("sell_date") <= filters.sold_until)
+    for column in COMPLETE_COLUMNS:
+        expression &= ds.field(column).is_valid()
+
+    dataset = ds.dataset(LISTINGS_PARQUET, format="parquet", partitioning=PARTITIONING,
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+    table = dataset.to_table(columns=[column for column in columns if column in LISTING_COLUMNS], filter=expression)
+    return typed(table.to_pandas(date_as_object=False))
@@ -0,0 +1,146 @@
+"""
+Exports the listings table to Parquet files partitioned by city and sell month, for the dashboard
+and offline notebooks.
+
+Every run only exports the listings added since the previous one, tracked by id in
+`_export_state.json` next to the files. Listings that were changed afterwards (e.g. by
+scrapers/reextract.py) are only picked up by a --full export, which also compacts the many small
+files that incremental runs leave behind.
+
+Usage:
+    python dashboard/export.py [--output DIR] [--batch-size N] [--full]
+"""
+import argparse
+import json
+import logging
+import shutil
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from dotenv import load_dotenv
+from pathlib import Path
+
+from data import LISTINGS_PARQUET, PARTITIONING, connect
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("export")
+
+STATE_FILE = "_export_state.json"
+
+# the exported columns; the low-cardinality text columns are dictionary encoded, and read as categoricals
+SCHEMA = pa.schema([
+    ("id", pa.int32()),
+    ("funda_id", pa.string()),
+    ("title", pa.string()),
+    ("last_asking_price", pa.int32()),
+    ("surface_area", pa.float64()),
+    ("bedrooms", pa.int32()),
+    ("total_rooms", pa.int32()),
+    ("listing_type", pa.dictionary(pa.int32(), pa.string())),
+    ("listing_type_clean", pa.dictionary(pa.int32(), pa.string())),
+    ("sell_date", pa.date32()),
+    ("offer_since", pa.date32()),
+    ("sell_duration_days", pa.float64()),
+    ("city", pa.string()),
+    ("postcode", pa.string()),
+    ("neighborhood", pa.dictionary(pa.int32(), pa.string())),
+    ("energy_label", pa.dictionary(pa.int32(), pa.string())),
+    ("building_year", pa.date32()),
+    ("scraped_at", pa.timestamp("us")),
+    ("url", pa.string()),
+])
+
+# durations are converted to days and energy labels to lower case by postgres, the same as
+# LISTING_COLUMNS in data.py, so nothing is converted per row in python
+EXPORT_QUERY = """
+    SELECT
+        id, funda_id, title, last_asking_price, surface_area::float8, bedrooms, total_rooms, listing_type,
+        listing_type_clean, sell_date, offer_since, extract(epoch FROM sell_duration)::float8 / 86400, city,
+        postcode, neighborhood, lower(energy_label), building_year, scraped_at, url
+    FROM listings
+    WHERE id > %s AND id <= %s
+    ORDER BY id
+"""
+
+
+def read_state(output: Path) -> int:
+    """The id of the last exported listing"""
+    try:
+        return json.loads((output / STATE_FILE).read_text())["last_id"]
+    except FileNotFoundError:
+        return 0
+
+
+def write_state(output: Path, last_id: int):
+    temporary = output / f"{STATE_FILE}.tmp"
+    temporary.write_text(json.dumps({"last_id": last_id}))
+    temporary.replace(output / STATE_FILE)
+
+
+def committed_id(conn) -> int:
+    """
+    The highest id below which every listing is committed. Inserts hold a lock that conflicts with
+    SHARE, so once it is granted, every id handed out so far belongs to a finished transaction.
+    """
+    with conn.transaction():
+        conn.execute("LOCK TABLE listings IN SHARE MODE")
+        return conn.execute("SELECT coalesce(max(id), 0) FROM listings").fetchone()[0]
+
+
+def to_table(rows: list[tuple]) -> pa.Table:
+    columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), SCHEMA)]
+    table = pa.Table.from_arrays(columns, schema=SCHEMA)
+    return table.append_column("sell_month", pc.strftime(table["sell_date"], format="%Y-%m"))
+
+
+def export(conn, output: Path, after_id: int, until_id: int, batch_size: int) -> int:
+    """Writes the listings with ids in (after_id, until_id] to the dataset, returns their number"""
+    exported = 0
+    # a server-side cursor, so only one batch is in memory at a time
+    with conn.cursor(name="export") as cur:
+        cur.execute(EXPORT_QUERY, (after_id, until_id))
+        while rows := cur.fetchmany(batch_size):
+            # named after the first id, so a run that is retried after a crash overwrites its own files
+            ds.write_dataset(
+                to_table(rows), output, format="parquet", partitioning=PARTITIONING,
+                basename_template=f"part-{rows[0][0]}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+            )
+            exported += len(rows)
+            logger.info(f"Exported {exported} listings, up to id {rows[-1][0]}")
+    return exported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default=LISTINGS_PARQUET or "exports/listings", help="dataset directory (default: $LISTINGS_PARQUET)")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="listings per written batch")
+    parser.add_argument("--full", action="store_true", help="export all listings again, replacing the existing files")
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    # a full export is written next to the dataset and swapped in once complete
+    target = output.with_name(f".{output.name}-full") if args.full else output
+    if args.full and target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True, exist_ok=True)
+
+    with connect() as conn:
+        after_id = read_state(target)
+        until_id = committed_id(conn)
+        exported = export(conn, target, after_id, until_id, args.batch_size)
+    write_state(target, max(after_id, until_id))
+
+    if args.full:
+        if output.exists():
+            shutil.rmtree(output)
+        target.rename(output)
+    logger.info(f"Exported {exported} new listings to {output}")
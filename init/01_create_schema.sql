@@ -1,3 +1,4 @@
+-- the columns filled by the writer are declared in scrapers/schema.py, run it to check they still agree
 
 
 CREATE TABLE listings (
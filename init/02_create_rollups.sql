@@ -0,0 +1,136 @@
+-- Pre-aggregated listings for the dashboard, one row per sell month, city, neighborhood, energy label
+-- and listing type. Kept up to date by statement triggers on listings, so every insert, upsert or
+-- delete only aggregates the rows it changed. Only listings with everything the dashboard needs count.
+--
+-- On an existing database, run this file once and fill the rollups with SELECT rebuild_listing_rollups();
+
+
+-- fixed-width histograms (quantile sketches), which add up across rollup rows --
+-- the first and last buckets also count everything below and above them
+CREATE FUNCTION histogram_add(counts INTEGER[], bucket INTEGER, buckets INTEGER, weight INTEGER)
+RETURNS INTEGER[] LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    IF counts IS NULL THEN
+        counts := array_fill(0, ARRAY[buckets]);
+    END IF;
+    bucket := least(greatest(bucket, 0), buckets - 1) + 1;
+    counts[bucket] := counts[bucket] + weight;
+    RETURN counts;
+END
+$$;
+
+-- histogram(bucket, number of buckets, weight)
+CREATE AGGREGATE histogram(INTEGER, INTEGER, INTEGER) (SFUNC = histogram_add, STYPE = INTEGER[]);
+
+CREATE FUNCTION histogram_merge(a INTEGER[], b INTEGER[])
+RETURNS INTEGER[] LANGUAGE sql IMMUTABLE AS $$
+    SELECT array_agg(coalesce(x, 0) + coalesce(y, 0) ORDER BY i) FROM unnest(a, b) WITH ORDINALITY AS t(x, y, i)
+$$;
+
+CREATE AGGREGATE histogram_sum(INTEGER[]) (SFUNC = histogram_merge, STYPE = INTEGER[]);
+
+
+CREATE TABLE listing_rollups (
+    sell_month DATE NOT NULL,
+    city TEXT NOT NULL,
+    neighborhood TEXT,
+    energy_label TEXT NOT NULL,             -- lower case
+    listing_type TEXT,
+    listings INTEGER NOT NULL,
+    sum_asking_price BIGINT NOT NULL,
+    sum_surface_area NUMERIC NOT NULL,
+    sum_sell_days DOUBLE PRECISION NOT NULL,
+    price_histogram INTEGER[] NOT NULL,     -- 80 buckets of 25000 euro
+    sell_days_histogram INTEGER[] NOT NULL, -- 53 buckets of 7 days
+    UNIQUE NULLS NOT DISTINCT (sell_month, city, neighborhood, energy_label, listing_type)
+);
+
+CREATE INDEX idx_rollups_city ON listing_rollups(city);
+
+
+-- the statement that adds the listings of `source` to the rollups, where source is a query
+-- returning listings with a weight: 1 to add them, -1 to remove them
+CREATE FUNCTION listing_rollups_statement(source TEXT)
+RETURNS TEXT LANGUAGE sql IMMUTABLE AS $$
+    SELECT format($sql$
+        INSERT INTO listing_rollups AS rollup
+        SELECT
+            date_trunc('month', sell_date)::date,
+            city,
+            neighborhood,
+            lower(energy_label),
+            listing_type,
+            sum(weight),
+            sum(weight * last_asking_price),
+            sum(weight * surface_area),
+            sum(weight * extract(epoch FROM sell_duration) / 86400),
+            histogram(last_asking_price / 25000, 80, weight),
+            histogram(floor(extract(epoch FROM sell_duration) / 604800)::integer, 53, weight)
+        FROM (%s) AS changes
+        WHERE last_asking_price IS NOT NULL
+          AND surface_area IS NOT NULL
+          AND sell_duration IS NOT NULL
+          AND sell_date IS NOT NULL
+          AND offer_since IS NOT NULL
+          AND city IS NOT NULL
+          AND energy_label IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+        -- concurrent writers lock the rollup rows in the same order
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (sell_month, city, neighborhood, energy_label, listing_type) DO UPDATE SET
+            listings = rollup.listings + EXCLUDED.listings,
+            sum_asking_price = rollup.sum_asking_price + EXCLUDED.sum_asking_price,
+            sum_surface_area = rollup.sum_surface_area + EXCLUDED.sum_surface_area,
+            sum_sell_days = rollup.sum_sell_days + EXCLUDED.sum_sell_days,
+            price_histogram = histogram_merge(rollup.price_histogram, EXCLUDED.price_histogram),
+            sell_days_histogram = histogram_merge(rollup.sell_days_histogram, EXCLUDED.sell_days_histogram)
+    $sql$, source)
+$$;
+
+
+CREATE FUNCTION update_listing_rollups()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        EXECUTE listing_rollups_statement('SELECT *, 1 AS weight FROM new_listings');
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        EXECUTE listing_rollups_statement(
+            'SELECT *, 1 AS weight FROM new_listings UNION ALL SELECT *, -1 AS weight FROM old_listings'
+        );
+    ELSE
+        EXECUTE listing_rollups_statement('SELECT *, -1 AS weight FROM old_listings');
+    END IF;
+    DELETE FROM listing_rollups WHERE listings = 0;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER listing_rollups_insert AFTER INSERT ON listings
+    REFERENCING NEW TABLE AS new_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION update_listing_rollups();
+
+CREATE TRIGGER listing_rollups_update AFTER UPDATE ON listings
+    REFERENCING OLD TABLE AS old_listings NEW TABLE AS new_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION update_listing_rollups();
+
+CREATE TRIGGER listing_rollups_delete AFTER DELETE ON listings
+    REFERENCING OLD TABLE AS old_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION update_listing_rollups();
+
+
+-- recomputes the rollups from all listings, returns the number of rollup rows
+CREATE FUNCTION rebuild_listing_rollups()
+RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    rows INTEGER;
+BEGIN
+    LOCK TABLE listings IN SHARE MODE;
+    TRUNCATE listing_rollups;
+    EXECUTE listing_rollups_statement('SELECT *, 1 AS weight FROM listings');
+    GET DIAGNOSTICS rows = ROW_COUNT;
+    RETURN rows;
+END
+$$;
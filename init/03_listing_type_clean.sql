@@ -0,0 +1,13 @@
+-- The kind of listing without its details, e.g. "Eengezinswoning, tussenwoning" -> "Eengezinswoning"
+-- and "Bovenwoning (appartement)" -> "Bovenwoning". Stored on listings and listing_rollups, so the
+-- dashboard can group and filter on it without cleaning every row again.
+CREATE FUNCTION clean_listing_type(listing_type TEXT)
+RETURNS TEXT LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT trim(regexp_replace(listing_type, '[(,].*$', ''))
+$$;
+
+ALTER TABLE listings
+    ADD COLUMN listing_type_clean TEXT GENERATED ALWAYS AS (clean_listing_type(listing_type)) STORED;
+
+ALTER TABLE listing_rollups
+    ADD COLUMN listing_type_clean TEXT GENERATED ALWAYS AS (clean_listing_type(listing_type)) STORED;
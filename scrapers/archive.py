@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import os
+import zstandard
+
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from config import ARCHIVE_MAX_BYTES, ARCHIVE_COMPRESSION_LEVEL
+
+SUFFIX = ".html.zst"
+# fields of the scraped listing stored with the page, enough to extract it again
+HEADER_FIELDS = ("funda_id", "url", "scraped_at")
+
+logger = logging.getLogger(__name__)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+class PageArchive:
+    """
+    Content-addressed store of fetched listing pages on the local disk.
+
+    Every page is stored zstd compressed at <root>/<funda_id>/<content hash>.html.zst, preceded by
+    a json line with the url and scrape time, so a page fetched again with the same content is only
+    stored once. When the archive grows beyond `max_bytes` the least recently stored pages are evicted.
+    """
+    def __init__(self, root: str, max_bytes: int = ARCHIVE_MAX_BYTES, level: int = ARCHIVE_COMPRESSION_LEVEL):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        # scanned on the first write, the archive may be shared with other scrapers
+        self.size = None
+
+    def path(self, funda_id: str, content_hash: str) -> Path:
+        return self.root / funda_id / (content_hash + SUFFIX)
+
+    def put(self, info: dict, content: str) -> Path:
+        """Stores the page of a scraped listing, returns its path"""
+        data = content.encode()
+        path = self.path(info["funda_id"], hashlib.blake2b(data, digest_size=16).hexdigest())
+        if path.exists():
+            # refetched without changes, only mark it as recently stored
+            os.utime(path)
+            return path
+
+        header = json.dumps({field: info[field] for field in HEADER_FIELDS}).encode()
+        blob = self.compressor.compress(header + b"\n" + data)
+
+        # write to a temporary file first, so readers never see half a page
+        path.parent.mkdir(exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_bytes(blob)
+        os.replace(temporary, path)
+
+        self.size = self.disk_usage() if self.size is None else self.size + len(blob)
+        if self.size > self.max_bytes:
+            self.evict()
+        return path
+
+    def entries(self) -> List[os.DirEntry]:
+        entries = []
+        with os.scandir(self.root) as listings:
+            for listing in listings:
+                if listing.is_dir():
+                    with os.scandir(listing.path) as pages:
+                        entries += [page for page in pages if page.name.endswith(SUFFIX)]
+        return entries
+
+    def disk_usage(self) -> int:
+        return sum(entry.stat().st_size for entry in self.entries())
+
+    def evict(self, target: float = 0.9):
+        """Deletes the least recently stored pages until the archive is below `target` of its maximum size"""
+        entries = sorted(self.entries(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        evicted = 0
+        for entry in entries:
+            if size <= target * self.max_bytes:
+                break
+            size -= entry.stat().st_size
+            os.remove(entry.path)
+            evicted += 1
+            try:
+                os.rmdir(os.path.dirname(entry.path))
+            except OSError:
+                # the listing has other pages left
+                pass
+
+        self.size = size
+        logger.info(f"Evicted {evicted} pages from the archive, {size} bytes left")
+
+    def latest(self) -> Iterator[Path]:
+        """Path of the most recently stored page of every listing"""
+        with os.scandir(self.root) as listings:
+            for listing in listings:
+                if not listing.is_dir():
+                    continue
+                with os.scandir(listing.path) as pages:
+                    pages = [page for page in pages if page.name.endswith(SUFFIX)]
+                if pages:
+                    yield Path(max(pages, key=lambda page: page.stat().st_mtime).path)
+
+
+def load(path: Path) -> Tuple[dict, str]:
+    """Returns the stored listing fields and the html of an archived page"""
+    header, data = _decompressor.decompress(path.read_bytes()).split(b"\n", 1)
+    return json.loads(header), data.decode()
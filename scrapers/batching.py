@@ -0,0 +1,42 @@
+from config import BATCH_SIZE, MAX_BATCH_SIZE, WRITER_LATENCY_SLO
+
+
+class AdaptiveBatcher:
+    """
+    Sizes writer batches from the depth of the queue and the observed commit latency.
+
+    Listings should reach the database within `latency_slo` seconds of being popped. Half of that
+    budget is reserved for the commit, so a batch is never larger than what we expect to commit in
+    that time, and a partially filled batch is flushed once its oldest listing waited the other half.
+    """
+    def __init__(self, min_size: int = BATCH_SIZE, max_size: int = MAX_BATCH_SIZE, latency_slo: float = WRITER_LATENCY_SLO, smoothing: float = 0.2):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.latency_slo = latency_slo
+        self.smoothing = smoothing
+        # exponentially weighted moving averages of the commit latency
+        self.seconds_per_row = None
+        self.seconds_per_commit = None
+
+    def observe(self, size: int, seconds: float):
+        """Records how long committing a batch of `size` listings took"""
+        if size <= 0:
+            return
+        if self.seconds_per_row is None:
+            self.seconds_per_row = seconds / size
+            self.seconds_per_commit = seconds
+        else:
+            self.seconds_per_row += self.smoothing * (seconds / size - self.seconds_per_row)
+            self.seconds_per_commit += self.smoothing * (seconds - self.seconds_per_commit)
+
+    def next_size(self, depth: int) -> int:
+        """Batch size for the given queue depth that is still expected to commit within budget"""
+        limit = self.max_size
+        if self.seconds_per_row:
+            limit = min(limit, int(self.latency_slo / 2 / self.seconds_per_row))
+        return max(self.min_size, min(depth, limit))
+
+    def max_wait(self) -> float:
+        """How long the oldest listing of a batch may wait for the batch to fill up"""
+        expected_commit = self.seconds_per_commit or 0
+        return max(0, self.latency_slo - max(expected_commit, self.latency_slo / 2))
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+
+from contextlib import contextmanager, asynccontextmanager
+from playwright.async_api import async_playwright
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+from random import choice
+
+from config import BROWSER_MAX_PAGES, BROWSER_CONTEXT_MAX_PAGES, BROWSER_HEADLESS, USER_AGENTS
+
+
+class BrowserPool:
+    """Keeps a single browser process alive for the lifetime of a worker and hands out pages from recycled contexts"""
+    def __init__(self, max_pages: int = BROWSER_MAX_PAGES, context_max_pages: int = BROWSER_CONTEXT_MAX_PAGES, headless: bool = BROWSER_HEADLESS):
+        self.max_pages = max_pages
+        self.context_max_pages = context_max_pages
+        self.headless = headless
+        self.logger = logging.getLogger("BrowserPool")
+
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._page = None
+
+        self.user_agent = None
+        self.browser_pages = 0  # pages served by the current browser process
+        self.context_pages = 0  # pages served by the current context
+        self.restarts = 0
+
+    def start(self):
+        """Launches the browser, starting playwright if needed"""
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        self.logger.info("Launching browser")
+        self._browser = self._playwright.chromium.launch(headless=self.headless)
+        self.browser_pages = 0
+
+    def restart(self):
+        """Closes the current browser (if any) and launches a fresh one"""
+        self._close_browser()
+        self.restarts += 1
+        self.start()
+
+    def close(self):
+        """Closes the browser and stops playwright"""
+        self._close_browser()
+        if self._playwright is not None:
+            self._playwright.stop()
+            self._playwright = None
+
+    @contextmanager
+    def page(self):
+        """
+        Yields a page ready for navigation.
+
+        The browser is restarted after it has served `max_pages` pages or when it crashed,
+        and a new context with a different user agent is created every `context_max_pages` pages
+        and after a page failed.
+        """
+        if self._browser is None:
+            self.start()
+        elif not self._browser.is_connected():
+            self.logger.warning("Browser disconnected, restarting")
+            self.restart()
+        elif self.browser_pages >= self.max_pages:
+            self.logger.info(f"Browser served {self.browser_pages} pages, restarting")
+            self.restart()
+
+        if self._page is None or self._page.is_closed() or self.context_pages >= self.context_max_pages:
+            self._new_context()
+
+        try:
+            yield self._page
+        except PlaywrightError as e:
+            # a navigation timeout or a crashed page only costs its context, the browser is only
+            # relaunched when it is gone
+            if self._browser.is_connected():
+                self.logger.warning(f"Page error, replacing the context: {e}")
+                self._close_context()
+            else:
+                self.logger.warning(f"Browser disconnected, restarting browser: {e}")
+                self.restart()
+            raise
+        finally:
+            self.browser_pages += 1
+            self.context_pages += 1
+
+    def _new_context(self):
+        """Replaces the current context with a fresh one using a random user agent"""
+        self._close_context()
+        self.user_agent = choice(USER_AGENTS)
+        self._context = self._browser.new_context(user_agent=self.user_agent)
+        self._page = self._context.new_page()
+        self.context_pages = 0
+
+    def _close_context(self):
+        if self._context is not None:
+            try:
+                self._context.close()
+            except PlaywrightError:
+                pass
+        self._context = None
+        self._page = None
+
+    def _close_browser(self):
+        self._close_context()
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except PlaywrightError:
+                pass
+        self._browser = None
+
+
+class _Slot:
+    """A context and page owned by one concurrent scraping slot"""
+    def __init__(self):
+        self.context = None
+        self.page = None
+        self.user_agent = None
+        self.pages = 0
+        self.generation = -1  # browser generation the context belongs to
+
+
+class AsyncBrowserPool:
+    """
+    Async counterpart of BrowserPool that keeps up to `size` pages in flight on a single browser.
+
+    Every slot gets its own context and user agent. Restarts wait until all in-flight pages are done.
+    """
+    def __init__(self, size: int, max_pages: int = BROWSER_MAX_PAGES, context_max_pages: int = BROWSER_CONTEXT_MAX_PAGES, headless: bool = BROWSER_HEADLESS):
+        self.size = size
+        self.max_pages = max_pages
+        self.context_max_pages = context_max_pages
+        self.headless = headless
+        self.logger = logging.getLogger("AsyncBrowserPool")
+
+        self._playwright = None
+        self._browser = None
+        self._generation = 0
+        self._slots = asyncio.LifoQueue()
+        for _ in range(size):
+            self._slots.put_nowait(_Slot())
+
+        self._cond = asyncio.Condition()
+        self._in_flight = 0
+        self._restarting = False
+
+        self.browser_pages = 0
+        self.restarts = 0
+
+    async def close(self):
+        """Closes the browser and stops playwright"""
+        await self._close_browser()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    @asynccontextmanager
+    async def page(self):
+        """Yields a page from a free slot, (re)launching the browser when needed"""
+        slot = await self._slots.get()
+        try:
+            await self._acquire()
+            try:
+                if slot.generation != self._generation or slot.page is None or slot.page.is_closed() or slot.pages >= self.context_max_pages:
+                    await self._new_context(slot)
+                slot.pages += 1
+                yield slot.page, slot.user_agent
+            except PlaywrightError:
+                # drop the context of this slot; a crashed browser is detected on the next acquire
+                await self._close_context(slot)
+                raise
+            finally:
+                await self._release()
+        finally:
+            self._slots.put_nowait(slot)
+
+    async def _acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._restarting)
+            reason = None
+            if self._browser is None:
+                reason = "Launching browser"
+            elif not self._browser.is_connected():
+                reason = "Browser disconnected, restarting"
+            elif self.browser_pages >= self.max_pages:
+                reason = f"Browser served {self.browser_pages} pages, restarting"
+
+            if reason:
+                self.logger.info(reason)
+                self._restarting = True
+                try:
+                    await self._cond.wait_for(lambda: self._in_flight == 0)
+                    await self._launch()
+                finally:
+                    self._restarting = False
+                    self._cond.notify_all()
+
+            self._in_flight += 1
+            self.browser_pages += 1
+
+    async def _release(self):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    async def _launch(self):
+        if self._browser is not None:
+            self.restarts += 1
+        await self._close_browser()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._generation += 1
+        self.browser_pages = 0
+
+    async def _new_context(self, slot: _Slot):
+        await self._close_context(slot)
+        slot.user_agent = choice(USER_AGENTS)
+        slot.context = await self._browser.new_context(user_agent=slot.user_agent)
+        slot.page = await slot.context.new_page()
+        slot.pages = 0
+        slot.generation = self._generation
+
+    async def _close_context(self, slot: _Slot):
+        if slot.context is not None and slot.generation == self._generation:
+            try:
+                await slot.context.close()
+            except PlaywrightError:
+                pass
+        slot.context = None
+        slot.page = None
+
+    async def _close_browser(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except PlaywrightError:
+                pass
+        self._browser = None
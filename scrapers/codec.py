@@ -0,0 +1,91 @@
+import json
+import msgpack
+import zstandard
+
+from typing import Dict, Optional
+
+# Message format, version 1:
+#   one version byte, followed by the msgpack array [core, misc]
+#   core: {field id: value} of the fields the writer transforms into columns
+#   misc: {field id or key: value} of all other fields, or the zstd compressed msgpack of that map
+# Legacy messages are json objects, so their first byte is "{" and never a version byte.
+VERSION_1 = 1
+
+# Interned field names, the index is the field id.
+# Append only: changing the id of a field breaks the messages that are still queued.
+FIELDS = (
+    "funda_id", "url", "scraped_at", "Titel", "Postcode", "Buurt",
+    "Aangeboden sinds", "Verkoopdatum", "Looptijd", "Laatste vraagprijs", "Status", "Aanvaarding",
+    "Bijdrage VvE", "Soort appartement", "Soort woonhuis", "Soort bouw", "Bouwjaar", "Soort dak",
+    "Gebruiksoppervlakten", "Wonen", "Externe bergruimte", "Perceel", "Inhoud", "Aantal kamers",
+    "Aantal badkamers", "Badkamervoorzieningen", "Aantal woonlagen", "Voorzieningen", "Energielabel",
+    "Isolatie", "Verwarming", "Warm water", "Cv-ketel", "Eigendomssituatie", "Oppervlakte", "Ligging",
+    "Tuin", "Achtertuin", "Ligging tuin", "Schuur/berging", "Soort parkeergelegenheid",
+)
+FIELD_IDS = {field: i for i, field in enumerate(FIELDS)}
+
+# fields read by transform.transform, kept uncompressed
+CORE_FIELDS = frozenset((
+    "funda_id", "url", "scraped_at", "Titel", "Postcode", "Buurt", "Aangeboden sinds", "Verkoopdatum",
+    "Laatste vraagprijs", "Soort appartement", "Soort woonhuis", "Bouwjaar", "Gebruiksoppervlakten",
+    "Aantal kamers", "Energielabel",
+))
+
+# misc maps smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 256
+
+_compressor = zstandard.ZstdCompressor(level=3)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def encode(message: Dict[str, Optional[str]], compress: bool = False) -> bytes:
+    """Encodes a scraped listing as a version 1 message"""
+    core = {}
+    misc = {}
+    for key, value in message.items():
+        field_id = FIELD_IDS.get(key, key)
+        if key in CORE_FIELDS:
+            core[field_id] = value
+        else:
+            misc[field_id] = value
+
+    if compress and misc:
+        packed = msgpack.packb(misc)
+        if len(packed) >= COMPRESS_MIN_BYTES:
+            misc = _compressor.compress(packed)
+
+    return bytes((VERSION_1,)) + msgpack.packb([core, misc])
+
+
+def _fields(packed: dict, message: dict):
+    for field, value in packed.items():
+        message[FIELDS[field] if isinstance(field, int) else field] = value
+
+
+def decode(raw: bytes) -> dict:
+    """Decodes a message of any version, including legacy json messages, into the scraped listing"""
+    version = raw[0]
+    if version == ord("{"):
+        return json.loads(raw)
+    if version != VERSION_1:
+        raise ValueError(f"Unknown message version: {version}")
+
+    core, misc = msgpack.unpackb(raw[1:], strict_map_key=False)
+    if isinstance(misc, bytes):
+        misc = msgpack.unpackb(_decompressor.decompress(misc), strict_map_key=False)
+
+    message = {}
+    _fields(core, message)
+    _fields(misc, message)
+    return message
+
+
+def make_encoder(codec: str = "json"):
+    """Returns the encode function of the given codec: "json", "msgpack" or "msgpack-zstd"."""
+    if codec == "json":
+        return lambda message: json.dumps(message).encode()
+    if codec == "msgpack":
+        return encode
+    if codec == "msgpack-zstd":
+        return lambda message: encode(message, compress=True)
+    raise ValueError(f"Unknown message codec: {codec}")
@@ -1,14 +1,86 @@
+# --- RATE LIMITING --- #
+# The crawlers and the scrapers each share a request rate through redis. It grows by RATE_INCREASE
+# after every clean response and is multiplied by RATE_DECREASE after a 403, 429, captcha or storing page
+RATE_INCREASE = 0.005 # requests per second
+RATE_DECREASE = 0.5
+
 # --- CRAWLER --- #
-# Sleeping delay is picked uniformly between MIN and MAX:
-CRAWLER_THROTTLE_SPEED_MIN = 5 #seconds
-CRAWLER_THROTTLE_SPEED_MAX = 10 #seconds
+# Request rate of all crawlers together, starting at about one page every 7.5 seconds
+CRAWLER_RATE_START = 0.13 # requests per second
+CRAWLER_RATE_MIN = 0.02
+CRAWLER_RATE_MAX = 1
+
+# Every sweep crawls up to CRAWLER_MAX_PAGES search result pages per region,
+# a region is skipped for the rest of the sweep once one of its pages yields no new listings
+CRAWLER_REGIONS = ["tilburg", "amsterdam", "rotterdam", "den-haag", "utrecht", "eindhoven", "groningen"]
+CRAWLER_MAX_PAGES = 166
+# Used when CRAWLER_MODE=incremental: the most recent listings are crawled first and a region is done
+# when its high-water mark is reached or after this many consecutive pages without new listings
+CRAWLER_EMPTY_PAGES = 2
+
+# Sizing of the bloom filter used when DEDUP_STORE=bloom:
+# holds BLOOM_CAPACITY funda ids with a false positive rate of BLOOM_ERROR_RATE (~3.6 MB)
+BLOOM_CAPACITY = 2_000_000
+BLOOM_ERROR_RATE = 0.001
 
 # --- SCRAPER --- #
-# Sleeping delay is picked uniformly between MIN and MAX:
-SCRAPER_THROTTLE_SPEED_MIN = 5 #seconds
-SCRAPER_THROTTLE_SPEED_MAX = 10 #seconds
+# Request rate of all scrapers together, starting at about one page every 7.5 seconds
+SCRAPER_RATE_START = 0.13 # requests per second
+SCRAPER_RATE_MIN = 0.02
+SCRAPER_RATE_MAX = 2
+# Number of pages in flight per process when SCRAPER_MODE=async.
+# The slots share the scraper request rate, so concurrency only helps to hide slow responses
+SCRAPER_CONCURRENCY = 4
+
+# --- FETCHERS --- #
+# Used by the plain HTTP fetcher (FETCHER_BACKEND=http)
+HTTP_TIMEOUT = 30 # seconds
+HTTP_MAX_CONNECTIONS = 10
+
+# --- BROWSER POOL --- #
+# The browser process is restarted after it has served BROWSER_MAX_PAGES pages
+BROWSER_MAX_PAGES = 200
+# A fresh context (cookies, user agent) is created every BROWSER_CONTEXT_MAX_PAGES pages
+BROWSER_CONTEXT_MAX_PAGES = 20
+BROWSER_HEADLESS = False
+
+# A random user agent is picked for every new browser context
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_4_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.5790.170 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:117.0) Gecko/20100101 Firefox/117.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 13.5; rv:117.0) Gecko/20100101 Firefox/117.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Safari/605.1.15",
+    "Mozilla/5.0 (Linux; Android 13; Pixel 6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+]
+
+# --- ARCHIVE --- #
+# Used when ARCHIVE_DIR is set: the scraper keeps the fetched pages for re-extraction with scrapers/reextract.py,
+# evicting the least recently stored pages beyond ARCHIVE_MAX_BYTES
+ARCHIVE_MAX_BYTES = 20 * 1024 ** 3
+ARCHIVE_COMPRESSION_LEVEL = 10
 
 # --- WRITER --- #
-# Writer will flush buffer at every BATCH_SIZE listings OR after FLUSH_TIME_LIMIT seconds
-FLUSH_TIME_LIMIT = 20 # seconds
+# Batches grow with the depth of data_queue from BATCH_SIZE up to MAX_BATCH_SIZE listings,
+# as long as a listing is still expected to be committed within WRITER_LATENCY_SLO seconds after it was popped
 BATCH_SIZE = 10 
+MAX_BATCH_SIZE = 5000
+WRITER_LATENCY_SLO = 5 # seconds
+# Used when WRITER_MODE=parallel: processes transforming messages and coroutines writing to postgres
+WRITER_PROCESSES = 4
+WRITER_DB_WRITERS = 2
+# A batch that fails for another reason than its listings (e.g. postgres is down) is retried after a delay
+# that doubles from WRITER_RETRY_DELAY up to WRITER_RETRY_MAX_DELAY seconds while the failures repeat
+WRITER_RETRY_DELAY = 1 # seconds
+WRITER_RETRY_MAX_DELAY = 60 # seconds
+
+# --- QUEUES --- #
+# Consumers refresh a heartbeat key while they pop and while they work on a message; the in-flight messages
+# of a consumer whose heartbeat expired are put back on the queue by the others, checking every QUEUE_REAP_INTERVAL seconds
+QUEUE_HEARTBEAT_TTL = 300 # seconds
+QUEUE_REAP_INTERVAL = 60 # seconds
+# Used when QUEUE_TRANSPORT=stream: streams are trimmed to about this many messages
+QUEUE_STREAM_MAXLEN = 1_000_000
+# Messages the writer can't process go to a dead-letter stream (data_queue:dead), trimmed to about this many
+DEAD_LETTER_MAXLEN = 100_000
@@ -6,14 +6,21 @@ import redis
 import uuid
 
 from dotenv import load_dotenv
+from httpx import HTTPError
 from parsel import Selector
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import Error as PlaywrightError
 from prometheus_client import CollectorRegistry, Gauge, Counter, push_to_gateway
-from random import random, choice
 from sys import exit
 from time import sleep
-
-from config import CRAWLER_THROTTLE_SPEED_MAX, CRAWLER_THROTTLE_SPEED_MIN
+from typing import List, Optional, Tuple
+
+from config import CRAWLER_RATE_START, CRAWLER_RATE_MIN, CRAWLER_RATE_MAX, CRAWLER_REGIONS, CRAWLER_MAX_PAGES, CRAWLER_EMPTY_PAGES
+from dedup import make_seen_set
+from fetchers import FetchResult, is_blocked, make_fetcher, page_title, CAPTCHA_TITLE, STORING_TITLE
+from queues import make_queue
+from ratelimit import RateController
+from tasks import PageTasks
+from urls import funda_id_from_url, search_url
 load_dotenv()   
 
 logging.basicConfig(
@@ -29,20 +36,10 @@ r = redis.Redis(
     password=os.getenv("REDIS_PASSWORD") or None
 )
 
-dedup_push_script = r.register_script("""
-    local set_key = KEYS[1]
-    local list_key = KEYS[2]
-    local url = ARGV[1]
-    local payload = ARGV[2]
-
-    if redis.call("SISMEMBER", set_key, url) == 0 then
-        redis.call("SADD", set_key, url)
-        redis.call("LPUSH", list_key, payload)
-        return 1
-    else
-        return 0
-    end
-""")
+FETCHER_BACKEND = os.getenv("FETCHER_BACKEND", "http")
+DEDUP_STORE = os.getenv("DEDUP_STORE", "exact")
+CRAWLER_MODE = os.getenv("CRAWLER_MODE", "full")
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
 
 # prometheus stuff
 PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "localhost:9091")
@@ -65,16 +62,13 @@ cur = conn.cursor()
 
 
 class Crawler:
-    """Takes the name of an area and returns all available listings in the area"""
-    def __init__(self, area: str):
-        self.area = area
-        self.cleaned_area = area.lower().replace(" ", "-")
-        self.base_url = 'https://www.funda.nl/zoeken/koop?selected_area=["tilburg","amsterdam","rotterdam","den-haag","utrecht","eindhoven","groningen"]&availability=["unavailable"]&search_result='
-
+    """Crawls the search result pages of the given regions and queues every listing not seen before"""
+    def __init__(self, regions: list[str] = CRAWLER_REGIONS, max_pages: int = CRAWLER_MAX_PAGES, incremental: bool = False):
+        self.regions = [region.lower().replace(" ", "-") for region in regions]
+        self.max_pages = max_pages
+        self.incremental = incremental
 
-        # self.base_url = f"https://www.funda.nl/zoeken/koop/?selected_area=[\"{self.cleaned_area}\"]&availability=[\"unavailable\"]&search_result="
-        # self.name= f"Crawler-{area}-{uuid.uuid4().hex[:6]}"
-        self.name= f"Crawler-All-{uuid.uuid4().hex[:6]}"
+        self.name= f"Crawler-{uuid.uuid4().hex[:6]}"
         self.logger = logging.getLogger(self.name)
         self.logger.info(f"Initialized crawler {self.name}.")
         # prometheus information
@@ -87,123 +81,200 @@ class Crawler:
         )
         self.captchas = Counter('crawler_captchas', 'Number of captchas served', registry=registry)
         self.storing = Counter('crawler_storing', 'Number of storingen served', registry=registry)
+        self.fetches = Counter('crawler_fetches_total', 'Number of fetches per backend', ['backend'], registry=registry)
+        self.seen_memory = Gauge('crawler_seen_set_memory_bytes', 'Redis memory used by the seen-set', registry=registry)
+        self.seen_fill = Gauge('crawler_seen_set_fill_ratio', 'Fill ratio of the seen-set', registry=registry)
+        self.fetcher = make_fetcher(FETCHER_BACKEND)
+        self.seen = make_seen_set(r, DEDUP_STORE)
+        self.queue = make_queue(r, "listing_queue", self.name, QUEUE_TRANSPORT)
+        self.tasks = PageTasks(r, self.name, "incremental" if incremental else "full")
+        self.request_rate = Gauge('crawler_request_rate', 'Request rate shared by all crawlers, per second', registry=registry)
+        self.limiter = RateController(r, "crawler", CRAWLER_RATE_START, CRAWLER_RATE_MIN, CRAWLER_RATE_MAX)
+
+    def record_response(self, result: FetchResult) -> bool:
+        """
+        Counts the status code and block pages of a fetch, including a blocked attempt that was retried.
+        Returns whether funda blocked the fetch or the attempt before it.
+        """
+        blocked = False
+        if result.fallback_from:
+            blocked = self.record_response(result.fallback_from)
+
+        self.fetches.labels(backend=result.backend).inc()
+        if result.status:
+            self.logger.info(f"Response status ({result.backend}): {result.status}")
+            if result.status == 200:
+                self.status_codes.labels(code='200').inc()
+            if result.status == 403:
+                self.status_codes.labels(code='403').inc()
+            if result.status == 429:
+                self.status_codes.labels(code='429').inc()
+            if result.status in [403, 429]:
+                blocked = True
+
+            # if result.status in [403,429]:
+                # self.logger.info(f"Exiting because of encountering status code {result.status}")
+                # exit(1)
+        else:
+            self.logger.info(f"Response is empty")
+
+        title = page_title(result.content)
+        self.logger.info(f"Page title: {title}")
+
+        # Funda serves a page titled "Je bent bijna op de pagina die je zoekt" 
+        # and a captcha if it suspect bot activity
+        if title and CAPTCHA_TITLE in title:
+            self.logger.info("Encountered Captcha page")
+            self.captchas.inc(1)
+            blocked = True
+        if title and STORING_TITLE in title:
+            self.logger.info("Encountered storing page")
+            self.storing.inc(1)
+            blocked = True
+
+            # self.logger.info("Exiting because served captcha page")
+            # exit(1)
+        return blocked
 
     def crawl_links(self):
-        page_number = 1
-        while True:
-
-            self.logger.info(f"Crawling page {page_number}")
-            url = self.base_url + str(page_number)
-
-            user_agents = [
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_4_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.5790.170 Safari/537.36",
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:117.0) Gecko/20100101 Firefox/117.0",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 13.5; rv:117.0) Gecko/20100101 Firefox/117.0",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Safari/605.1.15",
-                "Mozilla/5.0 (Linux; Android 13; Pixel 6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Mobile Safari/537.36",
-                "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
-            ]
-            ua = choice(user_agents)
-
-            with sync_playwright() as p:
-                self.logger.info(f"Making request to {url} with user agent {ua} ...")
-                browser = p.chromium.launch(headless=False)
-                context = browser.new_context(user_agent=ua)
-                page = context.new_page()
-                response = page.goto(url)            
-                if response:
-                    self.logger.info(f"Response status: {response.status}")
-                    if response.status == 200:
-                        self.status_codes.labels(code='200').inc()
-                    if response.status == 403:
-                        self.status_codes.labels(code='403').inc()
-                    if response.status == 429:
-                        self.status_codes.labels(code='429').inc()
-
-                    # if response.status in [403,429]:
-                        # self.logger.info(f"Exiting because of encountering status code {response.status}")
-                        # exit(1)
+        """Works on the page tasks of the running sweep, or starts a new one, until the sweep is done"""
+        # incremental sweeps start at the first page of every region and chain the next pages
+        seeded = self.tasks.start_sweep(self.regions, 1 if self.incremental else self.max_pages)
+        if seeded:
+            self.logger.info(f"Started a sweep of {seeded} pages")
+
+        try:
+            while True:
+                task = self.tasks.claim(timeout=5)
+                if task is None:
+                    if not self.tasks.running():
+                        self.logger.info("Quitting because the sweep is done")
+                        break
+                    # the last pages are still being crawled by other workers
+                    continue
+
+                raw, task = task
+                region, page_number = task["region"], task["page"]
+                if self.tasks.is_exhausted(region):
+                    self.tasks.finish(raw)
+                    continue
+
+                try:
+                    with self.tasks.keepalive():
+                        # wait for our turn at the rate shared by all crawlers
+                        sleeptime = self.limiter.acquire()
+                        self.logger.info(f"Sleeping {sleeptime} seconds.")
+                        sleep(sleeptime)
+
+                        pushed, funda_ids, blocked = self.crawl_page(region, page_number)
+                except (PlaywrightError, HTTPError) as e:
+                    self.logger.error(f"Failed to crawl page {page_number} of {region}, retrying later: {e}")
+                    self.tasks.retry(raw)
+                    continue
+
+                # a blocked page says nothing about the listings of the region, so it neither ends an
+                # incremental chain nor moves its high-water mark
+                if blocked:
+                    self.logger.warning(f"Page {page_number} of {region} was blocked, retrying later")
+                    self.tasks.retry(raw)
+                    continue
+
+                if self.incremental:
+                    self.tasks.finish(raw, self.next_page(task, pushed, funda_ids))
                 else:
-                    self.logger.info(f"Response is empty")
-                # wait for the page to load
-                page.wait_for_load_state("networkidle")
-                content = page.content()
-                selector = Selector(text = content)
-                
-                title = selector.css("title::text").get()
-                self.logger.info(f"Page title: {title}")
-
-                # Funda serves a page titled "Je bent bijna op de pagina die je zoekt" 
-                # and a captcha if it suspect bot activity
-                if title and "Je bent bijna op de pagina die" in title:
-                    self.logger.info("Encountered Captcha page")
-                    self.captchas.inc(1)
-                if title and "Storing" in title:
-                    self.logger.info("Encountered storing page")
-                    self.storing.inc(1)
-
-                    # self.logger.info("Exiting because served captcha page")
-                    # exit(1)
-                
-                
-
-                # gets the listing urls from the ordered list
-                urls = selector.css("div.flex.flex-col.gap-3.mt-4 a::attr(href)").getall()
-
-                # filter only listing pages while ommitting duplicates
-                urls = list(set([url for url in urls if url.startswith("/detail/")]))
-                self.logger.info(urls)
-
-
-                i = 0 
-                for url in urls:
-                    # filter if url already in postgres
-                    cur.execute("SELECT 1 FROM listings WHERE url = %s LIMIT 1;", (urls,))
-                    if cur.fetchone():
-                        continue
-                    
-                    listing = {
-                        "sender": self.name,
-                        "url": url,
-                        "area": self.cleaned_area
-                    }
-                    pushed = dedup_push_script(
-                        keys=["listing_seen", "listing_queue"],
-                        args=[url, json.dumps(listing)]
-                    )
-
-                    # only push if no duplicate in redis or postgres
-                    if pushed == 1:
-                        self.new_pages_found.inc()
-                        i += 1
-                
-                push_to_gateway(PUSHGATEWAY_URL, 
-                                job=self.name, 
-                                # instance= self.name, 
-                                registry=registry)
-
-
-                self.logger.info(f"Succesfully pushed {i} urls.")
-                
-                browser.close()
-
-            page_number += 1
-            sleeptime = random() * (CRAWLER_THROTTLE_SPEED_MAX - CRAWLER_THROTTLE_SPEED_MIN) + CRAWLER_THROTTLE_SPEED_MIN
-
-            self.logger.info(f"Sleeping {sleeptime} seconds.")
-            sleep(sleeptime)
-
-            if page_number > 166:
-                self.logger.info(f"Quitting because page number is {page_number}")
-                quit(0)
-
-
-
+                    if pushed == 0:
+                        self.logger.info(f"No new listings on page {page_number} of {region}, skipping its other pages")
+                        self.tasks.exhaust(region)
+                    self.tasks.finish(raw)
+        finally:
+            self.fetcher.close()
+
+    def next_page(self, task: dict, pushed: int, funda_ids: List[str]) -> Optional[dict]:
+        """The follow-up task of a page of an incremental sweep that was not blocked, None when the region is done"""
+        region, page_number = task["region"], task["page"]
+        if page_number == 1 and funda_ids:
+            self.tasks.propose_high_water(region, funda_ids[0])
+
+        # consecutive pages without new listings
+        empty = 0 if pushed else task.get("empty", 0) + 1
+
+        high_water = self.tasks.high_water(region)
+        if high_water in funda_ids:
+            self.logger.info(f"Reached the high-water mark of {region} on page {page_number}")
+        elif empty >= CRAWLER_EMPTY_PAGES:
+            self.logger.info(f"No new listings on the last {empty} pages of {region}")
+        elif not funda_ids or page_number >= self.max_pages:
+            self.logger.info(f"Reached the last page of {region}")
+        else:
+            return {"region": region, "page": page_number + 1, "empty": empty}
+
+        self.tasks.commit_high_water(region)
+        return None
+
+    def crawl_page(self, region: str, page_number: int) -> Tuple[int, List[str], bool]:
+        """
+        Crawls a single search result page.
+
+        Returns:
+            the number of new listings pushed, the funda ids of all listings on the page, in page order,
+            and whether funda blocked the page, also after falling back to the browser
+        """
+        self.logger.info(f"Crawling page {page_number} of {region}")
+        url = search_url(region, page_number, recent_first=self.incremental)
+
+        result = self.fetcher.fetch(url)
+        blocked = self.record_response(result)
+        self.request_rate.set(self.limiter.feedback(blocked))
+        # a block page has no listings to parse, the page is fetched again later
+        if is_blocked(result.content, result.status):
+            return 0, [], True
+
+        selector = Selector(text = result.content)
+
+        # gets the listing urls from the ordered list
+        urls = selector.css("div.flex.flex-col.gap-3.mt-4 a::attr(href)").getall()
+
+        # filter only listing pages while ommitting duplicates, keeping the order of the page
+        urls = list(dict.fromkeys([url for url in urls if url.startswith("/detail/")]))
+        self.logger.info(urls)
+
+
+        # key the urls on funda id, which is also what the scraper stores
+        listings = {funda_id_from_url(url): url for url in urls}
+
+        # filter the listings already in postgres in a single query
+        cur.execute("SELECT funda_id FROM listings WHERE funda_id = ANY(%s);", (list(listings),))
+        known = {row[0] for row in cur.fetchall()}
+
+        items = []
+        for funda_id, url in listings.items():
+            if funda_id in known:
+                continue
+            listing = {
+                "sender": self.name,
+                "url": url,
+                "area": region
+            }
+            items.append((funda_id, json.dumps(listing)))
+
+        # only push if no duplicate in redis or postgres
+        i = self.seen.push_new(items, self.queue)
+        self.new_pages_found.inc(i)
+        self.seen_memory.set(self.seen.memory_bytes())
+        self.seen_fill.set(self.seen.fill_ratio())
+        
+        push_to_gateway(PUSHGATEWAY_URL, 
+                        job=self.name, 
+                        # instance= self.name, 
+                        registry=registry)
+
+
+        self.logger.info(f"Succesfully pushed {i} urls.")
+        return i, list(listings), False
 
 
 if __name__ == "__main__":
-    crawler = Crawler("Tilburg")
+    crawler = Crawler(incremental=CRAWLER_MODE == "incremental")
     crawler.crawl_links()
 
     
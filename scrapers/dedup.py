@@ -0,0 +1,133 @@
+import hashlib
+import math
+import redis
+
+from typing import List, Tuple
+
+from config import BLOOM_CAPACITY, BLOOM_ERROR_RATE
+from queues import PUSH
+
+# pushes every (funda_id, payload) pair of the batch whose funda_id was not seen before
+EXACT_PUSH = PUSH + """
+    local set_key = KEYS[1]
+    local queue_key = KEYS[2]
+    local pushed = 0
+
+    for i = 3, #ARGV, 2 do
+        if redis.call("SADD", set_key, ARGV[i]) == 1 then
+            push(queue_key, ARGV[i + 1])
+            pushed = pushed + 1
+        end
+    end
+    return pushed
+"""
+
+# ARGV (after the push arguments): number of hashes k, followed by a payload and its k bit offsets for every item of the batch
+BLOOM_PUSH = PUSH + """
+    local bits_key = KEYS[1]
+    local queue_key = KEYS[2]
+    local k = tonumber(ARGV[3])
+    local pushed = 0
+
+    for i = 4, #ARGV, k + 1 do
+        local seen = true
+        for j = 1, k do
+            if redis.call("GETBIT", bits_key, ARGV[i + j]) == 0 then
+                seen = false
+                break
+            end
+        end
+        if not seen then
+            for j = 1, k do
+                redis.call("SETBIT", bits_key, ARGV[i + j], 1)
+            end
+            push(queue_key, ARGV[i])
+            pushed = pushed + 1
+        end
+    end
+    return pushed
+"""
+
+
+def memory_usage(r: redis.Redis, key: str) -> int:
+    # MEMORY USAGE is disabled on some hosted redis servers and missing in fakeredis
+    try:
+        return r.memory_usage(key) or 0
+    except redis.ResponseError:
+        return 0
+
+
+class ExactSeenSet:
+    """Remembers every funda id ever pushed in a redis set"""
+    def __init__(self, r: redis.Redis, key: str = "listing_seen"):
+        self.r = r
+        self.key = key
+        self.push_script = r.register_script(EXACT_PUSH)
+
+    def push_new(self, items: List[Tuple[str, str]], queue) -> int:
+        """Atomically pushes the payload of every (funda_id, payload) pair with an unseen funda_id to the queue"""
+        if not items:
+            return 0
+        args = queue.push_args()
+        for funda_id, payload in items:
+            args += [funda_id, payload]
+        return self.push_script(keys=[self.key, queue.name], args=args)
+
+    def memory_bytes(self) -> int:
+        return memory_usage(self.r, self.key)
+
+    def fill_ratio(self) -> float:
+        # an exact set never saturates
+        return 0.0
+
+
+class BloomSeenSet:
+    """
+    Remembers funda ids in a bloom filter stored as a redis bitmap.
+
+    Uses a fixed amount of memory for `capacity` ids at the cost of wrongly treating
+    a fraction `error_rate` of new ids as seen.
+    """
+    def __init__(self, r: redis.Redis, key: str = "listing_seen_bloom", capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.r = r
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        # optimal filter size and number of hashes for the given capacity and error rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+
+        self.push_script = r.register_script(BLOOM_PUSH)
+
+    def offsets(self, funda_id: str) -> List[int]:
+        """Bit offsets of an id, derived from a single digest with double hashing"""
+        digest = hashlib.blake2b(funda_id.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def push_new(self, items: List[Tuple[str, str]], queue) -> int:
+        """Atomically pushes the payload of every (funda_id, payload) pair with an unseen funda_id to the queue"""
+        if not items:
+            return 0
+        args = [*queue.push_args(), self.hashes]
+        for funda_id, payload in items:
+            args += [payload, *self.offsets(funda_id)]
+        return self.push_script(keys=[self.key, queue.name], args=args)
+
+    def memory_bytes(self) -> int:
+        return memory_usage(self.r, self.key)
+
+    def fill_ratio(self) -> float:
+        """Fraction of bits set; the false positive rate grows as fill_ratio ** hashes"""
+        return self.r.bitcount(self.key) / self.size
+
+
+def make_seen_set(r: redis.Redis, store: str = "exact"):
+    """Builds the seen-set for the given store: "exact" or "bloom"."""
+    if store == "exact":
+        return ExactSeenSet(r)
+    if store == "bloom":
+        return BloomSeenSet(r)
+    raise ValueError(f"Unknown dedup store: {store}")
@@ -0,0 +1,69 @@
+from lxml import etree
+from parsel import Selector
+from parsel.csstranslator import HTMLTranslator
+from typing import Optional
+
+# The selectors are translated to XPath and compiled once at import,
+# every page is then parsed a single time and walked in place.
+_translator = HTMLTranslator()
+
+
+def _compile(css: str) -> etree.XPath:
+    return etree.XPath(_translator.css_to_xpath(css))
+
+
+# --- about box --- #
+# Contains: address, postal code, neighborhood
+TITLE = _compile("div#about h1 span::text")
+POSTCODE = _compile("div#about span.text-neutral-40::text")
+BUURT = _compile("div#about a.ml-2.text-secondary-70::text")
+
+# --- purchase history --- #
+# contains: offered since, purchase date, duration
+PURCHASE_HISTORY = _compile("section.mt-6.border-b.border-neutral-20 dl div")
+PURCHASE_HISTORY_KEY = _compile("dt::text")
+PURCHASE_HISTORY_VALUE = _compile("dd::text")
+
+# --- features --- #
+# contains: most everything else
+FEATURES = _compile("section#features div dl")
+FEATURE_KEY = _compile("dt::text")
+FEATURE_VALUE = _compile("dd span::text")
+
+
+def _first(xpath: etree.XPath, node) -> Optional[str]:
+    result = xpath(node)
+    return str(result[0]) if result else None
+
+
+def extract_listing(content: str, info: Optional[dict] = None) -> dict:
+    """
+    Extracts the listing data from the html of a listing page.
+
+    Parameters:
+        content (str): html of the listing page
+        info (dict): dict to add the data to, e.g. with the funda_id, url and scraped_at already filled in
+
+    Returns:
+        info, with the about box, purchase history and features added
+    """
+    if info is None:
+        info = {}
+
+    root = Selector(text=content).root
+
+    info["Titel"] = _first(TITLE, root)
+    info["Postcode"] = _first(POSTCODE, root)
+    info["Buurt"] = _first(BUURT, root)
+
+    for element in PURCHASE_HISTORY(root):
+        key = _first(PURCHASE_HISTORY_KEY, element)
+        if key:
+            info[key] = _first(PURCHASE_HISTORY_VALUE, element)
+
+    for element in FEATURES(root):
+        key = _first(FEATURE_KEY, element)
+        if key:
+            info[key] = _first(FEATURE_VALUE, element)
+
+    return info
@@ -0,0 +1,184 @@
+import httpx
+import logging
+import re
+
+from random import choice
+from typing import NamedTuple, Optional
+
+from browser_pool import BrowserPool, AsyncBrowserPool
+from config import USER_AGENTS, HTTP_TIMEOUT, HTTP_MAX_CONNECTIONS
+
+# Funda serves a page titled "Je bent bijna op de pagina die je zoekt"
+# and a captcha if it suspect bot activity
+CAPTCHA_TITLE = "Je bent bijna op de pagina die"
+STORING_TITLE = "Storing"
+# statuses funda answers with when it throttles or bans a client
+BLOCKED_STATUSES = (403, 429)
+
+TITLE_PATTERN = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+
+class FetchResult(NamedTuple):
+    url: str
+    status: Optional[int]
+    content: str
+    backend: str
+    # the blocked result of the primary backend when the page had to be fetched again
+    fallback_from: Optional["FetchResult"] = None
+
+
+class Blocked(Exception):
+    """Funda served a block page instead of the requested page, so the page has to be fetched again later"""
+
+
+def page_title(content: str) -> Optional[str]:
+    """Returns the title of an html page without parsing the whole document"""
+    match = TITLE_PATTERN.search(content)
+    return match.group(1).strip() if match else None
+
+
+def is_blocked(content: str, status: Optional[int] = None) -> bool:
+    """Whether funda answered with a 403 or 429 status, or served a captcha or storing page instead of the requested page"""
+    if status in BLOCKED_STATUSES:
+        return True
+    title = page_title(content)
+    return bool(title) and (CAPTCHA_TITLE in title or STORING_TITLE in title)
+
+
+def http_headers() -> dict:
+    return {
+        "User-Agent": choice(USER_AGENTS),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "nl-NL,nl;q=0.9,en;q=0.8",
+    }
+
+
+class HttpFetcher:
+    """Fetches server rendered html with a pooled keep-alive HTTP/2 client"""
+    def __init__(self):
+        # httpx negotiates gzip/brotli compression by itself
+        self.client = httpx.Client(
+            http2=True,
+            headers=http_headers(),
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+
+    def fetch(self, url: str) -> FetchResult:
+        response = self.client.get(url)
+        return FetchResult(url, response.status_code, response.text, "http")
+
+    def close(self):
+        self.client.close()
+
+
+class PlaywrightFetcher:
+    """Fetches fully rendered pages with a (pooled) browser"""
+    def __init__(self, browser_pool: Optional[BrowserPool] = None):
+        self.browser_pool = browser_pool or BrowserPool()
+
+    def fetch(self, url: str) -> FetchResult:
+        with self.browser_pool.page() as page:
+            response = page.goto(url)
+            # wait for the page to load
+            page.wait_for_load_state("networkidle")
+            content = page.content()
+        return FetchResult(url, response.status if response else None, content, "playwright")
+
+    def close(self):
+        self.browser_pool.close()
+
+
+class FallbackFetcher:
+    """Fetches with the primary backend and only retries with the fallback backend when the page is blocked"""
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.logger = logging.getLogger("FallbackFetcher")
+
+    def fetch(self, url: str) -> FetchResult:
+        result = self.primary.fetch(url)
+        if not is_blocked(result.content, result.status):
+            return result
+
+        self.logger.info(f"{result.backend} fetch of {url} was blocked, falling back to {type(self.fallback).__name__}")
+        return self.fallback.fetch(url)._replace(fallback_from=result)
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+class AsyncHttpFetcher:
+    """Async counterpart of HttpFetcher"""
+    def __init__(self, max_connections: int = HTTP_MAX_CONNECTIONS):
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers=http_headers(),
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+
+    async def fetch(self, url: str) -> FetchResult:
+        response = await self.client.get(url)
+        return FetchResult(url, response.status_code, response.text, "http")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AsyncPlaywrightFetcher:
+    """Async counterpart of PlaywrightFetcher"""
+    def __init__(self, browser_pool: AsyncBrowserPool):
+        self.browser_pool = browser_pool
+
+    async def fetch(self, url: str) -> FetchResult:
+        async with self.browser_pool.page() as (page, user_agent):
+            response = await page.goto(url)
+            # wait for the page to load
+            await page.wait_for_load_state("networkidle")
+            content = await page.content()
+        return FetchResult(url, response.status if response else None, content, "playwright")
+
+    async def close(self):
+        await self.browser_pool.close()
+
+
+class AsyncFallbackFetcher(FallbackFetcher):
+    """Async counterpart of FallbackFetcher"""
+    async def fetch(self, url: str) -> FetchResult:
+        result = await self.primary.fetch(url)
+        if not is_blocked(result.content, result.status):
+            return result
+
+        self.logger.info(f"{result.backend} fetch of {url} was blocked, falling back to {type(self.fallback).__name__}")
+        return (await self.fallback.fetch(url))._replace(fallback_from=result)
+
+    async def close(self):
+        await self.primary.close()
+        await self.fallback.close()
+
+
+def make_fetcher(backend: str = "http"):
+    """
+    Builds the fetcher for the given backend.
+
+    "http" fetches over plain HTTP and falls back to the browser on captcha/storing pages,
+    "playwright" always uses the browser.
+    """
+    if backend == "playwright":
+        return PlaywrightFetcher()
+    if backend == "http":
+        return FallbackFetcher(HttpFetcher(), PlaywrightFetcher())
+    raise ValueError(f"Unknown fetcher backend: {backend}")
+
+
+def make_async_fetcher(concurrency: int, backend: str = "http"):
+    """Async counterpart of make_fetcher; keeps up to `concurrency` pages in flight"""
+    if backend == "playwright":
+        return AsyncPlaywrightFetcher(AsyncBrowserPool(size=concurrency))
+    if backend == "http":
+        return AsyncFallbackFetcher(AsyncHttpFetcher(max_connections=concurrency), AsyncPlaywrightFetcher(AsyncBrowserPool(size=concurrency)))
+    raise ValueError(f"Unknown fetcher backend: {backend}")
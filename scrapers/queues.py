@@ -0,0 +1,419 @@
+import logging
+import redis
+import threading
+
+from time import time
+from typing import Iterator, List, Optional, Tuple
+
+from config import DEAD_LETTER_MAXLEN, QUEUE_HEARTBEAT_TTL, QUEUE_REAP_INTERVAL, QUEUE_STREAM_MAXLEN
+
+# Lua helper for scripts that push onto a queue, which take the queue's push_args() as ARGV[1] and ARGV[2]
+PUSH = """
+    local function push(queue, payload)
+        if ARGV[1] == "XADD" then
+            redis.call("XADD", queue, "MAXLEN", "~", ARGV[2], "*", "data", payload)
+        else
+            redis.call("LPUSH", queue, payload)
+        end
+    end
+"""
+
+# moves up to ARGV[1] messages from the queue to a processing list, returns the remaining depth and the messages
+MOVE_MANY = """
+    local queue = KEYS[1]
+    local processing = KEYS[2]
+    local items = {}
+
+    for i = 1, tonumber(ARGV[1]) do
+        local item = redis.call("RPOP", queue)
+        if not item then
+            break
+        end
+        redis.call("LPUSH", processing, item)
+        items[i] = item
+    end
+    return {redis.call("LLEN", queue), items}
+"""
+
+# moves every message of a processing list back onto the queue (ARGV[1] is the side to push to).
+# When a heartbeat key is given, only does so when the consumer stopped heartbeating.
+REQUEUE = """
+    local processing = KEYS[1]
+    local queue = KEYS[2]
+    if KEYS[3] and redis.call("EXISTS", KEYS[3]) == 1 then
+        return 0
+    end
+
+    local moved = 0
+    while true do
+        local item = redis.call("RPOP", processing)
+        if not item then
+            break
+        end
+        redis.call(ARGV[1], queue, item)
+        moved = moved + 1
+    end
+    return moved
+"""
+
+
+class KeepAlive:
+    """
+    Context manager that touches the in-flight messages of a queue every third of its heartbeat TTL
+    while the block runs, so messages aren't reaped while a slow fetch or a long rate-limiter sleep
+    holds them up. The touching stops with the process, after which the messages are reaped as usual.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"{queue.name}-keepalive", daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.queue.heartbeat_ttl / 3):
+            try:
+                self.queue.touch()
+            except Exception as e:
+                self.queue.logger.error(f"Failed to touch in-flight messages: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ReliableQueue:
+    """
+    At-least-once consumer of a redis list.
+
+    Popped messages are moved into a processing list of the consumer and only removed once they
+    are acknowledged, so a crash never loses them. Messages can be popped under different leases
+    (one processing list each) to acknowledge a whole batch at once.
+
+    Every consumer keeps a heartbeat key alive while it pops, or for as long as it runs under
+    keepalive(), and periodically reaps the processing lists of consumers whose heartbeat expired by
+    putting their messages back on the queue.
+    """
+    def __init__(self, r: redis.Redis, name: str, consumer: str, heartbeat_ttl: int = QUEUE_HEARTBEAT_TTL, reap_interval: int = QUEUE_REAP_INTERVAL):
+        self.r = r
+        self.name = name
+        self.consumer = consumer
+        self.heartbeat_ttl = heartbeat_ttl
+        self.reap_interval = reap_interval
+        self.heartbeat_key = f"{name}:heartbeat:{consumer}"
+        self.logger = logging.getLogger(f"{consumer}-{name}")
+
+        self.move_many_script = r.register_script(MOVE_MANY)
+        self.requeue_script = r.register_script(REQUEUE)
+        self.last_reap = 0
+
+    def push_args(self) -> list:
+        return ["LPUSH", 0]
+
+    def push(self, payloads: List[str | bytes]):
+        """Pushes the payloads onto the queue in a single round trip"""
+        if payloads:
+            self.r.lpush(self.name, *payloads)
+
+    def lag(self) -> int:
+        """Number of messages waiting to be popped"""
+        return self.r.llen(self.name)
+
+    def processing(self, lease: str = "0") -> str:
+        return f"{self.name}:processing:{self.consumer}:{lease}"
+
+    def touch(self):
+        """Refreshes the heartbeat, so the messages in flight are not reaped"""
+        self.r.set(self.heartbeat_key, 1, ex=self.heartbeat_ttl)
+
+    def keepalive(self) -> KeepAlive:
+        return KeepAlive(self)
+
+    def heartbeat(self):
+        self.touch()
+        if time() - self.last_reap > self.reap_interval:
+            self.reap()
+
+    def pop(self, timeout: float, lease: str = "0") -> Optional[bytes]:
+        """Blocks for at most `timeout` seconds for a single message"""
+        self.heartbeat()
+        return self.r.blmove(self.name, self.processing(lease), timeout, src="RIGHT", dest="LEFT")
+
+    def pop_many(self, count: int, timeout: float, lease: str = "0") -> Tuple[List[bytes], int]:
+        """
+        Pops up to `count` messages and reads the queue depth in a single round trip.
+        Blocks for at most `timeout` seconds when the queue is empty.
+        """
+        self.heartbeat()
+        depth, raws = self.move_many_script(keys=[self.name, self.processing(lease)], args=[count])
+        if raws:
+            return raws, depth
+
+        raw = self.r.blmove(self.name, self.processing(lease), timeout, src="RIGHT", dest="LEFT")
+        return ([raw] if raw else []), 0
+
+    def ack(self, raw: bytes, lease: str = "0"):
+        """Acknowledges a single message"""
+        self.r.lrem(self.processing(lease), -1, raw)
+
+    def ack_many(self, raws: List[bytes], lease: str = "0"):
+        """Acknowledges some of the messages popped under the lease in a single round trip"""
+        pipe = self.r.pipeline(transaction=False)
+        for raw in raws:
+            pipe.lrem(self.processing(lease), -1, raw)
+        pipe.execute()
+
+    def nack(self, raw: bytes, lease: str = "0"):
+        """Puts a single message at the back of the queue to be retried later"""
+        pipe = self.r.pipeline()
+        pipe.lrem(self.processing(lease), -1, raw)
+        pipe.lpush(self.name, raw)
+        pipe.execute()
+
+    def ack_lease(self, lease: str = "0"):
+        """Acknowledges every message popped under the lease"""
+        self.r.delete(self.processing(lease))
+
+    def nack_lease(self, lease: str = "0") -> int:
+        """Puts every message popped under the lease at the back of the queue to be retried later"""
+        return self.requeue_script(keys=[self.processing(lease), self.name], args=["LPUSH"])
+
+    def reap(self) -> int:
+        """Puts the in-flight messages of consumers that stopped heartbeating back at the front of the queue"""
+        self.last_reap = time()
+        reaped = 0
+        for key in self.r.scan_iter(match=f"{self.name}:processing:*", count=1000):
+            consumer = key.decode().split(":")[-2]
+            heartbeat_key = f"{self.name}:heartbeat:{consumer}"
+            reaped += self.requeue_script(keys=[key, self.name, heartbeat_key], args=["RPUSH"])
+
+        if reaped:
+            self.logger.info(f"Re-queued {reaped} stale in-flight messages")
+        return reaped
+
+
+class StreamQueue:
+    """
+    At-least-once consumer of a redis stream, with the same interface as ReliableQueue.
+
+    Consumers read through a shared consumer group, so messages stay in the stream until it is
+    trimmed (MAXLEN ~ `maxlen`) and can be replayed or read by other groups. Read messages stay
+    pending in the group until they are acknowledged; messages pending for longer than
+    `heartbeat_ttl` seconds belong to a dead consumer and are claimed by the others. Under
+    keepalive(), the consumer resets the idle time of its own in-flight messages so that never happens
+    to them, however long they take.
+    """
+    def __init__(self, r: redis.Redis, name: str, consumer: str, group: str = "workers", heartbeat_ttl: int = QUEUE_HEARTBEAT_TTL,
+                 reap_interval: int = QUEUE_REAP_INTERVAL, maxlen: int = QUEUE_STREAM_MAXLEN):
+        self.r = r
+        self.name = name
+        self.consumer = consumer
+        self.group = group
+        self.heartbeat_ttl = heartbeat_ttl
+        self.reap_interval = reap_interval
+        self.maxlen = maxlen
+        self.logger = logging.getLogger(f"{consumer}-{name}")
+
+        # lease -> [(message id, payload)] read but not acknowledged yet
+        self.leases = {}
+        # messages claimed from dead consumers, handed out by the next pops
+        self.reclaimed = []
+        self.last_reap = 0
+
+        try:
+            r.xgroup_create(name, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def push_args(self) -> list:
+        return ["XADD", self.maxlen]
+
+    def push(self, payloads: List[str | bytes]):
+        """Pushes the payloads onto the stream in a single round trip"""
+        pipe = self.r.pipeline(transaction=False)
+        for payload in payloads:
+            pipe.xadd(self.name, {"data": payload}, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+    def lag(self) -> int:
+        """Number of messages in the stream the group has not read yet"""
+        return self.group_lag(self.r.xinfo_groups(self.name))
+
+    def group_lag(self, groups: list) -> int:
+        for group in groups:
+            if group["name"].decode() == self.group:
+                # redis < 7 does not track the lag
+                if group.get("lag") is not None:
+                    return group["lag"]
+        return self.r.xlen(self.name)
+
+    def touch(self):
+        """Resets the idle time of the messages in flight by claiming them again, so they are not reaped"""
+        # copied, the leases are changed by the consumer while this runs in the keepalive thread
+        message_ids = [message_id for messages in list(self.leases.values()) for message_id, _ in list(messages)]
+        message_ids += [message_id for message_id, _ in list(self.reclaimed)]
+        for start in range(0, len(message_ids), 1000):
+            self.r.xclaim(self.name, self.group, self.consumer, 0, message_ids[start:start + 1000], justid=True)
+
+    def keepalive(self) -> KeepAlive:
+        return KeepAlive(self)
+
+    def heartbeat(self):
+        # the idle time of pending messages replaces the heartbeat key of ReliableQueue
+        if time() - self.last_reap > self.reap_interval:
+            self.reap()
+
+    def read(self, count: int, timeout: float, lease: str, with_lag: bool = False) -> Tuple[List[bytes], int]:
+        self.heartbeat()
+        messages = self.reclaimed[:count]
+        del self.reclaimed[:count]
+        lag = 0
+
+        if len(messages) < count:
+            pipe = self.r.pipeline(transaction=False)
+            # don't block when there are reclaimed messages to hand out
+            pipe.xreadgroup(self.group, self.consumer, {self.name: ">"}, count=count - len(messages),
+                            block=None if messages else max(1, int(timeout * 1000)))
+            if with_lag:
+                pipe.xinfo_groups(self.name)
+            results = pipe.execute()
+            for _, entries in results[0] or []:
+                messages += [(message_id, fields[b"data"]) for message_id, fields in entries]
+            if with_lag:
+                lag = self.group_lag(results[1])
+
+        self.leases.setdefault(lease, []).extend(messages)
+        return [payload for _, payload in messages], lag
+
+    def pop(self, timeout: float, lease: str = "0") -> Optional[bytes]:
+        """Blocks for at most `timeout` seconds for a single message"""
+        raws, _ = self.read(1, timeout, lease)
+        return raws[0] if raws else None
+
+    def pop_many(self, count: int, timeout: float, lease: str = "0") -> Tuple[List[bytes], int]:
+        """
+        Reads up to `count` messages and the consumer lag in a single round trip.
+        Blocks for at most `timeout` seconds when the stream has no new messages.
+        """
+        return self.read(count, timeout, lease, with_lag=True)
+
+    def take(self, raw: bytes, lease: str) -> Optional[bytes]:
+        """Removes a message from the lease and returns its id"""
+        messages = self.leases.get(lease, [])
+        for i, (message_id, payload) in enumerate(messages):
+            if payload == raw:
+                del messages[i]
+                return message_id
+        return None
+
+    def ack(self, raw: bytes, lease: str = "0"):
+        """Acknowledges a single message"""
+        message_id = self.take(raw, lease)
+        if message_id:
+            self.r.xack(self.name, self.group, message_id)
+
+    def ack_many(self, raws: List[bytes], lease: str = "0"):
+        """Acknowledges some of the messages read under the lease in a single round trip"""
+        message_ids = [message_id for message_id in (self.take(raw, lease) for raw in raws) if message_id]
+        if message_ids:
+            self.r.xack(self.name, self.group, *message_ids)
+
+    def nack(self, raw: bytes, lease: str = "0"):
+        """Adds a single message to the end of the stream to be retried later"""
+        message_id = self.take(raw, lease)
+        pipe = self.r.pipeline()
+        pipe.xadd(self.name, {"data": raw}, maxlen=self.maxlen, approximate=True)
+        if message_id:
+            pipe.xack(self.name, self.group, message_id)
+        pipe.execute()
+
+    def ack_lease(self, lease: str = "0"):
+        """Acknowledges every message read under the lease"""
+        messages = self.leases.pop(lease, [])
+        if messages:
+            self.r.xack(self.name, self.group, *[message_id for message_id, _ in messages])
+
+    def nack_lease(self, lease: str = "0") -> int:
+        """Adds every message read under the lease to the end of the stream to be retried later"""
+        messages = self.leases.pop(lease, [])
+        if not messages:
+            return 0
+        pipe = self.r.pipeline()
+        for _, payload in messages:
+            pipe.xadd(self.name, {"data": payload}, maxlen=self.maxlen, approximate=True)
+        pipe.xack(self.name, self.group, *[message_id for message_id, _ in messages])
+        pipe.execute()
+        return len(messages)
+
+    def reap(self) -> int:
+        """Claims the messages that have been pending for longer than `heartbeat_ttl` seconds"""
+        self.last_reap = time()
+        reaped = 0
+        start = "0-0"
+        while True:
+            start, entries, *deleted = self.r.xautoclaim(self.name, self.group, self.consumer,
+                                                         min_idle_time=self.heartbeat_ttl * 1000, start_id=start, count=1000)
+            for message_id, fields in entries:
+                if fields:
+                    self.reclaimed.append((message_id, fields[b"data"]))
+                    reaped += 1
+            # entries trimmed off the stream while pending
+            if deleted and deleted[0]:
+                self.r.xack(self.name, self.group, *deleted[0])
+            if start in (b"0-0", "0-0"):
+                break
+
+        if reaped:
+            self.logger.info(f"Claimed {reaped} stale pending messages")
+        return reaped
+
+
+class DeadLetters:
+    """
+    Bounded stream of the messages of a queue that failed processing, kept with the stage, field and
+    reason they failed on so they can be re-driven once the cause is fixed. The stream is trimmed to
+    about `maxlen` messages, dropping the oldest, so a broken extractor can't fill up redis.
+    """
+    def __init__(self, r: redis.Redis, queue: str, maxlen: int = DEAD_LETTER_MAXLEN):
+        self.r = r
+        self.name = f"{queue}:dead"
+        self.maxlen = maxlen
+
+    def push(self, failures: List[Tuple[bytes, Tuple[str, str, str]]], consumer: str) -> int:
+        """Adds the (payload, (stage, field, reason)) failures in a single round trip, returns the new length"""
+        pipe = self.r.pipeline(transaction=False)
+        failed_at = int(time())
+        for payload, (stage, field, reason) in failures:
+            pipe.xadd(self.name, {"data": payload, "stage": stage, "field": field, "reason": reason,
+                                  "consumer": consumer, "failed_at": failed_at},
+                      maxlen=self.maxlen, approximate=True)
+        pipe.xlen(self.name)
+        return pipe.execute()[-1]
+
+    def depth(self) -> int:
+        return self.r.xlen(self.name)
+
+    def scan(self, count: int = 1000) -> Iterator[List[Tuple[bytes, dict]]]:
+        """Yields the dead letters oldest first, `count` at a time, as (id, fields) with decoded fields except the payload"""
+        start = "-"
+        while entries := self.r.xrange(self.name, min=start, count=count):
+            yield [(message_id, {key.decode(): value if key == b"data" else value.decode() for key, value in fields.items()})
+                   for message_id, fields in entries]
+            # continue after the last id, exclusive
+            start = b"(" + entries[-1][0]
+
+    def remove(self, message_ids: List[bytes]):
+        if message_ids:
+            self.r.xdel(self.name, *message_ids)
+
+
+def make_queue(r: redis.Redis, name: str, consumer: str, transport: str = "list"):
+    """Builds the queue for the given transport: "list" or "stream"."""
+    if transport == "list":
+        return ReliableQueue(r, name, consumer)
+    if transport == "stream":
+        return StreamQueue(r, name, consumer)
+    raise ValueError(f"Unknown queue transport: {transport}")
@@ -0,0 +1,70 @@
+import redis
+
+from config import RATE_INCREASE, RATE_DECREASE
+
+# Reserves the next request slot of the shared rate, returns how many seconds to wait for it.
+# KEYS: state hash. ARGV: start rate
+ACQUIRE = """
+    local time = redis.call("TIME")
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local rate = tonumber(redis.call("HGET", KEYS[1], "rate") or ARGV[1])
+    local slot = math.max(now, tonumber(redis.call("HGET", KEYS[1], "next") or 0))
+
+    redis.call("HSET", KEYS[1], "next", tostring(slot + 1 / rate))
+    return tostring(slot - now)
+"""
+
+# Adjusts the shared rate to the outcome of a request, returns the new rate.
+# KEYS: state hash. ARGV: blocked (0 or 1), start rate, min rate, max rate, increase, decrease
+FEEDBACK = """
+    local rate = tonumber(redis.call("HGET", KEYS[1], "rate") or ARGV[2])
+    if ARGV[1] == "1" then
+        rate = math.max(tonumber(ARGV[3]), rate * tonumber(ARGV[6]))
+
+        -- back off right away: nobody gets a slot before a full interval of the new rate
+        local time = redis.call("TIME")
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local slot = math.max(now, tonumber(redis.call("HGET", KEYS[1], "next") or 0))
+        redis.call("HSET", KEYS[1], "next", tostring(slot + 1 / rate))
+    else
+        rate = math.min(tonumber(ARGV[4]), rate + tonumber(ARGV[5]))
+    end
+
+    redis.call("HSET", KEYS[1], "rate", tostring(rate))
+    return tostring(rate)
+"""
+
+
+class RateController:
+    """
+    Request rate shared by all workers of a kind, adjusted with additive increase / multiplicative decrease.
+
+    Every clean response raises the rate by `increase` requests per second, and every blocked response
+    (403, 429, captcha or storing page) multiplies it by `decrease`. Workers reserve request slots
+    spaced 1 / rate apart, so the rate holds for all workers together however many there are.
+    """
+    def __init__(self, r: redis.Redis, name: str, start_rate: float, min_rate: float, max_rate: float,
+                 increase: float = RATE_INCREASE, decrease: float = RATE_DECREASE):
+        self.r = r
+        self.key = f"ratelimit:{name}"
+        self.start_rate = start_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        self.acquire_script = r.register_script(ACQUIRE)
+        self.feedback_script = r.register_script(FEEDBACK)
+
+    def acquire(self) -> float:
+        """Reserves the next request slot, returns the number of seconds to wait before making the request"""
+        return float(self.acquire_script(keys=[self.key], args=[self.start_rate]))
+
+    def feedback(self, blocked: bool) -> float:
+        """Reports the outcome of a request, returns the new rate in requests per second"""
+        args = [int(blocked), self.start_rate, self.min_rate, self.max_rate, self.increase, self.decrease]
+        return float(self.feedback_script(keys=[self.key], args=args))
+
+    def rate(self) -> float:
+        rate = self.r.hget(self.key, "rate")
+        return float(rate) if rate else self.start_rate
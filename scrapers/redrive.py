@@ -0,0 +1,89 @@
+"""
+Re-drives the dead-lettered messages of data_queue through the current transforms.
+
+Messages that now pass are pushed back onto data_queue for the writers and removed from the
+dead-letter stream; the others stay where they are. Run it after deploying the fix to the writers.
+
+Usage:
+    python scrapers/redrive.py [--stage STAGE] [--field FIELD] [--reason REASON] [--limit N] [--batch-size N] [--dry-run]
+"""
+import argparse
+import logging
+import os
+import redis
+
+from collections import Counter
+from dotenv import load_dotenv
+
+from queues import DeadLetters, make_queue
+from transform import process_batch
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("redrive")
+
+# redis connection
+r = redis.Redis(
+    host=os.getenv("REDIS_HOST"),
+    port=int(os.getenv("REDIS_PORT", "6379")),
+    db=int(os.getenv("REDIS_DB", "0")),
+    password=os.getenv("REDIS_PASSWORD") or None
+)
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
+
+
+def matches(fields: dict, args) -> bool:
+    return all(getattr(args, key) in (None, fields[key]) for key in ("stage", "field", "reason"))
+
+
+def redrive(dead_letters: DeadLetters, queue, args) -> Counter:
+    """Re-drives the matching dead letters, returns the number of messages by outcome"""
+    outcomes = Counter()
+    seen = 0
+    for entries in dead_letters.scan(args.batch_size):
+        if args.limit is not None and seen >= args.limit:
+            break
+        entries = [(message_id, fields) for message_id, fields in entries if matches(fields, args)]
+        if args.limit is not None:
+            entries = entries[:args.limit - seen]
+        seen += len(entries)
+        if not entries:
+            continue
+
+        listings, failures = process_batch([fields["data"] for _, fields in entries])
+        passed = [entries[i] for i, listing in enumerate(listings) if listing is not None]
+        outcomes["redriven"] += len(passed)
+        for stage, field, reason in failures.values():
+            outcomes[f"still failing: {stage} {field} {reason}"] += 1
+
+        if passed and not args.dry_run:
+            # pushed before they are removed, so a crash in between only re-drives them twice
+            queue.push([fields["data"] for _, fields in passed])
+            dead_letters.remove([message_id for message_id, _ in passed])
+    return outcomes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stage", default=None, help="only re-drive messages that failed in this stage: input, transform, output or write")
+    parser.add_argument("--field", default=None, help="only re-drive messages that failed on this field")
+    parser.add_argument("--reason", default=None, help="only re-drive messages that failed for this reason, e.g. parse or missing")
+    parser.add_argument("--limit", type=int, default=None, help="re-drive at most this many messages")
+    parser.add_argument("--batch-size", type=int, default=1000, help="dead letters read and transformed at a time")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be re-driven")
+    args = parser.parse_args()
+
+    dead_letters = DeadLetters(r, "data_queue")
+    queue = make_queue(r, "data_queue", "redrive", QUEUE_TRANSPORT)
+    logger.info(f"{dead_letters.depth()} messages in {dead_letters.name}")
+
+    outcomes = redrive(dead_letters, queue, args)
+    for outcome, count in sorted(outcomes.items()):
+        logger.info(f"{outcome}: {count}")
+    if args.dry_run:
+        logger.info("Dry run, nothing was re-driven")
@@ -0,0 +1,110 @@
+"""
+Re-extracts the archived listing pages and writes them to the database, replacing the existing rows.
+
+Used to backfill after changing the extractor or the transforms, without fetching from funda again.
+
+Usage:
+    python scrapers/reextract.py [--archive DIR] [--processes N] [--batch-size N] [--dry-run]
+"""
+import argparse
+import logging
+import os
+import sys
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List, Optional
+
+from archive import PageArchive, load
+from extractor import extract_listing
+from transform import process_listing
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("reextract")
+
+
+def reextract_page(path: Path) -> Optional[dict]:
+    """Extracts and transforms a single archived page, returns None for invalid listings"""
+    info, content = load(path)
+    return process_listing(extract_listing(content, info))
+
+
+def reextract_chunk(paths: List[Path]) -> List[Optional[dict]]:
+    results = []
+    for path in paths:
+        try:
+            results.append(reextract_page(path))
+        except Exception as e:
+            logger.error(f"Failed to re-extract {path}: {e}")
+            results.append(None)
+    return results
+
+
+def write_batch(writer, batch: List[dict]) -> int:
+    """
+    Upserts the listings, isolating the ones postgres rejects. Returns the number of rejected listings,
+    and exits when the write failed for another reason (e.g. the database is down).
+    """
+    rejected = writer.write_isolating([(listing["funda_id"], listing) for listing in batch], upsert=True)
+    if rejected is None:
+        logger.error(f"Failed to write a batch of {len(batch)} listings, stopping")
+        sys.exit(1)
+    for funda_id, (_, field, reason) in rejected:
+        logger.error(f"Listing {funda_id} was rejected by the database: {reason} (column '{field}')")
+    return len(rejected)
+
+
+def chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR") or "archive", help="archive directory (default: $ARCHIVE_DIR)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="extraction processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="listings per database write")
+    parser.add_argument("--dry-run", action="store_true", help="only extract, don't write to the database")
+    args = parser.parse_args()
+
+    # the writer connects to postgres on import, so only import it when writing
+    writer = None
+    if not args.dry_run:
+        from writer import Writer
+        writer = Writer()
+
+    archive = PageArchive(args.archive)
+    pages = valid = rejected = 0
+    batch = []
+
+    # fork so the workers don't re-run the module level connections of the writer
+    with ProcessPoolExecutor(args.processes, mp_context=get_context("fork")) as executor:
+        # keep a bounded window of chunks in flight, instead of submitting (and holding the results of)
+        # the whole archive at once, and top it up as chunks complete
+        pending_chunks = chunks(archive.latest(), 64)
+        pending = {executor.submit(reextract_chunk, chunk) for chunk in islice(pending_chunks, 2 * args.processes)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending |= {executor.submit(reextract_chunk, chunk) for chunk in islice(pending_chunks, len(done))}
+            results = [listing for future in done for listing in future.result()]
+            pages += len(results)
+            batch += [listing for listing in results if listing is not None]
+            if len(batch) >= args.batch_size:
+                valid += len(batch)
+                if writer:
+                    rejected += write_batch(writer, batch)
+                batch = []
+
+    valid += len(batch)
+    if writer and batch:
+        rejected += write_batch(writer, batch)
+    logger.info(f"Re-extracted {pages} archived pages, {valid} valid listings, {rejected} rejected by the database")
+    if rejected:
+        sys.exit(1)
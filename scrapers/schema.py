@@ -0,0 +1,130 @@
+"""
+Declarative schema of the scraped and the transformed listings.
+
+LISTING mirrors the listings table of init/01_create_schema.sql, in table order; the writer copies
+exactly these columns. Run `python scrapers/schema.py` to check that both still agree.
+"""
+import re
+import sys
+
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional, Tuple
+
+SQL_SCHEMA = Path(__file__).resolve().parents[1] / "init" / "01_create_schema.sql"
+
+
+class Field(NamedTuple):
+    name: str
+    # accepted python types, None accepts anything
+    types: Optional[tuple] = None
+    # postgres type of the listings column, None for fields that are not stored
+    sql_type: Optional[str] = None
+    # must be present
+    required: bool = True
+    # may be None
+    nullable: bool = False
+
+
+# a message popped from data_queue, as published by the scraper
+SCRAPED = (
+    Field("funda_id"),
+    Field("url"),
+    Field("scraped_at"),
+    Field("Postcode"),
+)
+
+# a transformed listing, as written to the listings table
+LISTING = (
+    Field("funda_id", (str,), "text"),
+    Field("title", (str,), "text"),
+    Field("last_asking_price", (int,), "integer"),
+    Field("surface_area", (int,), "numeric"),
+    Field("bedrooms", (int,), "integer", required=False, nullable=True),
+    Field("total_rooms", (int,), "integer"),
+    Field("listing_type", (str,), "text"),
+    Field("sell_date", (date,), "date"),
+    Field("offer_since", (date,), "date"),
+    Field("sell_duration", (timedelta,), "interval"),
+    Field("city", (str,), "text"),
+    Field("postcode", (str,), "text"),
+    Field("neighborhood", (str,), "text"),
+    Field("energy_label", (str,), "text"),
+    Field("building_year", (date,), "date", nullable=True),
+    Field("scraped_at", (datetime,), "timestamp"),
+    Field("url", (str,), "text"),
+    Field("misc_data", (dict,), "jsonb"),
+)
+
+# returned by a validator for an invalid row: (field, reason)
+Error = Tuple[str, str]
+
+# values of these postgres types outside their range are silently wrapped around by the binary COPY
+SQL_RANGES = {"integer": (-2 ** 31, 2 ** 31 - 1)}
+
+
+def compile_validator(fields: tuple) -> Callable[[dict], Optional[Error]]:
+    """
+    Generates a function that checks a row against the fields, returning None for a valid row
+    and the first (field, reason) it fails on otherwise. The reason is "missing", "null", "type"
+    or "range", for a number that doesn't fit its postgres type.
+
+    Every check is inlined, so a valid row costs a lookup and an exact type comparison per field.
+    """
+    namespace = {"MISSING": object()}
+    lines = ["def validate(row):", "    get = row.get"]
+    for i, field in enumerate(fields):
+        on_missing = f"return ({field.name!r}, 'missing')" if field.required else "pass"
+        on_null = "pass" if field.nullable else f"return ({field.name!r}, 'null')"
+        lines += [
+            f"    value = get({field.name!r}, MISSING)",
+            "    if value is MISSING:",
+            f"        {on_missing}",
+            "    elif value is None:",
+            f"        {on_null}",
+        ]
+        if field.types:
+            namespace[f"EXACT_{i}"] = field.types[0]
+            namespace[f"TYPES_{i}"] = field.types
+            # the exact type comparison settles the common case, isinstance accepts subclasses
+            lines += [
+                f"    elif type(value) is not EXACT_{i} and not isinstance(value, TYPES_{i}):",
+                f"        return ({field.name!r}, 'type')",
+            ]
+        if field.sql_type in SQL_RANGES:
+            low, high = SQL_RANGES[field.sql_type]
+            lines += [
+                f"    elif not {low} <= value <= {high}:",
+                f"        return ({field.name!r}, 'range')",
+            ]
+    lines.append("    return None")
+
+    exec("\n".join(lines), namespace)
+    return namespace["validate"]
+
+
+validate_scraped = compile_validator(SCRAPED)
+validate_listing = compile_validator(LISTING)
+
+
+def sql_columns(path: Path = SQL_SCHEMA) -> list[Tuple[str, str]]:
+    """(name, type) of the columns of the listings table in the schema file, without the serial id"""
+    table = re.search(r"CREATE TABLE listings \((.*?)\n\);", path.read_text(), re.S).group(1)
+    columns = []
+    for line in table.splitlines():
+        line = line.split("--")[0].strip()
+        if line:
+            name, sql_type = line.split()[:2]
+            columns.append((name, sql_type.rstrip(",").lower()))
+    return [(name, sql_type) for name, sql_type in columns if name != "id"]
+
+
+if __name__ == "__main__":
+    expected = [(field.name, field.sql_type) for field in LISTING if field.sql_type]
+    actual = sql_columns()
+    if actual != expected:
+        print(f"{SQL_SCHEMA.name} and LISTING disagree:")
+        for column in sorted(set(actual) ^ set(expected)):
+            print(f"  {'sql only' if column in actual else 'LISTING only':<14}{column[0]} {column[1]}")
+        sys.exit(1)
+    print(f"{SQL_SCHEMA.name} and LISTING agree on {len(expected)} columns")
@@ -1,20 +1,26 @@
+import asyncio
 import json
 import logging
 import os
-import psycopg
 import redis
 import uuid
 
 from datetime import datetime
 from dotenv import load_dotenv
-from parsel import Selector
-from playwright.sync_api import sync_playwright
+from httpx import HTTPError
+from playwright.sync_api import Error as PlaywrightError
 from prometheus_client import CollectorRegistry, Gauge, Counter, push_to_gateway
-from random import random, choice
-from sys import exit
 from time import sleep
+from typing import Tuple
 
-from config import SCRAPER_THROTTLE_SPEED_MIN, SCRAPER_THROTTLE_SPEED_MAX
+from archive import PageArchive
+from codec import make_encoder
+from config import SCRAPER_RATE_START, SCRAPER_RATE_MIN, SCRAPER_RATE_MAX, SCRAPER_CONCURRENCY
+from extractor import extract_listing
+from fetchers import Blocked, FetchResult, is_blocked, make_fetcher, make_async_fetcher, page_title, CAPTCHA_TITLE, STORING_TITLE
+from queues import make_queue
+from ratelimit import RateController
+from urls import absolute_url, funda_id_from_url
 
 load_dotenv()
 
@@ -33,6 +39,11 @@ r = redis.Redis(
     password=os.getenv("REDIS_PASSWORD") or None
 )
 
+FETCHER_BACKEND = os.getenv("FETCHER_BACKEND", "http")
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "json")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+
 # prometheus stuff
 PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "localhost:9091")
 registry = CollectorRegistry()
@@ -51,132 +62,225 @@ class Scraper:
             registry=registry
         )
         self.captchas = Counter('scraper_captchas', 'Number of captchas served', registry=registry)
+        self.storing = Counter('scraper_storing', 'Number of storingen served', registry=registry)
+        self.fetches = Counter('scraper_fetches_total', 'Number of fetches per backend', ['backend'], registry=registry)
+        self.fetcher = self.create_fetcher()
+        self.queue_lag = Gauge('scraper_queue_lag', 'Number of listings waiting in listing_queue', registry=registry)
+        self.queue = make_queue(r, 'listing_queue', self.name, QUEUE_TRANSPORT)
+        self.output = make_queue(r, 'data_queue', self.name, QUEUE_TRANSPORT)
+        self.encode = make_encoder(MESSAGE_CODEC)
+        self.request_rate = Gauge('scraper_request_rate', 'Request rate shared by all scrapers, per second', registry=registry)
+        self.limiter = RateController(r, "scraper", SCRAPER_RATE_START, SCRAPER_RATE_MIN, SCRAPER_RATE_MAX)
+        self.archive = PageArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+
 
+    def create_fetcher(self):
+        return make_fetcher(FETCHER_BACKEND)
 
     def listen(self):
         """Listens to the redis message queue and scrapes the listings it receives"""
-        while True:
-            _, raw = r.brpop('listing_queue')
-            url = json.loads(raw.decode()).get("url")
-            self.logger.info(f"Got URL: {url}")
-            self.scrape(url)
+        try:
+            while True:
+                raw = self.queue.pop(timeout=5)
+                if not raw:
+                    continue
+                url = json.loads(raw.decode()).get("url")
+                self.logger.info(f"Got URL: {url}")
+                try:
+                    # the rate-limiter sleep alone can outlast the heartbeat when many scrapers share the minimum rate
+                    with self.queue.keepalive():
+                        self.scrape(url)
+                except (PlaywrightError, HTTPError, Blocked) as e:
+                    # the browser pool has already restarted the browser at this point
+                    self.logger.error(f"Failed to scrape {url}, retrying later: {e}")
+                    self.queue.nack(raw)
+                else:
+                    self.queue.ack(raw)
+        finally:
+            self.fetcher.close()
             
     def scrape(self, url):
         """Scrapes all available data of the given listing and writes to the database"""
-        url = "https://www.funda.nl" + url
+        url, info = self.new_listing(url)
+
+        # wait for our turn at the rate shared by all scrapers
+        sleeptime = self.throttle_delay()
+        self.logger.info(f"Sleeping {sleeptime} seconds.")
+        sleep(sleeptime)
+
+        self.logger.info(f"Scraping page {url}")
 
-        # take the penultimate part of the url when split at /
-        # e.g. .../tilburg/appartement-de-fabrikant-type-c1-bouwnr-28/43859373/' -> [... 'tilburg', 'appartement-de-fabrikant-type-c1-bouwnr-28', '43859373', '']
-        funda_id = url.split("/")[-2] 
+        result = self.fetcher.fetch(url)
+        blocked = self.record_response(result)
+        self.request_rate.set(self.limiter.feedback(blocked))
+        self.check_blocked(result)
+        # only the final page is archived, once it is known not to be a block page
+        if self.archive:
+            self.archive.put(info, result.content)
+
+        self.extract(result.content, info)
+        self.publish(info)
+
+    def new_listing(self, url: str) -> Tuple[str, dict]:
+        """Returns the absolute url of the listing and the info dict to fill"""
+        url = absolute_url(url)
+        funda_id = funda_id_from_url(url)
 
         info = {"funda_id" : funda_id, "url": url, "scraped_at" : datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        return url, info
+
+    def record_response(self, result: FetchResult) -> bool:
+        """
+        Counts the status code and block pages of a fetch, including a blocked attempt that was retried.
+        Returns whether funda blocked the fetch or the attempt before it.
+        """
+        blocked = False
+        if result.fallback_from:
+            blocked = self.record_response(result.fallback_from)
+
+        self.fetches.labels(backend=result.backend).inc()
+        if result.status:
+            self.logger.info(f"Response status ({result.backend}): {result.status}")
+            if result.status == 200:
+                self.status_codes.labels(code='200').inc()
+            if result.status == 403:
+                self.status_codes.labels(code='403').inc()
+            if result.status == 429:
+                self.status_codes.labels(code='429').inc()
+            if result.status in [403, 429]:
+                blocked = True
+
+
+            # if result.status in [403,429]:
+            #     self.logger.info(f"Exiting because of encountering status code {result.status}")
+            #     exit(1)
+
+        else:
+            self.logger.info(f"Response is empty")
+
+        title = page_title(result.content)
+        self.logger.info(f"Page title: {title}")
+
+        # Funda serves a page titled "Je bent bijna op de pagina die je zoekt" 
+        # and a captcha if it suspect bot activity
+        if title and CAPTCHA_TITLE in title:
+            self.logger.info("Encountered Captcha page")
+            self.captchas.inc(1)
+            blocked = True
+            # self.logger.info("Exiting because served captcha page")
+            # exit(1)
+        if title and STORING_TITLE in title:
+            self.logger.info("Encountered storing page")
+            self.storing.inc(1)
+            blocked = True
+        return blocked
+
+    def check_blocked(self, result: FetchResult):
+        """Raises Blocked when the final page is a block page, so the listing is retried instead of published empty"""
+        if is_blocked(result.content, result.status):
+            raise Blocked(f"{result.backend} fetch of {result.url} was blocked (status {result.status})")
+
+    def extract(self, content: str, info: dict) -> dict:
+        """Extracts the listing data from the html of a listing page into info"""
+        extract_listing(content, info)
+        self.logger.debug(f"Extracted {info}")
+        return info
+
+    def publish(self, info: dict):
+        """Pushes the scraped listing to the data queue and the metrics to the gateway"""
+        self.pages_scraped.inc()
+        self.output.push([self.encode(info)])
+        self.queue_lag.set(self.queue.lag())
+ 
+        try: 
+            push_to_gateway(PUSHGATEWAY_URL, 
+
+                            job=self.name, 
+                            # instance= self.name, 
+                            registry=registry)
+
+        except Exception as e:
+            self.logger.info(f"failed to push metrics {e}")
+
+    def throttle_delay(self) -> float:
+        """Reserves the next request slot of the shared rate, returns how long to sleep before fetching"""
+        return self.limiter.acquire()
 
 
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_4_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.5790.170 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:117.0) Gecko/20100101 Firefox/117.0",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 13.5; rv:117.0) Gecko/20100101 Firefox/117.0",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Safari/605.1.15",
-            "Mozilla/5.0 (Linux; Android 13; Pixel 6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Mobile Safari/537.36",
-            "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
-        ]
-        ua = choice(user_agents)
-
-        self.logger.info(f"Scraping page {url} with user agent {ua}")
-
-        with sync_playwright() as p:
-            self.logger.info(f"Making request to {url} ...")
-            browser = p.chromium.launch(headless=False)
-            context = browser.new_context(user_agent=ua)
-            page = context.new_page()
-            response = page.goto(url)            
-            if response:
-                self.logger.info(f"Response status: {response.status}")
-                if response.status == 200:
-                    self.status_codes.labels(code='200').inc()
-                if response.status == 403:
-                    self.status_codes.labels(code='403').inc()
-                if response.status == 429:
-                    self.status_codes.labels(code='429').inc()
-
-
-                # if response.status in [403,429]:
-                #     self.logger.info(f"Exiting because of encountering status code {response.status}")
-                #     exit(1)
+class AsyncScraper(Scraper):
+    """Scrapes up to `concurrency` listings at the same time using playwright's async API"""
+    def __init__(self, concurrency: int = SCRAPER_CONCURRENCY):
+        self.concurrency = concurrency
+        super().__init__()
+        self.logger.info(f"Running {concurrency} scraping slots.")
 
+    def create_fetcher(self):
+        return make_async_fetcher(self.concurrency, FETCHER_BACKEND)
+
+    def listen(self):
+        """Listens to the redis message queue and scrapes the listings it receives"""
+        asyncio.run(self.run())
+
+    async def run(self):
+        # bounded so we never pop more listings than we have free slots for
+        work = asyncio.Queue(maxsize=self.concurrency)
+        tasks = [asyncio.create_task(self.feed(work))]
+        tasks += [asyncio.create_task(self.slot(i, work)) for i in range(self.concurrency)]
+        try:
+            with self.queue.keepalive():
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.fetcher.close()
+
+    async def feed(self, work: asyncio.Queue):
+        """Pops listings from the redis queue in a worker thread so the event loop is never blocked"""
+        while True:
+            raw = await asyncio.to_thread(self.queue.pop, timeout=5)
+            if not raw:
+                continue
+            await work.put(raw)
+
+    async def slot(self, slot_id: int, work: asyncio.Queue):
+        """Scrapes listings one after another"""
+        while True:
+            raw = await work.get()
+            url = json.loads(raw.decode()).get("url")
+            self.logger.info(f"Got URL: {url}")
+            try:
+                await self.scrape_async(url)
+            except (PlaywrightError, HTTPError, Blocked) as e:
+                self.logger.error(f"Failed to scrape {url}, retrying later: {e}")
+                await asyncio.to_thread(self.queue.nack, raw)
             else:
-                self.logger.info(f"Response is empty")
-
-            # wait for the page to load
-            page.wait_for_load_state("networkidle")
-            content = page.content()
-            selector = Selector(text = content)
-
-            title = selector.css("title::text").get()
-            self.logger.info(f"Page title: {title}")
-            print(type(title))
-
-            # Funda serves a page titled "Je bent bijna op de pagina die je zoekt" 
-            # and a captcha if it suspect bot activity
-            if title and "Je bent bijna op de pagina die" in title:
-                self.logger.info("Encountered Captcha page")
-                self.captchas.inc(1)
-                # self.logger.info("Exiting because served captcha page")
-                # exit(1)
-            
-            # --- about box --- #
-            # Contains: address, postal code, neighborhood
-            about_box = selector.css("div#about")
-
-            info["Titel"] = about_box.css("h1 span::text").get() 
-            info["Postcode"] = about_box.css("span.text-neutral-40::text").get()
-            info["Buurt"] = about_box.css("a.ml-2.text-secondary-70::text").get()
-
-            # --- purchase history --- #
-            # contains: offered since, purchase date, duration
-            purchase_history = selector.css("section.mt-6.border-b.border-neutral-20 dl div").getall()
-            for element in purchase_history:
-                key = Selector(element).css("dt::text").get()
-                value = Selector(element).css("dd::text").get()
-                if key:
-                    info[key] = value
-
-            # --- features --- #
-            # contains: most everything else
-            features = selector.css("section#features div dl").getall()
-            for element in features:
-                key = Selector(element).css("dt::text").get()
-                value = Selector(element).css("dd span::text").get()
-                if key:
-                    info[key] = value
-
-            for key in info.keys():
-                print(f"{key}: {info[key]}")
-
-            browser.close()
-            self.pages_scraped.inc()
-            r.lpush("data_queue", json.dumps(info))
- 
-            try: 
-                push_to_gateway(PUSHGATEWAY_URL, 
+                await asyncio.to_thread(self.queue.ack, raw)
+
+    async def scrape_async(self, url: str):
+        """Scrapes all available data of the given listing and writes to the database"""
+        url, info = self.new_listing(url)
+
+        sleeptime = await asyncio.to_thread(self.throttle_delay)
+        self.logger.info(f"Sleeping {sleeptime} seconds.")
+        await asyncio.sleep(sleeptime)
 
-                                job=self.name, 
-                                # instance= self.name, 
-                                registry=registry)
+        self.logger.info(f"Scraping page {url}")
 
-            except Exception as e:
-                self.logger.info(f"failed to push metrics {e}")
+        result = await self.fetcher.fetch(url)
+        blocked = self.record_response(result)
+        self.request_rate.set(await asyncio.to_thread(self.limiter.feedback, blocked))
+        self.check_blocked(result)
+        if self.archive:
+            await asyncio.to_thread(self.archive.put, info, result.content)
 
-            # sleep for a while
-            sleeptime = random() * (SCRAPER_THROTTLE_SPEED_MAX - SCRAPER_THROTTLE_SPEED_MIN) + SCRAPER_THROTTLE_SPEED_MIN
-            self.logger.info(f"Sleeping {sleeptime} seconds.")
-            sleep(sleeptime)
+        self.extract(result.content, info)
+        await asyncio.to_thread(self.publish, info)
 
 
 
 if __name__ == "__main__":
-    scraper = Scraper()
+    if os.getenv("SCRAPER_MODE", "sync") == "async":
+        scraper = AsyncScraper()
+    else:
+        scraper = Scraper()
     scraper.listen()
-    # scraper.scrape("/detail/koop/tilburg/appartement-langestraat-6-02/43938990/")
-    
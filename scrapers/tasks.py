@@ -0,0 +1,122 @@
+import json
+import redis
+
+from typing import List, Optional, Tuple
+
+from queues import ReliableQueue
+
+# seeds the tasks of a new sweep, unless a sweep is still pending. KEYS: queue, pending, exhausted
+START_SWEEP = """
+    if redis.call("EXISTS", KEYS[2]) == 1 then
+        return 0
+    end
+    redis.call("DEL", KEYS[3])
+    for i = 1, #ARGV do
+        redis.call("LPUSH", KEYS[1], ARGV[i])
+    end
+    redis.call("SET", KEYS[2], #ARGV)
+    return #ARGV
+"""
+
+# acknowledges a task and counts it as done, ending the sweep after its last task. KEYS: processing, pending, queue
+# When a follow-up task is given in ARGV[2], it replaces the finished task and is claimed next.
+FINISH = """
+    if redis.call("LREM", KEYS[1], -1, ARGV[1]) == 0 then
+        return -1
+    end
+    if ARGV[2] then
+        redis.call("RPUSH", KEYS[3], ARGV[2])
+        return tonumber(redis.call("GET", KEYS[2]))
+    end
+    local left = redis.call("DECR", KEYS[2])
+    if left <= 0 then
+        redis.call("DEL", KEYS[2])
+    end
+    return left
+"""
+
+
+class PageTasks:
+    """
+    Distributes the search result pages of a sweep over the crawler workers.
+
+    A sweep seeds one task per (region, page), interleaved so workers spread over the regions.
+    Tasks are claimed from a ReliableQueue, so every page goes to one worker and the pages of a
+    crashed worker are re-queued. The queue and the count of pending tasks are the checkpoint:
+    a restarted worker continues the running sweep where it was left.
+
+    A region is marked exhausted once one of its pages yields no new listings, after which its
+    remaining pages are skipped.
+
+    Incremental sweeps seed only the first page of every region and chain the next page onto each
+    finished one, so the pages of a region are crawled in order and the chain can stop early. The
+    newest listing of every region is kept as its high-water mark for the next incremental sweep.
+
+    Full and incremental sweeps run apart, each `mode` under its own keys, so a worker never claims
+    the tasks of a sweep of the other mode. The high-water marks are shared.
+    """
+    def __init__(self, r: redis.Redis, consumer: str, mode: str = "full", name: str = "crawl_tasks"):
+        self.r = r
+        self.mode = mode
+        self.name = f"{name}:{mode}"
+        self.queue = ReliableQueue(r, self.name, consumer)
+        self.pending_key = f"{self.name}:pending"
+        self.exhausted_key = f"{self.name}:exhausted"
+        self.high_water_key = f"{name}:high_water"
+        self.next_high_water_key = f"{name}:high_water:next"
+
+        self.start_script = r.register_script(START_SWEEP)
+        self.finish_script = r.register_script(FINISH)
+
+    def start_sweep(self, regions: List[str], max_pages: int) -> int:
+        """Seeds a new sweep when none is running, returns the number of tasks seeded"""
+        tasks = [json.dumps({"region": region, "page": page})
+                 for page in range(1, max_pages + 1) for region in regions]
+        return self.start_script(keys=[self.name, self.pending_key, self.exhausted_key], args=tasks)
+
+    def running(self) -> bool:
+        return self.r.exists(self.pending_key) == 1
+
+    def claim(self, timeout: float) -> Optional[Tuple[bytes, dict]]:
+        """Blocks for at most `timeout` seconds for a task, returns it raw and decoded"""
+        raw = self.queue.pop(timeout)
+        if not raw:
+            return None
+        return raw, json.loads(raw)
+
+    def is_exhausted(self, region: str) -> bool:
+        return self.r.sismember(self.exhausted_key, region) == 1
+
+    def exhaust(self, region: str):
+        """Skips the remaining pages of the region for the rest of the sweep"""
+        self.r.sadd(self.exhausted_key, region)
+
+    def finish(self, raw: bytes, follow_up: Optional[dict] = None) -> int:
+        """Marks a task as done, optionally replacing it by a follow-up task. Returns the number of tasks left in the sweep"""
+        args = [raw] if follow_up is None else [raw, json.dumps(follow_up)]
+        return self.finish_script(keys=[self.queue.processing(), self.pending_key, self.name], args=args)
+
+    def keepalive(self):
+        """Keeps the claimed task from being re-queued while it runs, see queues.KeepAlive"""
+        return self.queue.keepalive()
+
+    def retry(self, raw: bytes):
+        """Puts a failed task back on the queue"""
+        self.queue.nack(raw)
+
+    def high_water(self, region: str) -> Optional[str]:
+        """Funda id of the newest listing found by the last completed incremental sweep of the region"""
+        mark = self.r.hget(self.high_water_key, region)
+        return mark.decode() if mark else None
+
+    def propose_high_water(self, region: str, funda_id: str):
+        """Remembers the newest listing of the running sweep, it only becomes the mark once the region is done"""
+        self.r.hset(self.next_high_water_key, region, funda_id)
+
+    def commit_high_water(self, region: str):
+        mark = self.r.hget(self.next_high_water_key, region)
+        if mark:
+            pipe = self.r.pipeline()
+            pipe.hset(self.high_water_key, region, mark)
+            pipe.hdel(self.next_high_water_key, region)
+            pipe.execute()
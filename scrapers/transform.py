@@ -0,0 +1,249 @@
+import logging
+import re
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Tuple, Optional, Any
+
+from codec import decode
+from schema import validate_listing, validate_scraped
+
+# The transforms are pure functions without module level connections,
+# so they can run in worker processes and be benchmarked in isolation.
+logger = logging.getLogger(__name__)
+
+
+# --- lookup tables and parsers, built once at import --- #
+NON_DIGITS = re.compile(r"[^0-9]+")
+ROOMS = re.compile(r"(\d+)\s+kamers?")
+BEDROOMS = re.compile(r"\((\d+)\s+slaapkamers?\)")
+
+MONTHS = {
+    "januari": 1,
+    "februari": 2,
+    "maart": 3,
+    "april": 4,
+    "mei": 5,
+    "juni": 6,
+    "juli": 7,
+    "augustus": 8,
+    "september": 9,
+    "oktober": 10,
+    "november": 11,
+    "december": 12,
+}
+
+
+def reduce_to_int(string: str) -> int:
+    """Reduce a string to just the numbers in the string and store as integer."""
+    return int(NON_DIGITS.sub("", string))
+
+
+def parse_rooms(text: str) -> Tuple[int, Optional[int]]:
+    """
+    Extract total number of rooms and bedrooms from a Dutch real estate listing string.
+
+    Parameters:
+        text (str): e.g. "5 kamers (3 slaapkamers)" or "3 kamers"
+
+    Returns:
+        (total_rooms, bedrooms) — bedrooms is None if not specified
+    """
+    # Match total number of rooms
+    total_match = ROOMS.search(text)
+    total_rooms = int(total_match.group(1)) if total_match else None
+
+    # Match number of bedrooms (optionally singular)
+    bedroom_match = BEDROOMS.search(text)
+    bedrooms = int(bedroom_match.group(1)) if bedroom_match else None
+
+    return (total_rooms, bedrooms)
+
+
+# the same few thousand dates come back in every batch
+@lru_cache(maxsize=8192)
+def to_date(date_str: str) -> date:
+    """Reduce string to a date"""
+    parts = date_str.lower().split()
+    if len(parts) != 3:
+        raise ValueError(f"Invalid date format: {date_str}")
+
+    day = int(parts[0])
+    month = MONTHS.get(parts[1])
+    year = int(parts[2])
+
+    if not month:
+        raise ValueError(f"Unknown Dutch month: {parts[1]}")
+
+    return date(year, month, day)
+
+
+def to_year(year_str: str) -> Optional[date]:
+    """Reduce a building year to a date, None if bouwjaar is malformed"""
+    try:
+        return date(int(year_str), 1, 1)
+    except ValueError:
+        return None
+
+
+def to_datetime(datetime_str: str) -> datetime:
+    """Parses the "%Y-%m-%d %H:%M:%S" timestamps of the scraper"""
+    return datetime.fromisoformat(datetime_str)
+
+
+def split_postcode_city(postcode_str: str) -> Tuple[str, str]:
+    """
+    Splits a Dutch-style postcode and city string into postcode and city.
+
+    Example:
+        "5035 DD Tilburg" -> ("5035 DD", "Tilburg")
+
+    Assumes input always has exactly 3 parts.
+    """
+    parts = postcode_str.strip().split()
+    postcode = f"{parts[0]} {parts[1]}"
+    city = parts[2]
+    return postcode, city
+
+
+def validate_input(message) -> bool:
+    """Ensures that the scraped information has the fields the transforms need"""
+    return validate_scraped(message) is None
+
+
+def _same(value):
+    return value
+
+
+# Field mapping: source -> (target, or targets of a tuple, and the parser of the value)
+# When two sources map to the same target, the last one wins
+FIELD_MAP = {
+    "scraped_at": ("scraped_at", to_datetime),
+    "Aantal kamers": (("total_rooms", "bedrooms"), parse_rooms),
+    "Postcode": (("postcode", "city"), split_postcode_city),
+    "Titel": ("title", _same),
+    "Laatste vraagprijs": ("last_asking_price", reduce_to_int),
+    "Gebruiksoppervlakten": ("surface_area", reduce_to_int),
+    "Soort appartement": ("listing_type", _same),
+    "Soort woonhuis": ("listing_type", _same),
+    "Verkoopdatum": ("sell_date", to_date),
+    "Aangeboden sinds": ("offer_since", to_date),
+    "Buurt": ("neighborhood", _same),
+    "Energielabel": ("energy_label", _same),
+    "Bouwjaar": ("building_year", to_year),
+}
+
+# These fields are either used or inferred from other data, all other fields end up in misc_data
+USED_KEYS = frozenset(FIELD_MAP) | {"funda_id", "url", "postcode", "Looptijd", "city"}
+
+
+def validate_output(transformed_message: dict) -> bool:
+    """Ensures that the transformed information has the correct format"""
+    return validate_listing(transformed_message) is None
+
+
+def _assign(result: dict, target: str | tuple, value):
+    if isinstance(target, tuple):
+        result.update(zip(target, value))
+    else:
+        result[target] = value
+
+
+def _finish(result: dict, message: dict) -> dict:
+    """Adds the derived fields once all fields are parsed"""
+    # Ensure building year exists (even though it might be none)
+    if result.get("building_year") is None:
+        result["building_year"] = None
+
+    # Derived duration field
+    if result.get("sell_date") and result.get("offer_since"):
+        result["sell_duration"] = result["sell_date"] - result["offer_since"]
+
+    result["misc_data"] = {
+        k: v for k, v in message.items() if k not in USED_KEYS
+    }
+    return result
+
+
+class TransformError(ValueError):
+    """A field of a scraped listing that cannot be parsed"""
+    def __init__(self, field: str):
+        super().__init__(f"Cannot parse {field}")
+        self.field = field
+
+
+def transform(message: Dict[str, str]) -> Dict[str, str | int | date | Any]:
+    """
+    Transforms scraped listing data to fit the database schema.
+    Raises a TransformError with the field that cannot be parsed.
+    """
+    # Keep passthrough fields
+    result = {"funda_id": message["funda_id"], "url": message["url"]}
+
+    for src, (target, parse) in FIELD_MAP.items():
+        if src in message:
+            try:
+                value = parse(message[src])
+            except Exception as e:
+                raise TransformError(src) from e
+            _assign(result, target, value)
+
+    return _finish(result, message)
+
+
+# why a message was dropped: (stage, field, reason)
+Failure = Tuple[str, str, str]
+
+
+def process_message(raw: bytes) -> Optional[dict]:
+    """Decodes, validates and transforms a single queue message, returns None for invalid messages"""
+    return process_listing(decode(raw))
+
+
+def process_listing(message: dict) -> Optional[dict]:
+    """Validates and transforms a single scraped listing, returns None for invalid listings"""
+    if not validate_input(message):
+        logger.info("Input invalid, moving on to next item.")
+        return None
+
+    transformed = transform(message)
+
+    if not validate_output(transformed):
+        logger.info("Output invalid")
+        return None
+    return transformed
+
+
+def process_batch(raws: list[bytes]) -> Tuple[list[Optional[dict]], Dict[int, Failure]]:
+    """
+    Processes a batch of queue messages, keeping their order. Failed messages become None.
+
+    Returns the listings and the failures by index, as (stage, field, reason) where stage is
+    "input" (the scraped message), "transform" or "output" (the transformed listing).
+    """
+    failures = {}
+    results = [None] * len(raws)
+    for i, raw in enumerate(raws):
+        try:
+            message = decode(raw)
+        except Exception as e:
+            logger.debug(f"Cannot decode message: {e}")
+            failures[i] = ("input", "message", "decode")
+            continue
+        error = validate_scraped(message)
+        if error:
+            failures[i] = ("input", *error)
+            continue
+
+        try:
+            listing = transform(message)
+        except TransformError as e:
+            logger.debug(f"Transform failed: {e}: {e.__cause__}")
+            failures[i] = ("transform", e.field, "parse")
+            continue
+        error = validate_listing(listing)
+        if error:
+            failures[i] = ("output", *error)
+        else:
+            results[i] = listing
+    return results, failures
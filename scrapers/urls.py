@@ -0,0 +1,33 @@
+import os
+
+# the benchmark harness points this at a local stand-in serving saved pages
+FUNDA_URL = os.getenv("FUNDA_BASE_URL", "https://www.funda.nl")
+# sold listings of a single region
+SEARCH_URL = FUNDA_URL + '/zoeken/koop?selected_area=["{region}"]&availability=["unavailable"]&search_result={page}'
+# sorts the search results from most recent to oldest
+SORT_RECENT = '&sort="date_down"'
+
+
+def absolute_url(url: str) -> str:
+    """Turns a relative /detail/... path into a funda url, leaves absolute urls as is"""
+    if url.startswith("/"):
+        return FUNDA_URL + url
+    return url
+
+
+def search_url(region: str, page: int, recent_first: bool = False) -> str:
+    url = SEARCH_URL.format(region=region, page=page)
+    if recent_first:
+        url += SORT_RECENT
+    return url
+
+
+def funda_id_from_url(url: str) -> str:
+    """
+    Returns funda's listing id from a relative or absolute listing url.
+
+    Example:
+        ".../tilburg/appartement-de-fabrikant-type-c1-bouwnr-28/43859373/" -> "43859373"
+    """
+    # take the last non-empty part of the url when split at /
+    return url.rstrip("/").rsplit("/", 1)[-1]
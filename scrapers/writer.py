@@ -1,20 +1,27 @@
-import json
+import asyncio
 import logging
 import os
 import psycopg
 import re
 import redis
+import signal
 import uuid
+import zlib
 
-from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
+from multiprocessing import get_context
 from psycopg import sql
-from psycopg.types.json import Json
-from prometheus_client import CollectorRegistry, Gauge, Counter, push_to_gateway
-from time import time
-from typing import Dict, Tuple, Optional, Any
+from psycopg_pool import AsyncConnectionPool
+from prometheus_client import CollectorRegistry, Gauge, Counter, Histogram, push_to_gateway
+from time import sleep, time
+from typing import Optional
 
-from config import BATCH_SIZE, FLUSH_TIME_LIMIT
+from batching import AdaptiveBatcher
+from config import WRITER_PROCESSES, WRITER_DB_WRITERS, WRITER_RETRY_DELAY, WRITER_RETRY_MAX_DELAY
+from queues import DeadLetters, make_queue
+from schema import LISTING
+from transform import Failure, process_batch
 
 load_dotenv()
 
@@ -32,15 +39,17 @@ r = redis.Redis(
     db=int(os.getenv("REDIS_DB", "0")),
     password=os.getenv("REDIS_PASSWORD") or None
 )
+QUEUE_TRANSPORT = os.getenv("QUEUE_TRANSPORT", "list")
 
 # postgres connection
 print("Connecting to postgres")
-try: 
-    conn = psycopg.connect(f"host={os.getenv("POSTGRES_HOST")} \
+CONNINFO = f"host={os.getenv("POSTGRES_HOST")} \
                     connect_timeout=10 \
                     dbname={os.getenv("POSTGRES_DB")}\
                     user={os.getenv("POSTGRES_USER")}\
-                    password={os.getenv("POSTGRES_PASSWORD")}")
+                    password={os.getenv("POSTGRES_PASSWORD")}"
+try: 
+    conn = psycopg.connect(CONNINFO)
     print("connection: ", conn)
 
 except psycopg.OperationalError as e:
@@ -51,296 +60,406 @@ except psycopg.OperationalError as e:
 PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "localhost:9091")
 registry = CollectorRegistry()
 
+# columns of the listings table that the writer fills, with their postgres types for the binary COPY
+LISTING_COLUMNS = [(field.name, field.sql_type) for field in LISTING if field.sql_type]
+COLUMN_NAMES = [name for name, _ in LISTING_COLUMNS]
+COLUMN_TYPES = [type_ for _, type_ in LISTING_COLUMNS]
+
+_fields = sql.SQL(', ').join(map(sql.Identifier, COLUMN_NAMES))
+
+# session-local staging table without the constraints of listings, emptied at every commit
+CREATE_STAGING = sql.SQL("""
+    CREATE TEMP TABLE IF NOT EXISTS listings_staging
+    ON COMMIT DELETE ROWS
+    AS SELECT {fields} FROM listings WITH NO DATA
+""").format(fields=_fields)
+
+COPY_STAGING = sql.SQL("COPY listings_staging ({fields}) FROM STDIN (FORMAT BINARY)").format(fields=_fields)
+
+MERGE_STAGING = sql.SQL("""
+    INSERT INTO listings ({fields})
+    SELECT {fields} FROM listings_staging
+    ON CONFLICT (funda_id)
+    DO NOTHING
+""").format(fields=_fields)
+
+# used when backfilling: the listings replace the rows that are already there
+UPSERT_STAGING = sql.SQL("""
+    INSERT INTO listings ({fields})
+    SELECT {fields} FROM listings_staging
+    ON CONFLICT (funda_id)
+    DO UPDATE SET {updates}
+""").format(
+    fields=_fields,
+    updates=sql.SQL(', ').join(
+        sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(name)) for name in COLUMN_NAMES if name != "funda_id"
+    ),
+)
+
+# errors caused by the rows of a batch rather than by the database: invalid data or a violated constraint.
+# A batch failing with one of these is split up to find the listings postgres rejects
+ROW_ERRORS = (psycopg.DataError, psycopg.IntegrityError, ValueError, TypeError)
+
+# postgres reports the column of a bad COPY value as e.g. "COPY listings_staging, line 3, column title: ..."
+COPY_COLUMN = re.compile(r"COPY \w+, line \d+, column (\w+)")
+
+
+def rejection(error: Exception) -> Failure:
+    """The dead-letter failure of a listing that postgres rejected: ("write", column, error)"""
+    context = getattr(getattr(error, "diag", None), "context", None) or ""
+    column = COPY_COLUMN.search(context)
+    return ("write", column.group(1) if column else "", type(error).__name__)
+
+
 class Writer:
     def __init__(self):
         self.name= f"Writer-{uuid.uuid4().hex[:6]}"
         self.logger = logging.getLogger(self.name)
         self.logger.info(f"Initialized writer {self.name}.")
         self.conn = conn
-        self.writes = Counter('writer_writes', 'Number of succesful writes by writers', ["writes"], registry=registry)
+        self.writes = Counter('writer_writes', 'Number of succesful writes by writers', ["code"], registry=registry)
+        self.batch_sizes = Histogram('writer_batch_size', 'Number of listings per written batch',
+                                     buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000), registry=registry)
+        self.queue_depth = Histogram('writer_queue_depth', 'Depth of data_queue when popping',
+                                     buckets=(0, 10, 100, 1000, 10000, 100000, 1000000), registry=registry)
+        self.flush_latency = Histogram('writer_flush_latency_seconds', 'Time to write and commit a batch', registry=registry)
+        self.invalid = Counter('writer_invalid_listings', 'Number of dead-lettered messages by the stage, field and reason they failed on',
+                               ["stage", "field", "reason"], registry=registry)
+        self.dead_letter_depth = Gauge('writer_dead_letter_depth', 'Number of messages in the dead-letter stream', registry=registry)
+        self.batcher = AdaptiveBatcher()
+        # every popped message stays in this writer's processing list until its batch is committed
+        self.queue = make_queue(r, 'data_queue', self.name, QUEUE_TRANSPORT)
+        self.dead_letters = DeadLetters(r, 'data_queue')
+        # batches in a row that failed to write for another reason than their listings
+        self.failed_writes = 0
 
     def listen(self):
         batch = []
-        last_flush = time()
+        batch_started = None
+        depth = 0
 
         while True:
+            size = self.batcher.next_size(depth)
+            wait = self.batcher.max_wait() - (time() - batch_started) if batch else 1
             try:
-                self.logger.info("Fetching item from queue...")
-                item = r.brpop('data_queue', timeout=5)
-                if item:
-                    _, raw = item
-                    message = json.loads(raw.decode())
-                    if self.validate_input(message):
-                        self.logger.info("Input valid. Transforming message...")
-
-                        transformed = self.transform(message)
-
-                        if self.validate_output(transformed):
-                            self.logger.info("Output valid")
-                            batch.append(transformed)
-                        else:
-                            self.logger.info("Output invalid")
-                    else:
-                        self.logger.info("Input invalid, moving on to next item.")
+                raws, depth = self.queue.pop_many(max(1, size - len(batch)), timeout=min(1, max(wait, 0.1)))
+                self.queue_depth.observe(depth)
             except Exception as e:
-                self.logger.error(f"Queue read or transform failed: {e}")
+                self.logger.error(f"Queue read failed: {e}")
+                raws = []
+
+            listings, failures = process_batch(raws)
+            if not self.dead_letter([(raws[i], failure) for i, failure in failures.items()]):
+                # the failed messages are still in the lease, which would acknowledge them with the batch.
+                # The whole lease is retried instead
+                self.queue.nack_lease()
+                batch = []
+                continue
+            for raw, transformed in zip(raws, listings):
+                if transformed is None:
+                    continue
+                if not batch:
+                    batch_started = time()
+                batch.append((raw, transformed))
+
+            # Flush if batch is large enough or its oldest listing waited long enough
+            if batch and (len(batch) >= size or time() - batch_started >= self.batcher.max_wait()):
+                self.flush(batch)
+                batch = []
+            elif raws and not batch:
+                # nothing valid was popped, so there is nothing to wait for
+                self.queue.ack_lease()
+
+    def dead_letter(self, failures: list[tuple[bytes, Failure]], lease: str = "0") -> bool:
+        """
+        Moves the (message, failure) pairs to the dead-letter stream and acknowledges them, so a retry of
+        the rest of their lease doesn't process them again. Returns whether they were moved.
+        """
+        if not failures:
+            return True
+        for _, (stage, field, reason) in failures:
+            self.invalid.labels(stage=stage, field=field, reason=reason).inc()
+        try:
+            depth = self.dead_letters.push(failures, self.name)
+            self.queue.ack_many([raw for raw, _ in failures], lease)
+            self.dead_letter_depth.set(depth)
+        except Exception as e:
+            self.logger.error(f"Failed to dead-letter {len(failures)} messages: {e}")
+            return False
+        return True
 
-            # Flush if batch is large enough or time passed
-            if len(batch) >= BATCH_SIZE or (time() - last_flush) > FLUSH_TIME_LIMIT:
-                if batch:
-                    self.write(batch)
-                    batch = []
-                    last_flush = time()
+    def flush(self, batch: list[tuple[bytes, dict]]):
+        """Writes the (message, listing) batch, acknowledges its messages and feeds its latency back into the batch sizing"""
+        start = time()
+        with self.queue.keepalive():
+            rejected = self.write_isolating(batch)
+            elapsed = time() - start
+            if rejected is None:
+                # the batch is retried, but not before the database had some time to come back
+                sleep(self.retry_delay())
+            else:
+                self.failed_writes = 0
+        if rejected is not None and self.dead_letter(rejected):
+            self.queue.ack_lease()
+        else:
+            self.queue.nack_lease()
+        self.batcher.observe(len(batch), elapsed)
+        self.batch_sizes.observe(len(batch))
+        self.flush_latency.observe(elapsed)
+        # once per batch, not for every part of a batch that had to be split up
+        self.push_metrics()
+
+    def retry_delay(self) -> float:
+        """Seconds to wait before retrying a batch that failed to write, doubling while the failures repeat"""
+        delay = min(WRITER_RETRY_DELAY * 2 ** self.failed_writes, WRITER_RETRY_MAX_DELAY)
+        self.failed_writes += 1
+        self.logger.warning(f"Writing failed {self.failed_writes} times in a row, retrying in {delay} seconds")
+        return delay
+
+    def push_metrics(self):
+        # the batch is already settled, an unreachable gateway must not crash the writer
+        try:
+            push_to_gateway(PUSHGATEWAY_URL, job=self.name, registry=registry)
+        except Exception as e:
+            self.logger.info(f"failed to push metrics {e}")
 
+    def write_isolating(self, batch: list[tuple[bytes, dict]], upsert: bool = False) -> Optional[list[tuple[bytes, Failure]]]:
+        """
+        Writes the (message, listing) batch. When postgres rejects it for its data, its halves are written
+        separately, down to the single listings it rejects, so one bad listing can't hold up the queue.
 
-    def write(self, listings: list[dict]):
+        Returns the messages of the rejected listings with their failure, or None when the write failed
+        for another reason (e.g. the database is down) and the batch has to be retried.
+        """
+        error = self.write([listing for _, listing in batch], upsert=upsert)
+        if error is None:
+            return []
+        if not isinstance(error, ROW_ERRORS):
+            return None
+        if len(batch) == 1:
+            return [(batch[0][0], rejection(error))]
+
+        middle = len(batch) // 2
+        rejected = []
+        for half in (batch[:middle], batch[middle:]):
+            half_rejected = self.write_isolating(half, upsert)
+            if half_rejected is None:
+                return None
+            rejected += half_rejected
+        return rejected
+
+    def write(self, listings: list[dict], upsert: bool = False) -> Optional[Exception]:
+        """
+        Bulk loads the listings with a binary COPY into a staging table and merges them in one statement.
+        Existing listings are left alone, unless `upsert` is set. Returns None once they are committed,
+        and the error otherwise.
+        """
         if not listings:
-            return
-
-        columns = list(listings[0].keys())
-
-        # Wrap misc_data in Json 
-        values = []
-        for listing in listings:
-            row = []
-            for col in columns:
-                value = listing[col]
-                if col == "misc_data" and isinstance(value, dict):
-                    row.append(Json(value))
-                else:
-                    row.append(value)
-            values.append(row)
-
-        placeholders = sql.SQL(', ').join(sql.Placeholder() * len(columns))
-
-        insert_query = sql.SQL("""
-            INSERT INTO listings ({fields})
-            VALUES ({placeholders})
-            ON CONFLICT (funda_id)
-            DO NOTHING
-        """).format(
-            fields=sql.SQL(', ').join(map(sql.Identifier, columns)),
-            placeholders=placeholders
-        )
+            return None
 
         try:
             with self.conn.cursor() as cur:
-                cur.executemany(insert_query, values)
+                cur.execute(CREATE_STAGING)
+                with cur.copy(COPY_STAGING) as copy:
+                    copy.set_types(COLUMN_TYPES)
+                    for listing in listings:
+                        copy.write_row([listing.get(column) for column in COLUMN_NAMES])
+                cur.execute(UPSERT_STAGING if upsert else MERGE_STAGING)
+                inserted = cur.rowcount
             self.conn.commit()
-            self.logger.info(f"Wrote batch of {len(listings)} listings to database")
+            self.logger.info(f"Wrote batch of {len(listings)} listings to database ({inserted} {'written' if upsert else 'new'})")
             self.writes.labels(code='success').inc()
+            return None
         except Exception as e:
-            self.logger.error(f"Failed to write batch: {e}")
+            self.logger.error(f"Failed to write batch of {len(listings)} listings: {e}")
             self.writes.labels(code='failure').inc()
             self.conn.rollback()
- 
-        push_to_gateway(PUSHGATEWAY_URL, 
-                        job=self.name, 
-                        # instance= self.name, 
-                        registry=registry)
+            return e
 
 
-    def reduce_to_int(self, string: str) -> int:
-        """Reduce a string to just the numbers in the string and store as integer."""
-        return int("".join([element for element in string if element in "0123456789"]))
-
-    def parse_rooms(self, text: str) -> Tuple[int, Optional[int]]:
-        """
-        Extract total number of rooms and bedrooms from a Dutch real estate listing string.
+class ParallelWriter(Writer):
+    """
+    Transforms and validates messages on a process pool and writes them with a few
+    DB-writer coroutines that share a connection pool.
 
-        Parameters:
-            text (str): e.g. "5 kamers (3 slaapkamers)" or "3 kamers"
-
-        Returns:
-            (total_rooms, bedrooms) — bedrooms is None if not specified
-        """
-        # Match total number of rooms
-        total_match = re.search(r"(\d+)\s+kamers?", text)
-        total_rooms = int(total_match.group(1)) if total_match else None
-
-        # Match number of bedrooms (optionally singular)
-        bedroom_match = re.search(r"\((\d+)\s+slaapkamers?\)", text)
-        bedrooms = int(bedroom_match.group(1)) if bedroom_match else None
-
-        return (total_rooms, bedrooms)
-
-    def to_date(self, date_str: str) -> date:
-        """Reduce string to a date"""
-        months = {
-            "januari": 1,
-            "februari": 2,
-            "maart": 3,
-            "april": 4,
-            "mei": 5,
-            "juni": 6,
-            "juli": 7,
-            "augustus": 8,
-            "september": 9,
-            "oktober": 10,
-            "november": 11,
-            "december": 12,
-        }
-
-        parts = date_str.lower().split()
-        if len(parts) != 3:
-            raise ValueError(f"Invalid date format: {date_str}")
-
-        day = int(parts[0])
-        month = months.get(parts[1])
-        year = int(parts[2])
-
-        if not month:
-            raise ValueError(f"Unknown Dutch month: {parts[1]}")
-
-        return date(year, month, day)
-
-    def split_postcode_city(self, postcode_str: str) -> Tuple[str, str]:
-        """
-        Splits a Dutch-style postcode and city string into postcode and city.
+    Listings are sharded over the DB writers by funda id, so the writes of one listing
+    keep the order in which they were popped.
+    """
+    def __init__(self, processes: int = WRITER_PROCESSES, db_writers: int = WRITER_DB_WRITERS):
+        super().__init__()
+        self.processes = processes
+        self.db_writers = db_writers
+        # lease -> [number of shards still being written, whether all of them were written, rejected (message, failure)s]
+        self.leases = {}
+        self.logger.info(f"Running {processes} transform processes and {db_writers} database writers.")
 
-        Example:
-            "5035 DD Tilburg" -> ("5035 DD", "Tilburg")
-
-        Assumes input always has exactly 3 parts.
-        """
-        parts = postcode_str.strip().split()
-        postcode = f"{parts[0]} {parts[1]}"
-        city = parts[2]
-        return postcode, city
-
-    def validate_input(self, message) -> bool:
-        required_fields = ["funda_id", "url", "scraped_at", "Postcode"]
-        missing = [f for f in required_fields if f not in message]
-
-        if missing != []:
-            return False
-
-        for f in required_fields:
-            if message.get(f) is None:
-                return False
-
-
-        return True
-
-
-    def validate_output(self, transformed_message: dict) -> bool:
-        """Ensures that the transformed information has the correct format"""
-
-        required_fields = {
-            "funda_id": str,
-            "title": str,
-            "last_asking_price": int,
-            "surface_area": int,
-            "total_rooms": int,
-            "listing_type": str,
-            "sell_date": date,
-            "offer_since": date,
-            "sell_duration": timedelta,
-            "city": str,  # Only if you're including this
-            "postcode": str,
-            "neighborhood": str,
-            "energy_label": str,
-            "building_year": (date, type(None)),
-            "scraped_at": datetime,
-            "url": str,
-            "misc_data": dict,
-        }
-
-        optional_fields = {
-            "bedrooms": (int, type(None)),
-        }
-
-        # Check required fields
-        for field, expected_type in required_fields.items():
-            if field not in transformed_message:
-                self.logger.info(f"Missing required field: {field}")
-                return False
-            if not isinstance(transformed_message[field], expected_type):
-                self.logger.info(f"Invalid type for field '{field}': expected {expected_type}, got {type(transformed_message[field])}")
-                return False
-
-        # Check optional fields
-        for field, expected_type in optional_fields.items():
-            if field in transformed_message and not isinstance(transformed_message[field], expected_type):
-                self.logger.info(f"Invalid type for optional field '{field}': expected {expected_type}, got {type(transformed_message[field])}")
-                return False
-
-        return True
-
-                
-    def transform(self, message: Dict[str, str]) -> Dict[str, str | int | date | Any]:
-        """Transforms scraped listing data to fit the database schema."""
-        result = {}
-
-        # Keep passthrough fields
-        result["funda_id"] = message["funda_id"]
-        result["url"] = message["url"]
-        result["scraped_at"] = message["scraped_at"]
-
-        # Room parsing
-        if "Aantal kamers" in message:
-            total, bedrooms = self.parse_rooms(message["Aantal kamers"])
-            result["total_rooms"] = total
-            result["bedrooms"] = bedrooms
-
-        postcode, city = self.split_postcode_city(message["Postcode"])
-
-        result["postcode"] = postcode
-        result["city"] = city
-
-        # Field mapping: source -> target
-        field_map = {
-            "Titel": "title",
-            "Laatste vraagprijs": "last_asking_price",
-            "Gebruiksoppervlakten": "surface_area",
-            "Soort appartement": "listing_type",
-            "Soort woonhuis": "listing_type",
-            "Verkoopdatum": "sell_date",
-            "Aangeboden sinds": "offer_since",
-            "Buurt": "neighborhood",
-            "Energielabel": "energy_label",
-            "Bouwjaar": "building_year"
-        }
-
-        for src, dst in field_map.items():
-            if src not in message:
+    def listen(self):
+        asyncio.run(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        # transformed chunks in the order they were popped, bounded to keep memory in check
+        transformed = asyncio.Queue(maxsize=2 * self.processes)
+        shards = [asyncio.Queue(maxsize=2) for _ in range(self.db_writers)]
+
+        # fork so the workers don't re-run the module level connections of this script
+        with ProcessPoolExecutor(self.processes, mp_context=get_context("fork")) as executor:
+            # a forking pool starts all its workers on the first submit; do that before any threads exist
+            await loop.run_in_executor(executor, int)
+            with self.queue.keepalive():
+                async with AsyncConnectionPool(CONNINFO, min_size=self.db_writers, max_size=self.db_writers) as pool:
+                    # when one stage fails (e.g. with a BrokenProcessPool) the others are cancelled and the error
+                    # ends the process to be restarted, instead of leaving the others blocked on a full queue.
+                    # Its unacknowledged messages are re-queued by the other writers
+                    async with asyncio.TaskGroup() as stages:
+                        for shard in shards:
+                            stages.create_task(self.db_writer(pool, shard))
+                        stages.create_task(self.dispatch(transformed, shards))
+                        stages.create_task(self.read(loop, executor, transformed, stop))
+
+    async def read(self, loop, executor, transformed: asyncio.Queue, stop: asyncio.Event):
+        """Pops batches off the queue and submits them to the process pool until asked to stop"""
+        depth = 0
+        lease = 0
+        while not stop.is_set():
+            size = self.batcher.next_size(depth)
+            try:
+                # every batch is popped under its own lease, acknowledged once all its listings are written
+                raws, depth = await asyncio.to_thread(self.queue.pop_many, size, 1, str(lease))
+                self.queue_depth.observe(depth)
+            except Exception as e:
+                self.logger.error(f"Queue read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not raws:
                 continue
-            value = message[src]
-            if dst in ["last_asking_price", "surface_area"]:
-                result[dst] = self.reduce_to_int(value)
-            elif dst in ["sell_date", "offer_since"]:
-                result[dst] = self.to_date(value)
-            elif dst == "building_year":
-                try:
-                    result[dst] = date(int(value), 1, 1)
-                except ValueError:
-                    result[dst] = None  # fallback if bouwjaar is malformed
-            else:
-                result[dst] = value
-
-        # Ensure building year exists (even though it might be none)
-        if result.get("building_year") is None:
-            result["building_year"] = None
 
-        # Derived duration field
-        if result.get("sell_date") and result.get("offer_since"):
-            result["sell_duration"] = result["sell_date"] - result["offer_since"]
+            # one chunk per process, submitted in order
+            chunk_size = -(-len(raws) // self.processes)
+            chunks = [raws[start:start + chunk_size] for start in range(0, len(raws), chunk_size)]
+            futures = [(chunk, loop.run_in_executor(executor, process_batch, chunk)) for chunk in chunks]
+            await transformed.put((str(lease), futures))
+            lease += 1
+
+        # clean shutdown: everything popped so far is transformed and written before exiting
+        self.logger.info("Stopping, draining in-flight batches...")
+        await transformed.put(None)
+
+    async def dispatch(self, transformed: asyncio.Queue, shards: list[asyncio.Queue]):
+        """Awaits the transformed batches in pop order and routes their listings to the DB writers, until read stops"""
+        while (item := await transformed.get()) is not None:
+            lease, futures = item
+            batches = [[] for _ in shards]
+            # a lease with messages that failed to be dead-lettered is retried as a whole, not acknowledged
+            dead_lettered = True
+            for chunk, future in futures:
+                listings, failures = await future
+                if failures and not await asyncio.to_thread(self.dead_letter, [(chunk[i], failure) for i, failure in failures.items()], lease):
+                    dead_lettered = False
+                for raw, listing in zip(chunk, listings):
+                    if listing is not None:
+                        batches[zlib.crc32(listing["funda_id"].encode()) % len(shards)].append((raw, listing))
+
+            pending = [(shard, batch) for shard, batch in zip(shards, batches) if batch]
+            if not pending:
+                # nothing valid was popped, so there is nothing to write
+                await asyncio.to_thread(self.queue.ack_lease if dead_lettered else self.queue.nack_lease, lease)
+                continue
 
-        # Add all remaining fields to misc_data
-        # These fields are either used or inferred from other data
-        used_keys = set(field_map.keys()) | {
-            "Aantal kamers", "funda_id", "url", "scraped_at", "Postcode", "postcode", "Looptijd", "city"
-        }
+            self.leases[lease] = [len(pending), dead_lettered, []]
+            for shard, batch in pending:
+                await shard.put((lease, batch))
+
+        for shard in shards:
+            await shard.put(None)
+
+    async def db_writer(self, pool: AsyncConnectionPool, shard: asyncio.Queue):
+        """Writes the batches of one shard, one after another"""
+        while (item := await shard.get()) is not None:
+            lease, batch = item
+            start = time()
+            rejected = await self.write_isolating_async(pool, batch)
+            elapsed = time() - start
+            self.batcher.observe(len(batch), elapsed)
+            self.batch_sizes.observe(len(batch))
+            self.flush_latency.observe(elapsed)
+            if rejected is None:
+                # the lease is retried, but not before the database had some time to come back
+                await asyncio.sleep(self.retry_delay())
+            else:
+                self.failed_writes = 0
+            await self.settle(lease, rejected)
 
-        # wrangle scraped_at into a datetime
-        result["scraped_at"] = datetime.strptime(result["scraped_at"], "%Y-%m-%d %H:%M:%S")
+    async def settle(self, lease: str, rejected: Optional[list[tuple[bytes, Failure]]]):
+        """
+        Acknowledges a lease once all of its shards are written, re-queues it when any of them failed.
+        The listings postgres rejected are dead-lettered first, so they are not re-queued with it.
+        """
+        state = self.leases[lease]
+        state[0] -= 1
+        if rejected is None:
+            state[1] = False
+        else:
+            state[2] += rejected
+        if state[0]:
+            return
 
-        result["misc_data"] = {
-            k: v for k, v in message.items() if k not in used_keys
-        }
+        del self.leases[lease]
+        _, ok, rejected = state
+        if await asyncio.to_thread(self.dead_letter, rejected, lease) and ok:
+            await asyncio.to_thread(self.queue.ack_lease, lease)
+        else:
+            await asyncio.to_thread(self.queue.nack_lease, lease)
+        await asyncio.to_thread(self.push_metrics)
+
+    async def write_isolating_async(self, pool: AsyncConnectionPool, batch: list[tuple[bytes, dict]]) -> Optional[list[tuple[bytes, Failure]]]:
+        """Async counterpart of Writer.write_isolating"""
+        error = await self.write_async(pool, [listing for _, listing in batch])
+        if error is None:
+            return []
+        if not isinstance(error, ROW_ERRORS):
+            return None
+        if len(batch) == 1:
+            return [(batch[0][0], rejection(error))]
+
+        middle = len(batch) // 2
+        rejected = []
+        for half in (batch[:middle], batch[middle:]):
+            half_rejected = await self.write_isolating_async(pool, half)
+            if half_rejected is None:
+                return None
+            rejected += half_rejected
+        return rejected
+
+    async def write_async(self, pool: AsyncConnectionPool, listings: list[dict]) -> Optional[Exception]:
+        """Async counterpart of Writer.write on a pooled connection"""
+        try:
+            async with pool.connection() as aconn:
+                async with aconn.cursor() as cur:
+                    await cur.execute(CREATE_STAGING)
+                    async with cur.copy(COPY_STAGING) as copy:
+                        copy.set_types(COLUMN_TYPES)
+                        for listing in listings:
+                            await copy.write_row([listing.get(column) for column in COLUMN_NAMES])
+                    await cur.execute(MERGE_STAGING)
+                    inserted = cur.rowcount
+            # the pool commits when the connection is returned
+            self.logger.info(f"Wrote batch of {len(listings)} listings to database ({inserted} new)")
+            self.writes.labels(code='success').inc()
+            return None
+        except Exception as e:
+            self.logger.error(f"Failed to write batch of {len(listings)} listings: {e}")
+            self.writes.labels(code='failure').inc()
+            return e
 
-        return result
 
 if __name__ == "__main__":
-    writer = Writer()
+    if os.getenv("WRITER_MODE", "single") == "parallel":
+        writer = ParallelWriter()
+    else:
+        writer = Writer()
     writer.listen()
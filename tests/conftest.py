@@ -0,0 +1,73 @@
+import fakeredis
+import psycopg
+import pytest
+
+from pathlib import Path
+from prometheus_client import CollectorRegistry
+from unittest.mock import MagicMock
+
+from extractor import extract_listing
+
+FIXTURES = Path(__file__).resolve().parents[1] / "benchmarks" / "fixtures"
+
+
+@pytest.fixture
+def r():
+    """A fresh in-memory redis with lua scripting, per test"""
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(scope="session")
+def html() -> list[str]:
+    """The listing page fixtures"""
+    return [fixture.read_text() for fixture in sorted(FIXTURES.glob("detail_*.html"))]
+
+
+@pytest.fixture(scope="session")
+def pages(html) -> list[dict]:
+    """The scraped fields of the listing page fixtures"""
+    return [extract_listing(content) for content in html]
+
+
+@pytest.fixture
+def messages(pages) -> list[dict]:
+    """Scraped listings as the scraper queues them, repeating the fixtures with a few distinct values"""
+    messages = []
+    for i in range(12):
+        message = {
+            "funda_id": str(40000000 + i),
+            "url": f"https://www.funda.nl/detail/koop/tilburg/huis/{40000000 + i}/",
+            "scraped_at": f"2025-08-01 12:00:{i:02d}",
+            **pages[i % len(pages)],
+        }
+        message["Laatste vraagprijs"] = f"€ {200 + i * 25}.000 k.k."
+        messages.append(message)
+    return messages
+
+
+@pytest.fixture
+def writer_module(monkeypatch, r):
+    """The writer script on the in-memory redis, with a stand-in for the postgres connection it makes on import"""
+    monkeypatch.setattr(psycopg, "connect", lambda *args, **kwargs: MagicMock())
+    import writer
+    monkeypatch.setattr(writer, "r", r)
+    # every Writer registers its metrics
+    monkeypatch.setattr(writer, "registry", CollectorRegistry())
+    monkeypatch.setattr(writer, "push_to_gateway", MagicMock())
+    return writer
+
+
+@pytest.fixture
+def writer(writer_module):
+    return writer_module.Writer()
+
+
+@pytest.fixture
+def scraper_module(monkeypatch, r):
+    """The scraper script on the in-memory redis, without the metrics gateway"""
+    import scraper
+    monkeypatch.setattr(scraper, "r", r)
+    monkeypatch.setattr(scraper, "registry", CollectorRegistry())
+    monkeypatch.setattr(scraper, "push_to_gateway", MagicMock())
+    monkeypatch.setattr(scraper, "sleep", lambda seconds: None)
+    return scraper
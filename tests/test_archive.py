@@ -0,0 +1,69 @@
+import os
+
+from archive import PageArchive, load
+
+
+def info(funda_id: int) -> dict:
+    return {"funda_id": str(funda_id), "url": f"https://www.funda.nl/detail/koop/tilburg/huis/{funda_id}/",
+            "scraped_at": "2025-08-01 12:00:00", "Laatste vraagprijs": "€ 250.000 k.k."}
+
+
+def age(path, seconds: int):
+    """Sets the modification time of an archived page back by `seconds`"""
+    stat = path.stat()
+    os.utime(path, (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+
+def test_stores_the_page_with_its_listing_fields(tmp_path, html):
+    archive = PageArchive(tmp_path)
+
+    path = archive.put(info(40000000), html[0])
+
+    assert path.parent == tmp_path / "40000000"
+    fields, content = load(path)
+    # only the fields needed to extract it again
+    assert fields == {key: info(40000000)[key] for key in ("funda_id", "url", "scraped_at")}
+    assert content == html[0]
+    assert path.stat().st_size < len(html[0].encode()) / 3
+
+
+def test_stores_an_unchanged_page_once(tmp_path, html):
+    archive = PageArchive(tmp_path)
+    first = archive.put(info(40000000), html[0])
+    age(first, 3600)
+    aged = first.stat().st_mtime
+
+    assert archive.put(info(40000000), html[0]) == first
+    assert len(archive.entries()) == 1
+    # the page fetched again is marked as recently stored
+    assert first.stat().st_mtime > aged
+
+    archive.put(info(40000000), html[1])
+    assert len(archive.entries()) == 2
+
+
+def test_latest_is_the_most_recently_stored_page_of_every_listing(tmp_path, html):
+    archive = PageArchive(tmp_path)
+    old = archive.put(info(40000000), html[0])
+    age(old, 3600)
+    new = archive.put(info(40000000), html[1])
+    other = archive.put(info(40000001), html[0])
+
+    assert sorted(archive.latest()) == sorted([new, other])
+
+
+def test_evicts_the_least_recently_stored_pages(tmp_path, html):
+    size = PageArchive(tmp_path / "probe").put(info(40000000), html[0]).stat().st_size
+    archive = PageArchive(tmp_path / "archive", max_bytes=int(3.5 * size))
+    paths = []
+    for i in range(3):
+        paths.append(archive.put(info(40000000 + i), html[0]))
+        age(paths[-1], 3600 - i)
+
+    # refetching the oldest page keeps it in the archive
+    archive.put(info(40000000), html[0])
+    paths.append(archive.put(info(40000003), html[0]))
+
+    assert not paths[1].exists() and not paths[1].parent.exists()
+    assert all(path.exists() for path in (paths[0], paths[2], paths[3]))
+    assert archive.size == archive.disk_usage() <= 0.9 * archive.max_bytes
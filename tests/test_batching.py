@@ -0,0 +1,56 @@
+import pytest
+
+from batching import AdaptiveBatcher
+
+
+@pytest.fixture
+def batcher() -> AdaptiveBatcher:
+    return AdaptiveBatcher(min_size=10, max_size=5000, latency_slo=5, smoothing=0.5)
+
+
+def test_follows_the_queue_depth_between_the_bounds(batcher):
+    assert batcher.next_size(0) == 10
+    assert batcher.next_size(300) == 300
+    assert batcher.next_size(1_000_000) == 5000
+
+
+def test_limits_the_size_to_what_commits_within_half_the_slo(batcher):
+    # 1 ms per listing, so 2500 listings take the 2.5 s budget of the commit
+    batcher.observe(1000, 1.0)
+
+    assert batcher.next_size(1_000_000) == 2500
+    assert batcher.next_size(300) == 300
+
+
+def test_smooths_the_latency(batcher):
+    batcher.observe(1000, 1.0)
+    batcher.observe(1000, 5.0)
+
+    # halfway between 1 and 5 ms per listing
+    assert batcher.seconds_per_row == pytest.approx(0.003)
+    assert batcher.seconds_per_commit == pytest.approx(3.0)
+    assert batcher.next_size(1_000_000) == 833
+
+
+def test_ignores_empty_batches(batcher):
+    batcher.observe(0, 1.0)
+
+    assert batcher.seconds_per_row is None
+    assert batcher.next_size(1_000_000) == 5000
+
+
+def test_never_goes_below_the_minimum_when_commits_are_slow(batcher):
+    batcher.observe(10, 60.0)
+
+    assert batcher.next_size(1_000_000) == 10
+
+
+def test_max_wait_leaves_room_for_the_commit(batcher):
+    # half of the budget is reserved for the commit, even before any was observed
+    assert batcher.max_wait() == 2.5
+
+    batcher.observe(1000, 4.0)
+    assert batcher.max_wait() == pytest.approx(1.0)
+
+    batcher.observe(1000, 20.0)
+    assert batcher.max_wait() == 0
@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+
+from playwright.sync_api import Error as PlaywrightError
+
+from browser_pool import AsyncBrowserPool, BrowserPool
+
+
+class FakePage:
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+        self.pages = []
+
+    def new_page(self) -> FakePage:
+        self.pages.append(FakePage())
+        return self.pages[-1]
+
+    def close(self):
+        self.closed = True
+        for page in self.pages:
+            page.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+        self.contexts = []
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def new_context(self, user_agent: str) -> FakeContext:
+        self.contexts.append(FakeContext())
+        return self.contexts[-1]
+
+    def close(self):
+        self.connected = False
+
+
+class FakePlaywright:
+    """Stands in for playwright, launching fake browsers"""
+    def __init__(self):
+        self.browsers = []
+        self.chromium = self
+
+    def launch(self, headless: bool) -> FakeBrowser:
+        self.browsers.append(FakeBrowser())
+        return self.browsers[-1]
+
+
+@pytest.fixture
+def pool():
+    pool = BrowserPool(max_pages=100, context_max_pages=10)
+    pool._playwright = FakePlaywright()
+    return pool
+
+
+def test_reuses_the_browser_and_recycles_contexts(pool):
+    for _ in range(25):
+        with pool.page():
+            pass
+
+    (browser,) = pool._playwright.browsers
+    assert len(browser.contexts) == 3
+    assert pool.restarts == 0
+
+
+def test_page_error_only_replaces_the_context(pool):
+    with pool.page() as page:
+        pass
+    with pytest.raises(PlaywrightError):
+        with pool.page():
+            raise PlaywrightError("Timeout 30000ms exceeded")
+
+    assert page.is_closed()
+    with pool.page() as next_page:
+        assert next_page is not page
+    assert len(pool._playwright.browsers) == 1
+    assert pool.restarts == 0
+
+
+def test_restarts_a_disconnected_browser(pool):
+    with pytest.raises(PlaywrightError):
+        with pool.page():
+            pool._browser.connected = False
+            raise PlaywrightError("Target page, context or browser has been closed")
+
+    assert len(pool._playwright.browsers) == 2
+    assert pool.restarts == 1
+    assert pool._browser is pool._playwright.browsers[-1]
+
+
+def test_restarts_after_max_pages(pool):
+    for _ in range(101):
+        with pool.page():
+            pass
+
+    assert len(pool._playwright.browsers) == 2
+
+
+class AsyncFakeContext(FakeContext):
+    async def new_page(self) -> FakePage:
+        return super().new_page()
+
+    async def close(self):
+        super().close()
+
+
+class AsyncFakeBrowser(FakeBrowser):
+    async def new_context(self, user_agent: str) -> AsyncFakeContext:
+        self.contexts.append(AsyncFakeContext())
+        return self.contexts[-1]
+
+    async def close(self):
+        super().close()
+
+
+class AsyncFakePlaywright(FakePlaywright):
+    async def launch(self, headless: bool) -> AsyncFakeBrowser:
+        self.browsers.append(AsyncFakeBrowser())
+        return self.browsers[-1]
+
+
+def test_async_page_error_leaves_the_other_slots_alone():
+    async def run():
+        pool = AsyncBrowserPool(size=2)
+        pool._playwright = AsyncFakePlaywright()
+
+        async with pool.page() as (slow, _):
+            with pytest.raises(PlaywrightError):
+                async with pool.page() as (failing, _):
+                    raise PlaywrightError("Timeout 30000ms exceeded")
+            assert failing.is_closed()
+            assert not slow.is_closed()
+        return pool
+
+    pool = asyncio.run(run())
+    assert len(pool._playwright.browsers) == 1
+    assert pool.restarts == 0
@@ -0,0 +1,42 @@
+import json
+import pytest
+
+from codec import COMPRESS_MIN_BYTES, VERSION_1, decode, encode, make_encoder
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack", "msgpack-zstd"])
+def test_round_trip(messages, codec):
+    encoder = make_encoder(codec)
+    for message in messages:
+        assert decode(encoder(message)) == message
+
+
+def test_round_trip_keeps_unknown_fields_and_nulls():
+    message = {"funda_id": "1", "url": "/detail/1/", "Nieuw veld": "waarde", "Bouwjaar": None}
+    assert decode(encode(message)) == message
+
+
+def test_compresses_large_misc_only(pages):
+    message = {"funda_id": "1", "url": "/detail/1/", **pages[-1]}
+    compressed = encode(message, compress=True)
+    assert compressed[0] == VERSION_1
+    assert len(compressed) < len(encode(message))
+
+    small = {"funda_id": "1", "url": "/detail/1/", "Status": "Verkocht"}
+    assert len(encode(small)) < COMPRESS_MIN_BYTES
+    assert encode(small, compress=True) == encode(small)
+
+
+def test_decodes_legacy_json():
+    message = {"funda_id": "1", "url": "/detail/1/", "Titel": "Langestraat 6"}
+    assert decode(json.dumps(message).encode()) == message
+
+
+def test_rejects_unknown_version():
+    with pytest.raises(ValueError, match="Unknown message version"):
+        decode(bytes((2,)) + encode({"funda_id": "1"})[1:])
+
+
+def test_rejects_unknown_codec():
+    with pytest.raises(ValueError, match="Unknown message codec"):
+        make_encoder("protobuf")
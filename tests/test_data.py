@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+from data import FrameCache, histogram_quantile
+
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"value": np.arange(rows, dtype=np.int64)})
+
+
+def size(rows: int) -> int:
+    return int(frame(rows).memory_usage(deep=True).sum())
+
+
+def test_evicts_least_recently_used():
+    cache = FrameCache(max_bytes=3 * size(100))
+    for key in "abc":
+        cache.put(key, frame(100))
+    # a becomes the most recently used, so b goes first
+    assert cache.get("a") is not None
+
+    cache.put("d", frame(100))
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.size == 3 * size(100)
+
+
+def test_evicts_until_the_new_frame_fits():
+    cache = FrameCache(max_bytes=4 * size(100))
+    for key in "abc":
+        cache.put(key, frame(100))
+
+    cache.put("big", frame(300))
+
+    assert list(cache.frames) == ["c", "big"]
+    assert cache.size == size(100) + size(300)
+
+
+def test_skips_frames_larger_than_the_cache():
+    cache = FrameCache(max_bytes=size(100))
+    cache.put("a", frame(100))
+
+    cache.put("a", frame(1000))
+
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_replacing_a_frame_keeps_the_size():
+    cache = FrameCache(max_bytes=3 * size(100))
+    cache.put("a", frame(100))
+    cache.put("a", frame(50))
+
+    assert len(cache.get("a")) == 50
+    assert cache.size == size(50)
+
+
+def test_expires_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(data, "monotonic", lambda: now[0])
+    cache = FrameCache(ttl=60)
+    cache.put("a", frame(10))
+
+    now[0] += 59
+    assert cache.get("a") is not None
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+@pytest.mark.parametrize("counts, q, expected", [
+    ([2, 2], 0.5, 10),
+    ([0, 4, 0], 0.5, 15),
+    ([1, 0, 3], 0.5, 23.333333),
+])
+def test_histogram_quantile(counts, q, expected):
+    assert histogram_quantile(np.array(counts), 10, q) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("counts", [[0, 0, 0], []])
+def test_histogram_quantile_of_empty_histogram(counts):
+    assert np.isnan(histogram_quantile(np.array(counts), 10, 0.5))
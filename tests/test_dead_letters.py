@@ -0,0 +1,84 @@
+import pytest
+
+from argparse import Namespace
+from collections import Counter
+
+from codec import encode
+from queues import DeadLetters, make_queue
+from redrive import redrive
+from transform import process_batch
+
+
+def redrive_args(**overrides) -> Namespace:
+    return Namespace(**{"stage": None, "field": None, "reason": None, "limit": None,
+                        "batch_size": 2, "dry_run": False, **overrides})
+
+
+@pytest.fixture
+def dead_letters(r, messages):
+    """The dead letters of a batch with a listing that failed to transform and one without a url"""
+    messages[2]["Laatste vraagprijs"] = "prijs op aanvraag"
+    del messages[5]["url"]
+    raws = [encode(message) for message in messages]
+    _, failures = process_batch(raws)
+
+    dead_letters = DeadLetters(r, "data_queue")
+    dead_letters.push([(raws[i], failure) for i, failure in failures.items()], "writer")
+    return dead_letters
+
+
+def test_push_keeps_the_failure(dead_letters, messages):
+    (entries,) = dead_letters.scan(10)
+    fields = {entry["field"]: entry for _, entry in entries}
+
+    assert dead_letters.depth() == 2
+    assert fields["Laatste vraagprijs"]["stage"] == "transform"
+    assert fields["Laatste vraagprijs"]["reason"] == "parse"
+    assert fields["Laatste vraagprijs"]["consumer"] == "writer"
+    assert fields["url"]["stage"] == "input"
+    assert fields["Laatste vraagprijs"]["data"] == encode(messages[2])
+
+
+def test_scan_pages_through_all(r):
+    dead_letters = DeadLetters(r, "data_queue")
+    dead_letters.push([(f"message {i}".encode(), ("input", "url", "missing")) for i in range(5)], "writer")
+
+    pages = list(dead_letters.scan(2))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [fields["data"] for page in pages for _, fields in page] == [f"message {i}".encode() for i in range(5)]
+
+
+def test_redrive_leaves_the_still_failing(r, dead_letters):
+    queue = make_queue(r, "data_queue", "redrive")
+
+    outcomes = redrive(dead_letters, queue, redrive_args())
+
+    assert outcomes == Counter({"still failing: transform Laatste vraagprijs parse": 1, "still failing: input url missing": 1})
+    assert dead_letters.depth() == 2
+    assert queue.lag() == 0
+
+
+def test_redrive_pushes_back_the_fixed(r, dead_letters, messages):
+    queue = make_queue(r, "data_queue", "redrive")
+    # stands in for a fix of the transforms: the dead letter now has a price they parse
+    (entries,) = dead_letters.scan(10)
+    fixed = [message_id for message_id, fields in entries if fields["field"] == "Laatste vraagprijs"]
+    dead_letters.remove(fixed)
+    dead_letters.push([(encode({**messages[2], "Laatste vraagprijs": "€ 250.000 k.k."}), ("transform", "Laatste vraagprijs", "parse"))], "writer")
+
+    outcomes = redrive(dead_letters, queue, redrive_args(stage="transform"))
+
+    assert outcomes == Counter({"redriven": 1})
+    assert dead_letters.depth() == 1
+    assert queue.pop(0.01) is not None
+
+
+def test_redrive_dry_run_changes_nothing(r, dead_letters):
+    queue = make_queue(r, "data_queue", "redrive")
+    dead_letters.push([(encode({"funda_id": "1", "url": "/detail/1/"}), ("input", "scraped_at", "missing"))], "writer")
+
+    outcomes = redrive(dead_letters, queue, redrive_args(dry_run=True, limit=1))
+
+    assert sum(outcomes.values()) == 1
+    assert dead_letters.depth() == 3
+    assert queue.lag() == 0
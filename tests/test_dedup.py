@@ -0,0 +1,60 @@
+import pytest
+
+from dedup import BloomSeenSet, ExactSeenSet, make_seen_set
+from queues import make_queue
+
+
+def items(ids) -> list[tuple[str, str]]:
+    return [(str(funda_id), f"payload {funda_id}") for funda_id in ids]
+
+
+@pytest.fixture(params=["exact", "bloom"])
+def seen(request, r):
+    if request.param == "bloom":
+        return BloomSeenSet(r, capacity=1000, error_rate=0.001)
+    return ExactSeenSet(r)
+
+
+def test_pushes_only_unseen_ids(r, seen):
+    queue = make_queue(r, "listing_queue", "crawler")
+
+    assert seen.push_new(items(range(10)), queue) == 10
+    assert seen.push_new(items(range(5, 15)), queue) == 5
+    assert seen.push_new([], queue) == 0
+
+    assert queue.lag() == 15
+    assert sorted(r.lrange("listing_queue", 0, -1)) == sorted(payload.encode() for _, payload in items(range(15)))
+
+
+def test_pushes_duplicates_within_a_batch_once(r, seen):
+    queue = make_queue(r, "listing_queue", "crawler")
+
+    assert seen.push_new(items([1, 2, 1, 2, 3]), queue) == 3
+
+
+def test_bloom_sizing(r):
+    bloom = BloomSeenSet(r, capacity=1_000_000, error_rate=0.01)
+
+    # about 9.6 bits and 7 hashes per id for a 1% false positive rate
+    assert bloom.size == pytest.approx(9_585_059, rel=1e-3)
+    assert bloom.hashes == 7
+    assert len(set(bloom.offsets("40000000"))) == 7
+    assert all(0 <= offset < bloom.size for offset in bloom.offsets("40000000"))
+
+
+def test_bloom_false_positive_rate_at_capacity(r):
+    bloom = BloomSeenSet(r, capacity=2000, error_rate=0.01)
+    bloom.push_new(items(range(2000)), make_queue(r, "listing_queue", "crawler"))
+
+    # probed without pushing, pushing would fill the filter further
+    false_positives = sum(all(r.getbit(bloom.key, offset) for offset in bloom.offsets(str(funda_id)))
+                          for funda_id in range(10_000, 12_000))
+
+    assert false_positives / 2000 < 0.02
+    assert 0.4 < bloom.fill_ratio() < 0.6
+
+
+def test_make_seen_set_rejects_unknown_store(r):
+    assert isinstance(make_seen_set(r, "bloom"), BloomSeenSet)
+    with pytest.raises(ValueError, match="Unknown dedup store"):
+        make_seen_set(r, "cuckoo")
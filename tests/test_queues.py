@@ -0,0 +1,147 @@
+import pytest
+
+from time import sleep
+
+from queues import ReliableQueue, StreamQueue, make_queue
+
+TRANSPORTS = ["list", "stream"]
+
+
+def drain(queue, lease: str = "drain") -> list[bytes]:
+    """Pops everything that is left on the queue"""
+    raws = []
+    while raw := queue.pop(0.01, lease):
+        raws.append(raw)
+    return raws
+
+
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_ack_removes_the_message(r, transport):
+    queue = make_queue(r, "test_queue", "consumer", transport)
+    queue.push([b"a", b"b"])
+
+    raw = queue.pop(0.01)
+    queue.ack(raw)
+    queue.nack_lease()
+
+    assert drain(queue) == [b"b"]
+
+
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_nack_puts_the_message_back(r, transport):
+    queue = make_queue(r, "test_queue", "consumer", transport)
+    queue.push([b"a", b"b"])
+
+    raw = queue.pop(0.01)
+    queue.nack(raw)
+
+    assert sorted(drain(queue)) == [b"a", b"b"]
+
+
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_nack_lease_requeues_only_the_unacknowledged(r, transport):
+    queue = make_queue(r, "test_queue", "consumer", transport)
+    queue.push([b"a", b"b", b"c", b"d"])
+
+    raws, _ = queue.pop_many(4, 0.01, lease="batch")
+    assert sorted(raws) == [b"a", b"b", b"c", b"d"]
+    # e.g. the dead-lettered messages of a batch that failed to write
+    queue.ack_many([b"b", b"d"], lease="batch")
+
+    assert queue.nack_lease("batch") == 2
+    assert queue.nack_lease("batch") == 0
+    assert sorted(drain(queue)) == [b"a", b"c"]
+
+
+@pytest.mark.parametrize("transport", TRANSPORTS)
+def test_ack_lease_acknowledges_the_whole_batch(r, transport):
+    queue = make_queue(r, "test_queue", "consumer", transport)
+    queue.push([b"a", b"b"])
+
+    queue.pop_many(2, 0.01, lease="batch")
+    queue.ack_lease("batch")
+
+    assert queue.nack_lease("batch") == 0
+    assert drain(queue) == []
+
+
+def test_reliable_queue_reaps_dead_consumers(r):
+    dead = ReliableQueue(r, "test_queue", "dead", heartbeat_ttl=60)
+    alive = ReliableQueue(r, "test_queue", "alive", heartbeat_ttl=60)
+    dead.push([b"a", b"b"])
+    assert dead.pop(0.01) == b"a"
+    assert alive.pop(0.01) == b"b"
+
+    # the heartbeat of a live consumer keeps its messages in flight
+    assert alive.reap() == 0
+
+    r.delete(dead.heartbeat_key)
+    assert alive.reap() == 1
+    assert r.llen(dead.processing()) == 0
+    assert alive.pop(0.01) == b"a"
+
+
+def test_reliable_queue_keepalive_refreshes_the_heartbeat(r):
+    queue = ReliableQueue(r, "test_queue", "consumer", heartbeat_ttl=1)
+    other = ReliableQueue(r, "test_queue", "other", heartbeat_ttl=1)
+    queue.push([b"a"])
+    queue.pop(0.01)
+
+    with queue.keepalive():
+        sleep(1.5)
+        assert other.reap() == 0
+
+    r.delete(queue.heartbeat_key)
+    assert other.reap() == 1
+
+
+def test_stream_queue_reaps_stale_pending_messages(r):
+    dead = StreamQueue(r, "test_stream", "dead", heartbeat_ttl=60)
+    dead.push([b"a"])
+    assert dead.pop(0.01) == b"a"
+
+    assert StreamQueue(r, "test_stream", "alive", heartbeat_ttl=60).reap() == 0
+
+    # anything pending is stale with a TTL of 0
+    alive = StreamQueue(r, "test_stream", "alive", heartbeat_ttl=0)
+    assert alive.reap() == 1
+    assert alive.pop(0.01) == b"a"
+    alive.ack(b"a")
+    assert alive.reap() == 0
+
+
+def test_stream_queue_keepalive_resets_the_idle_time(r):
+    queue = StreamQueue(r, "test_stream", "consumer", heartbeat_ttl=1)
+    other = StreamQueue(r, "test_stream", "other", heartbeat_ttl=1)
+    queue.push([b"a"])
+    queue.pop(0.01)
+
+    with queue.keepalive():
+        sleep(1.5)
+        assert other.reap() == 0
+
+    sleep(1.1)
+    assert other.reap() == 1
+
+
+def test_make_queue_rejects_unknown_transport(r):
+    with pytest.raises(ValueError, match="Unknown queue transport"):
+        make_queue(r, "test_queue", "consumer", "kafka")
+
+
+def test_stream_queue_reports_the_group_lag(r):
+    queue = StreamQueue(r, "test_stream", "consumer")
+    queue.push([b"a", b"b", b"c"])
+
+    raws, lag = queue.pop_many(1, 0.01)
+
+    assert raws == [b"a"]
+    assert lag == 2
+    assert queue.lag() == 2
+
+
+def test_stream_queue_trims_to_maxlen(r):
+    queue = StreamQueue(r, "test_stream", "consumer", maxlen=100)
+    queue.push([f"message {i}".encode() for i in range(1000)])
+
+    assert r.xlen("test_stream") < 1000
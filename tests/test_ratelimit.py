@@ -0,0 +1,48 @@
+import pytest
+
+from ratelimit import RateController
+
+
+@pytest.fixture
+def limiter(r) -> RateController:
+    return RateController(r, "crawler", start_rate=2, min_rate=0.5, max_rate=4, increase=0.5, decrease=0.5)
+
+
+def test_spaces_the_slots_by_the_rate(limiter):
+    waits = [limiter.acquire() for _ in range(4)]
+
+    assert waits == pytest.approx([0, 0.5, 1.0, 1.5], abs=0.05)
+
+
+def test_workers_share_the_rate(r, limiter):
+    other = RateController(r, "crawler", start_rate=2, min_rate=0.5, max_rate=4)
+
+    assert [limiter.acquire(), other.acquire(), limiter.acquire()] == pytest.approx([0, 0.5, 1.0], abs=0.05)
+    # another kind of worker has a rate of its own
+    assert RateController(r, "scraper", 2, 0.5, 4).acquire() == pytest.approx(0, abs=0.05)
+
+
+def test_increases_additively_and_decreases_multiplicatively(limiter):
+    assert limiter.rate() == 2
+    assert limiter.feedback(False) == 2.5
+    assert limiter.feedback(False) == 3
+    assert limiter.feedback(True) == 1.5
+    assert limiter.rate() == 1.5
+
+
+def test_stays_within_the_bounds(limiter):
+    for _ in range(10):
+        limiter.feedback(False)
+    assert limiter.rate() == 4
+
+    for _ in range(10):
+        limiter.feedback(True)
+    assert limiter.rate() == 0.5
+
+
+def test_blocked_response_pushes_back_the_next_slot(limiter):
+    limiter.acquire()
+    limiter.feedback(True)
+
+    # the slot reserved at 2/s and a full interval of the new rate of 1/s
+    assert limiter.acquire() == pytest.approx(1.5, abs=0.05)
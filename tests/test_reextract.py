@@ -0,0 +1,45 @@
+import psycopg
+import pytest
+
+from reextract import write_batch
+
+
+def rejecting_write(bad_ids=(), error=psycopg.DataError):
+    """A Writer.write that fails every batch holding one of `bad_ids`, recording whether it upserted"""
+    upserts = []
+
+    def write(listings: list[dict], upsert: bool = False):
+        upserts.append(upsert)
+        if any(listing["funda_id"] in bad_ids for listing in listings):
+            return error("value too long for type character varying(255)")
+        return None
+    return write, upserts
+
+
+@pytest.fixture
+def listings(messages) -> list[dict]:
+    return [{"funda_id": message["funda_id"]} for message in messages]
+
+
+def test_upserts_the_batch(writer, listings):
+    writer.write, upserts = rejecting_write()
+
+    assert write_batch(writer, listings) == 0
+    assert upserts == [True]
+
+
+def test_counts_and_reports_the_rejected_listings(writer, listings, caplog):
+    writer.write, upserts = rejecting_write({"40000003"})
+
+    assert write_batch(writer, listings) == 1
+    # the halves are upserted as well
+    assert len(upserts) > 1 and all(upserts)
+    assert "Listing 40000003 was rejected by the database: DataError" in caplog.text
+
+
+def test_stops_when_the_database_fails(writer, listings):
+    writer.write, _ = rejecting_write({"40000003"}, error=psycopg.OperationalError)
+
+    with pytest.raises(SystemExit) as exit:
+        write_batch(writer, listings)
+    assert exit.value.code == 1
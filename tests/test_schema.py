@@ -0,0 +1,64 @@
+import pytest
+
+from schema import Field, LISTING, compile_validator, sql_columns, validate_listing, validate_scraped
+from transform import transform
+
+FIELDS = (
+    Field("funda_id", (str,), "text"),
+    Field("bedrooms", (int,), "integer", required=False, nullable=True),
+    Field("surface_area", (int, float), "numeric"),
+    Field("misc_data"),
+)
+
+
+@pytest.fixture
+def validate():
+    return compile_validator(FIELDS)
+
+
+def test_accepts_a_valid_row(validate):
+    assert validate({"funda_id": "40000000", "bedrooms": 2, "surface_area": 78, "misc_data": {}}) is None
+    # optional and nullable fields, a second accepted type, and anything for an untyped field
+    assert validate({"funda_id": "40000000", "surface_area": 78.5, "misc_data": "{}"}) is None
+    assert validate({"funda_id": "40000000", "bedrooms": None, "surface_area": 78, "misc_data": [1]}) is None
+
+
+@pytest.mark.parametrize("row, error", [
+    ({"bedrooms": 2, "surface_area": 78, "misc_data": {}}, ("funda_id", "missing")),
+    ({"funda_id": None, "surface_area": 78, "misc_data": {}}, ("funda_id", "null")),
+    ({"funda_id": 40000000, "surface_area": 78, "misc_data": {}}, ("funda_id", "type")),
+    ({"funda_id": "40000000", "bedrooms": "2", "surface_area": 78, "misc_data": {}}, ("bedrooms", "type")),
+    ({"funda_id": "40000000", "surface_area": "78 m²", "misc_data": {}}, ("surface_area", "type")),
+    ({"funda_id": "40000000", "surface_area": 78}, ("misc_data", "missing")),
+])
+def test_returns_the_first_failing_field(validate, row, error):
+    assert validate(row) == error
+
+
+@pytest.mark.parametrize("bedrooms, error", [
+    (2 ** 31 - 1, None),
+    (-2 ** 31, None),
+    (2 ** 31, ("bedrooms", "range")),
+    (-2 ** 31 - 1, ("bedrooms", "range")),
+])
+def test_rejects_integers_outside_the_postgres_integer_range(validate, bedrooms, error):
+    assert validate({"funda_id": "40000000", "bedrooms": bedrooms, "surface_area": 78, "misc_data": {}}) == error
+
+
+def test_numeric_columns_have_no_range(validate):
+    assert validate({"funda_id": "40000000", "surface_area": 10 ** 20, "misc_data": {}}) is None
+
+
+def test_validates_the_scraped_and_transformed_listings(messages):
+    assert validate_scraped(messages[0]) is None
+    del messages[1]["Postcode"]
+    assert validate_scraped(messages[1]) == ("Postcode", "missing")
+
+    listing = transform(messages[0])
+    assert validate_listing(listing) is None
+    listing["last_asking_price"] = 5_000_000_000
+    assert validate_listing(listing) == ("last_asking_price", "range")
+
+
+def test_listing_agrees_with_the_sql_schema():
+    assert sql_columns() == [(field.name, field.sql_type) for field in LISTING if field.sql_type]
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+
+from archive import PageArchive, load
+from fetchers import Blocked, FetchResult
+
+URL = "https://www.funda.nl/detail/koop/tilburg/huis/40000000/"
+CAPTCHA = "<html><head><title>Je bent bijna op de pagina die je zoekt</title></head></html>"
+
+
+class FakeFetcher:
+    """Answers every fetch with the same result"""
+    def __init__(self, result: FetchResult):
+        self.result = result
+
+    def fetch(self, url: str) -> FetchResult:
+        return self.result
+
+    def close(self):
+        pass
+
+
+class AsyncFakeFetcher(FakeFetcher):
+    async def fetch(self, url: str) -> FetchResult:
+        return self.result
+
+    async def close(self):
+        pass
+
+
+def fallback_result(content: str) -> FetchResult:
+    """A browser fetch of the listing after the http fetch was blocked"""
+    return FetchResult(URL, 200, content, "browser", fallback_from=FetchResult(URL, 403, "", "http"))
+
+
+@pytest.fixture
+def scraper(scraper_module, tmp_path):
+    scraper = scraper_module.Scraper()
+    scraper.archive = PageArchive(tmp_path)
+    return scraper
+
+
+def test_archives_the_clean_fallback_of_a_blocked_fetch(scraper, html):
+    scraper.fetcher = FakeFetcher(fallback_result(html[0]))
+
+    scraper.scrape(URL)
+
+    (path,) = scraper.archive.latest()
+    assert load(path)[1] == html[0]
+    # the blocked attempt still slows down the shared rate
+    assert scraper.limiter.rate() < scraper.limiter.start_rate
+    assert scraper.output.lag() == 1
+
+
+def test_never_archives_a_block_page(scraper):
+    scraper.fetcher = FakeFetcher(fallback_result(CAPTCHA))
+
+    with pytest.raises(Blocked):
+        scraper.scrape(URL)
+
+    assert list(scraper.archive.latest()) == []
+    assert scraper.output.lag() == 0
+
+
+def test_async_archives_the_clean_fallback_of_a_blocked_fetch(scraper_module, tmp_path, html):
+    scraper = scraper_module.AsyncScraper(concurrency=2)
+    scraper.archive = PageArchive(tmp_path)
+    scraper.fetcher = AsyncFakeFetcher(fallback_result(html[0]))
+
+    asyncio.run(scraper.scrape_async(URL))
+
+    (path,) = scraper.archive.latest()
+    assert load(path)[1] == html[0]
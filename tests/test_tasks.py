@@ -0,0 +1,114 @@
+
+from tasks import PageTasks
+
+
+def claim_all(tasks: PageTasks) -> list[tuple[bytes, dict]]:
+    claimed = []
+    while task := tasks.claim(0.01):
+        claimed.append(task)
+    return claimed
+
+
+def test_seeds_interleaved_pages_once(r):
+    tasks = PageTasks(r, "crawler-1")
+
+    assert tasks.start_sweep(["tilburg", "utrecht"], 3) == 6
+    # a second worker joins the running sweep instead of seeding another
+    assert PageTasks(r, "crawler-2").start_sweep(["tilburg", "utrecht"], 3) == 0
+
+    claimed = [(task["region"], task["page"]) for _, task in claim_all(tasks)]
+    assert claimed == [("tilburg", 1), ("utrecht", 1), ("tilburg", 2), ("utrecht", 2), ("tilburg", 3), ("utrecht", 3)]
+
+
+def test_sweep_ends_after_its_last_task(r):
+    tasks = PageTasks(r, "crawler-1")
+    tasks.start_sweep(["tilburg"], 2)
+    first, second = claim_all(tasks)
+
+    assert tasks.finish(first[0]) == 1
+    assert tasks.running()
+    assert tasks.finish(second[0]) == 0
+    assert not tasks.running()
+    # finishing a task twice doesn't count it twice
+    assert tasks.finish(second[0]) == -1
+
+    assert tasks.start_sweep(["tilburg"], 2) == 2
+
+
+def test_retried_tasks_are_claimed_again(r):
+    tasks = PageTasks(r, "crawler-1")
+    tasks.start_sweep(["tilburg"], 1)
+    raw, task = tasks.claim(0.01)
+
+    tasks.retry(raw)
+
+    assert tasks.claim(0.01) == (raw, task)
+    assert tasks.running()
+
+
+def test_tasks_of_a_crashed_worker_are_reaped(r):
+    crashed = PageTasks(r, "crawler-1")
+    crashed.start_sweep(["tilburg"], 1)
+    raw, _ = crashed.claim(0.01)
+    r.delete(crashed.queue.heartbeat_key)
+
+    other = PageTasks(r, "crawler-2")
+    assert other.queue.reap() == 1
+    assert other.claim(0.01)[0] == raw
+
+
+def test_exhausted_regions_reset_with_the_next_sweep(r):
+    tasks = PageTasks(r, "crawler-1")
+    tasks.start_sweep(["tilburg", "utrecht"], 1)
+    tasks.exhaust("tilburg")
+
+    assert tasks.is_exhausted("tilburg")
+    assert not tasks.is_exhausted("utrecht")
+
+    for raw, _ in claim_all(tasks):
+        tasks.finish(raw)
+    tasks.start_sweep(["tilburg", "utrecht"], 1)
+    assert not tasks.is_exhausted("tilburg")
+
+
+def test_follow_up_is_claimed_next_and_keeps_the_sweep_running(r):
+    tasks = PageTasks(r, "crawler-1", "incremental")
+    tasks.start_sweep(["tilburg", "utrecht"], 1)
+    raw, task = tasks.claim(0.01)
+
+    assert tasks.finish(raw, {"region": task["region"], "page": 2}) == 2
+    assert tasks.claim(0.01)[1] == {"region": "tilburg", "page": 2}
+
+
+def test_high_water_mark_only_moves_once_the_region_is_done(r):
+    tasks = PageTasks(r, "crawler-1", "incremental")
+    tasks.propose_high_water("tilburg", "43000001")
+
+    assert tasks.high_water("tilburg") is None
+    tasks.commit_high_water("tilburg")
+    assert tasks.high_water("tilburg") == "43000001"
+    # nothing proposed since, the mark stays
+    tasks.commit_high_water("tilburg")
+    assert tasks.high_water("tilburg") == "43000001"
+
+
+def test_full_and_incremental_sweeps_are_kept_apart(r):
+    full = PageTasks(r, "crawler-1", "full")
+    incremental = PageTasks(r, "crawler-2", "incremental")
+
+    assert full.start_sweep(["tilburg"], 3) == 3
+    # an incremental sweep starts while the full sweep runs, and claims only its own tasks
+    assert incremental.start_sweep(["tilburg"], 1) == 1
+    full.exhaust("tilburg")
+    assert not incremental.is_exhausted("tilburg")
+
+    raw, task = incremental.claim(0.01)
+    assert task == {"region": "tilburg", "page": 1}
+    assert incremental.claim(0.01) is None
+    assert incremental.finish(raw) == 0
+    assert full.running()
+    assert all(full.claim(0.01) for _ in range(3))
+
+    incremental.propose_high_water("tilburg", "43000001")
+    incremental.commit_high_water("tilburg")
+    assert full.high_water("tilburg") == "43000001"
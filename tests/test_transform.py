@@ -0,0 +1,63 @@
+import pytest
+
+from datetime import date, datetime, timedelta
+
+from codec import encode
+from transform import TransformError, process_batch, process_listing, transform
+
+
+def test_transform(messages):
+    listing = transform(messages[0])
+
+    assert listing["scraped_at"] == datetime(2025, 8, 1, 12, 0, 0)
+    assert (listing["postcode"], listing["city"]) == ("5038 SH", "Tilburg")
+    assert (listing["total_rooms"], listing["bedrooms"]) == (3, 2)
+    assert listing["last_asking_price"] == 200000
+    assert listing["surface_area"] == 78
+    assert listing["listing_type"] == "Bovenwoning (appartement)"
+    assert listing["sell_duration"] == date(2024, 5, 2) - date(2024, 3, 12) == timedelta(days=51)
+    assert listing["building_year"] == date(1932, 1, 1)
+    assert listing["misc_data"]["Status"] == "Verkocht"
+    assert "Titel" not in listing["misc_data"] and "Looptijd" not in listing["misc_data"]
+
+
+@pytest.mark.parametrize("field, value", [
+    ("Laatste vraagprijs", "prijs op aanvraag"),
+    ("Verkoopdatum", "2 mei"),
+    ("Aantal kamers", ["3 kamers"]),
+    ("Postcode", {"postcode": "5038 SH"}),
+])
+def test_transform_names_the_field_it_cannot_parse(messages, field, value):
+    messages[0][field] = value
+
+    with pytest.raises(TransformError) as error:
+        transform(messages[0])
+    assert error.value.field == field
+
+
+def test_process_batch_matches_process_listing(messages):
+    del messages[1]["url"]
+    raws = [encode(message) for message in messages]
+
+    listings, failures = process_batch(raws)
+
+    assert listings == [process_listing(message) for message in messages]
+    assert listings[1] is None
+    assert failures == {1: ("input", "url", "missing")}
+
+
+def test_process_batch_fails_only_the_bad_messages(messages):
+    messages[2]["Laatste vraagprijs"] = "prijs op aanvraag"
+    messages[4]["Aantal kamers"] = ["3 kamers"]
+    messages[6]["Laatste vraagprijs"] = "€ 3.000.000.000 k.k."
+    raws = [encode(message) for message in messages] + [b"\x07 not a message"]
+
+    listings, failures = process_batch(raws)
+
+    assert failures == {
+        2: ("transform", "Laatste vraagprijs", "parse"),
+        4: ("transform", "Aantal kamers", "parse"),
+        6: ("output", "last_asking_price", "range"),
+        len(messages): ("input", "message", "decode"),
+    }
+    assert [i for i, listing in enumerate(listings) if listing is None] == sorted(failures)
@@ -0,0 +1,140 @@
+import psycopg
+import pytest
+
+from types import SimpleNamespace
+
+from codec import encode
+from transform import process_batch
+
+
+def fake_write(bad_ids=(), error=psycopg.DataError):
+    """A Writer.write that fails every batch holding one of `bad_ids`, recording the batch sizes"""
+    sizes = []
+
+    def write(listings: list[dict], upsert: bool = False):
+        sizes.append(len(listings))
+        if any(listing["funda_id"] in bad_ids for listing in listings):
+            return error("invalid byte sequence for encoding \"UTF8\": 0x00")
+        return None
+    return write, sizes
+
+
+@pytest.fixture
+def popped(writer, messages) -> list[tuple[bytes, dict]]:
+    """The (message, listing) batch of the messages, popped by the writer"""
+    writer.queue.push([encode(message) for message in messages])
+    raws, _ = writer.queue.pop_many(len(messages), 0.01)
+    listings, failures = process_batch(raws)
+    assert not failures
+    return list(zip(raws, listings))
+
+
+class CopyDataError(psycopg.DataError):
+    """A DataError with the diagnostics postgres sends for a bad COPY value"""
+    diag = SimpleNamespace(context="COPY listings_staging, line 3, column misc_data: \"{...}\"")
+
+
+def test_rejection_names_the_copy_column(writer_module):
+    assert writer_module.rejection(CopyDataError("invalid byte sequence")) == ("write", "misc_data", "CopyDataError")
+    assert writer_module.rejection(ValueError("2147483648 out of range")) == ("write", "", "ValueError")
+
+
+def test_write_isolating_bisects_down_to_the_rejected_listings(writer, popped):
+    bad = {popped[3][1]["funda_id"], popped[10][1]["funda_id"]}
+    writer.write, sizes = fake_write(bad)
+
+    rejected = writer.write_isolating(popped)
+
+    assert [raw for raw, _ in rejected] == [popped[3][0], popped[10][0]]
+    assert all(failure == ("write", "", "DataError") for _, failure in rejected)
+    # every listing but the rejected ones ends up in a batch that was written
+    assert sizes[0] == len(popped)
+    assert len(sizes) < 2 * len(popped)
+
+
+def test_write_isolating_gives_up_on_other_errors(writer, popped):
+    writer.write, sizes = fake_write({popped[0][1]["funda_id"]}, error=psycopg.OperationalError)
+
+    assert writer.write_isolating(popped) is None
+    assert sizes == [len(popped)]
+
+
+def test_flush_dead_letters_the_rejected_and_acknowledges_the_rest(writer, popped):
+    writer.write, _ = fake_write({popped[5][1]["funda_id"]})
+
+    writer.flush(popped)
+
+    (entries,) = writer.dead_letters.scan()
+    assert [(fields["data"], fields["stage"]) for _, fields in entries] == [(popped[5][0], "write")]
+    assert writer.queue.nack_lease() == 0
+    assert writer.queue.lag() == 0
+
+
+def test_flush_pushes_metrics_once(writer_module, writer, popped):
+    writer.write, sizes = fake_write({popped[1][1]["funda_id"], popped[7][1]["funda_id"]})
+
+    writer.flush(popped)
+
+    assert len(sizes) > 1
+    assert writer_module.push_to_gateway.call_count == 1
+
+
+def test_flush_backs_off_while_the_database_is_down(monkeypatch, writer_module, writer, popped):
+    delays = []
+    monkeypatch.setattr(writer_module, "sleep", delays.append)
+    writer.write, _ = fake_write({listing["funda_id"] for _, listing in popped}, error=psycopg.OperationalError)
+
+    for _ in range(8):
+        writer.flush(popped)
+        # the whole batch is back on the queue to be retried
+        raws, _ = writer.queue.pop_many(len(popped), 0.01)
+        assert sorted(raws) == sorted(raw for raw, _ in popped)
+
+    assert delays == [1, 2, 4, 8, 16, 32, 60, 60]
+
+    writer.write, _ = fake_write()
+    writer.flush(popped)
+    assert writer.failed_writes == 0
+    assert len(delays) == 8
+
+
+class Stop(BaseException):
+    """Ends Writer.listen, which catches every Exception"""
+
+
+def listen_once(writer):
+    """Runs one iteration of Writer.listen"""
+    pop_many = writer.queue.pop_many
+    calls = []
+
+    def pop_once(*args, **kwargs):
+        if calls:
+            raise Stop
+        calls.append(args)
+        return pop_many(*args, **kwargs)
+    writer.queue.pop_many = pop_once
+    with pytest.raises(Stop):
+        writer.listen()
+
+
+def test_listen_dead_letters_and_acknowledges_invalid_messages(writer, messages):
+    del messages[0]["url"]
+    writer.queue.push([encode(message) for message in messages[:1]])
+
+    listen_once(writer)
+
+    assert writer.dead_letters.depth() == 1
+    assert writer.queue.nack_lease() == 0
+
+
+def test_listen_retries_the_lease_when_dead_lettering_fails(writer, messages):
+    def unavailable(*args):
+        raise ConnectionError("redis is down")
+    writer.dead_letters.push = unavailable
+    del messages[0]["url"]
+    writer.queue.push([encode(message) for message in messages[:3]])
+
+    listen_once(writer)
+
+    assert writer.queue.nack_lease() == 0
+    assert writer.queue.lag() == 3